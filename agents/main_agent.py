@@ -3,67 +3,101 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 import sys
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import BaseTool
 
 
 # add services path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from services.agent_creator import creator_tools, SummarizeReviewsTool, CategorizeProductsTool
-from services.manage_sessions import get_or_create_session, load_messages, save_message 
+from services.manage_sessions import get_or_create_session, session_exists, load_messages, save_message
+from services.working_set import session_scope
 from services.rag_service import get_rag_chain
+from services.llm_clients import get_chat_model
+from services.prompts import AGENT_PROMPT
 
 load_dotenv()
 
 # ----------------------------
-# main system prompt
+# Cached resources
 # ----------------------------
-service_prompt = """
-تو یک دستیار هوش مصنوعی هستی که به کاربر کمک می‌کنی محصول مناسب خود را در دیجی‌کالا (گوشی‌های آیفون یا اپل واچ) پیدا کند.
-وظیفه تو این است که با پرسیدن سوالات دقیق و گام به گام، محصول موردنظر کاربر را بازیابی کنید و به سوالات خاصی در مورد آن پاسخ بدهی.
-
-قوانین:
-1. در هر لحظه فقط یک سوال بپرس و مکالمه را فعالانه هدایت کن.
-2. با پرسیدن محصول مورد نظر ('آیفون' یا 'اپل واچ') شروع کن.
-3. مکالمه را به طور فعال هدایت کنید.
-4. پس از تأیید محصول، از کاربر بخواه فیلترهای مورد نظرش (مثل رنگ یا محدوده قیمت) را اعلام کند.
-5. از کاربر بپرس که آیا نیاز به دانستن نظرات کاربران دارد یا خیر.
-6. از کاربر بپرس که آیا نیاز به مقایسه بین دو محصول را با استفاده از نظرات دارد یا خیر.
-7. از ابزارهای موجود (Tools) برای جستجوی داده‌ها و ارائه نتایج استفاده کن.
-8. نتایج را به صورت شفاف و کاربرپسند ارائه بده.
-"""
+# Streamlit re-runs this script on every interaction; the agent, its LLM client and
+# the RAG chain are built once per server process and shared by all browser sessions.
+@st.cache_resource(show_spinner=False)
+def get_agent_executor() -> AgentExecutor:
+    # load the RAG chain (FAISS index) now so the first search does not pay for it
+    get_rag_chain()
+
+    # LLM
+    llm = get_chat_model(temperature=0.7)
+
+    # create composite agent: tools + RAG
+    tools = creator_tools.copy()
+
+    agent = create_openai_tools_agent(llm, tools, AGENT_PROMPT)
+    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+
+
+def get_session_id() -> str:
+    """
+    One chat session per browser session. The id lives in st.session_state and in
+    the page URL (?session=...), so reruns and page reloads keep the same session
+    instead of creating a new row each time.
+    """
+    if "creator_session_id" not in st.session_state:
+        session_id = st.query_params.get("session")
+        if not session_id or not session_exists(session_id):
+            session_id = get_or_create_session("creator")
+        st.session_state.creator_session_id = session_id
+        st.query_params["session"] = session_id
+    return st.session_state.creator_session_id
+
+
+def _prepare_chat_history(messages, keep_last: int = 12, max_msg_len: int = 2000):
+    """Return a trimmed copy of messages: keep only the last `keep_last` messages.
+    Also truncate any very long message.content to `max_msg_len` characters.
+    """
+    if not messages:
+        return []
+
+    # take last N messages, plus the summary of archived history if there is one
+    summary = [m for m in messages[:1] if getattr(m, "type", None) == "system"]
+    trimmed = summary + messages[len(summary):][-keep_last:]
+
+    # create shallow copies with truncated content to avoid modifying session state
+    out = []
+    for m in trimmed:
+        try:
+            content = getattr(m, "content", str(m)) or ""
+        except Exception:
+            content = str(m)
+
+        if len(content) > max_msg_len:
+            content = content[:max_msg_len] + "\n\n...متن کوتاه شد (بخش طولانی حذف شد)"
+
+        # Preserve message type by recreating minimal message objects
+        if getattr(m, "type", None) == "human":
+            out.append(HumanMessage(content=content, type="human"))
+        elif getattr(m, "type", None) == "ai":
+            out.append(AIMessage(content=content, type="ai"))
+        elif getattr(m, "type", None) == "system":
+            out.append(SystemMessage(content=content))
+        else:
+            # fallback: keep as HumanMessage
+            out.append(HumanMessage(content=content, type="human"))
+
+    return out
 
 
 # ----------------------------
 # main Agent run function
 # ----------------------------
 def run_creator_mode():
-    session_id = get_or_create_session("creator")
-    
-    # load RAG chain
-    rag_chain = get_rag_chain()
-    
-    # LLM
-    llm = ChatOpenAI(model=os.getenv("MODEL", "gpt-4o-mini"), temperature=0.7)
-    
-    # Prompt agent
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", service_prompt),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad"),
-    ])
-    
-    # create composite agent: tools + RAG
-    tools = creator_tools.copy()
-    
-    agent = create_openai_tools_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
-    
-    # initialize chat messages
+    session_id = get_session_id()
+    agent_executor = get_agent_executor()
+
+    # initialize chat messages (loaded from the DB once per browser session)
     if "creator_messages" not in st.session_state:
         st.session_state.creator_messages = load_messages(session_id) or []
         if not st.session_state.creator_messages:
@@ -72,9 +106,10 @@ def run_creator_mode():
             st.session_state.creator_messages.append(ai_msg)
             save_message(session_id, "ai", initial_msg)
     
-    # show previous messages
+    # show previous messages (the archived-history summary is for the agent only)
     for msg in st.session_state.creator_messages:
-        st.chat_message(msg.type).write(msg.content)
+        if msg.type != "system":
+            st.chat_message(msg.type).write(msg.content)
     
     # get input from user
     if user_input := st.chat_input("پاسخ شما..."):
@@ -83,45 +118,14 @@ def run_creator_mode():
         save_message(session_id, "human", user_input)
         st.chat_message("human").write(user_input)
         
-        def _prepare_chat_history(messages, keep_last: int = 12, max_msg_len: int = 2000):
-            """Return a trimmed copy of messages: keep only the last `keep_last` messages.
-            Also truncate any very long message.content to `max_msg_len` characters.
-            """
-            if not messages:
-                return []
-
-            # take last N messages
-            trimmed = messages[-keep_last:]
-
-            # create shallow copies with truncated content to avoid modifying session state
-            out = []
-            for m in trimmed:
-                try:
-                    content = getattr(m, "content", str(m)) or ""
-                except Exception:
-                    content = str(m)
-
-                if len(content) > max_msg_len:
-                    content = content[:max_msg_len] + "\n\n...متن کوتاه شد (بخش طولانی حذف شد)"
-
-                # Preserve message type by recreating minimal message objects
-                if getattr(m, "type", None) == "human":
-                    out.append(HumanMessage(content=content, type="human"))
-                elif getattr(m, "type", None) == "ai":
-                    out.append(AIMessage(content=content, type="ai"))
-                else:
-                    # fallback: keep as HumanMessage
-                    out.append(HumanMessage(content=content, type="human"))
-
-            return out
-
         with st.spinner("Agent در حال پردازش..."):
             # run agent with a trimmed chat_history to avoid exceeding model context length
             safe_history = _prepare_chat_history(st.session_state.creator_messages, keep_last=12, max_msg_len=2000)
-            response = agent_executor.invoke({
-                "input": user_input,
-                "chat_history": safe_history
-            })
+            with session_scope(session_id):
+                response = agent_executor.invoke({
+                    "input": user_input,
+                    "chat_history": safe_history
+                })
         
         raw_output = response.get("output") or response.get("result") or response
 
@@ -1,20 +1,29 @@
 # api_server.py
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from services.agent_creator import creator_tools
 from services.manage_sessions import get_or_create_session, load_messages, save_message
 from services.rag_service import get_rag_chain
+from services.intent_router import route_message, get_router_stats
+from services.llm_clients import get_chat_model, get_prompt_cache_stats
+from services.prompts import AGENT_PROMPT
+from services.admission import admission, admission_key, Overloaded, get_admission_stats
+from services.message_archive import start_compaction_thread
+from services.working_set import session_scope, get_working_set_stats
+from services.prefetch import get_prefetch_stats
+from services.context_builder import get_context_stats
+from services.profiling import install_profiling
+from services.batch_service import parse_items, run_batch_jsonl, admit_batch, BatchInputError, MODES as BATCH_MODES
 
 load_dotenv()
 
@@ -29,6 +38,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in tracemalloc / CPU sampling and /admin/profiling endpoints (PROFILING_ENABLED=1)
+install_profiling(app)
+
+# Archive idle sessions' messages in the background (MESSAGE_COMPACTION_INTERVAL)
+@app.on_event("startup")
+def start_message_compaction():
+    start_compaction_thread()
+
 # ----------------------------
 #  Pydantic
 # ----------------------------
@@ -42,42 +59,28 @@ class ChatResponse(BaseModel):
     history: List[dict]  # [{'type': 'human'/'ai', 'content': '...'}]
 
 # ----------------------------
-# Prompt 
-# ----------------------------
-service_prompt = """
-تو یک دستیار هوش مصنوعیهستی که به کاربر کمک می‌کنی محصول مناسب خود را در دیجی‌کالا (گوشی‌های آیفون یا اپل واچ) پیدا کند.
-وظیفه تو این است که با پرسیدن سوالات دقیق و گام به گام، محصول موردنظر کاربر را بازیابی کنید و به سوالات خاصی در مورد آن پاسخ بدهی.
-
-قوانین:
-1. در هر لحظه فقط یک سوال بپرس و مکالمه را فعالانه هدایت کن.
-2. با پرسیدن محصول مورد نظر ('آیفون' یا 'اپل واچ') شروع کن.
-3. مکالمه را به طور فعال هدایت کنید.
-4. پس از تأیید محصول، از کاربر بخواه فیلترهای مورد نظرش (مثل رنگ یا محدوده قیمت) را اعلام کند.
-5. از کاربر بپرس که آیا نیاز به دانستن نظرات کاربران دارد یا خیر.
-6. از کاربر بپرس که آیا نیاز به مقایسه بین دو محصول را با استفاده از نظرات دارد یا خیر.
-7. از ابزارهای موجود (Tools) برای جستجوی داده‌ها و ارائه نتایج استفاده کن.
-8. نتایج را به صورت شفاف و کاربرپسند ارائه بده.
-"""
-
-# ----------------------------
-#  Agent ,AgentExecutor
+# Agent ,AgentExecutor
 # ----------------------------
-llm = ChatOpenAI(model=os.getenv("MODEL", "gpt-4o-mini"), temperature=0.7)
-prompt = ChatPromptTemplate.from_messages([
-    ("system", service_prompt),
-    MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "{input}"),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
+# shared prompt (static system prompt first) so provider prompt caching applies
+llm = get_chat_model(temperature=0.7)
 tools = creator_tools.copy()
-agent = create_openai_tools_agent(llm, tools, prompt)
+agent = create_openai_tools_agent(llm, tools, AGENT_PROMPT)
 agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=False)
 
 # ----------------------------
 # Endpoint /chat
 # ----------------------------
+def _busy(e: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=f"Server is busy ({e.reason}); please retry later.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(data: ChatRequest = Body(...)):
+def chat_endpoint(request: Request, data: ChatRequest = Body(...)):
+    # anonymous callers share a fairness key per client address, not a fresh session each
+    fairness_key = admission_key(data.session_id, request.client.host if request.client else None)
     # session
     session_id = data.session_id or get_or_create_session("api_session")
     chat_history = load_messages(session_id) or []
@@ -85,14 +88,22 @@ def chat_endpoint(data: ChatRequest = Body(...)):
     
     human_msg = HumanMessage(content=data.message, type="human")
     chat_history.append(human_msg)
-    save_message(session_id, "human", data.message)
 
-    # Run agent
-    response = agent_executor.invoke({
-        "input": data.message,
-        "chat_history": chat_history
-    })
-    ai_text = response.get("output") or response.get("result") or str(response)
+    # Greetings and simple lookups are answered without the agent
+    route, ai_text = route_message(data.message)
+    if ai_text is None:
+        # Run agent within the admission limits; shed requests get 503/429 + Retry-After
+        try:
+            # tools see the session through session_scope and reuse its earlier products
+            with admission.slot(fairness_key), session_scope(session_id):
+                response = agent_executor.invoke({
+                    "input": data.message,
+                    "chat_history": chat_history
+                })
+        except Overloaded as e:
+            raise _busy(e)
+        ai_text = response.get("output") or response.get("result") or str(response)
+    save_message(session_id, "human", data.message)
 
    
     #add response to history
@@ -112,6 +123,69 @@ def chat_endpoint(data: ChatRequest = Body(...)):
         history=history_serializable
     )
 
+# ----------------------------
+# Endpoint /chat/batch
+# ----------------------------
+# Stateless bulk questions (JSONL in, JSONL out): batched retrieval, bounded concurrent LLM calls
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: Request, mode: str = "rag", k: Optional[int] = None):
+    if mode not in BATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(BATCH_MODES)}")
+    body = (await request.body()).decode("utf-8")
+    try:
+        items = parse_items(body.splitlines())
+    except BatchInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # LLM calls share the admission limit with /chat; refuse new batches while it is overloaded
+    try:
+        admit_batch(mode)
+    except Overloaded as e:
+        raise _busy(e)
+    # the generator is synchronous, so Starlette iterates it in its thread pool
+    return StreamingResponse(run_batch_jsonl(items, mode=mode, k=k), media_type="application/x-ndjson")
+
+# ----------------------------
+# Endpoint /router/stats
+# ----------------------------
+@app.get("/router/stats")
+def router_stats_endpoint():
+    return get_router_stats()
+
+# ----------------------------
+# Endpoint /admission/stats
+# ----------------------------
+@app.get("/admission/stats")
+def admission_stats_endpoint():
+    return get_admission_stats()
+
+# ----------------------------
+# Endpoint /prompt-cache/stats
+# ----------------------------
+@app.get("/prompt-cache/stats")
+def prompt_cache_stats_endpoint():
+    return get_prompt_cache_stats()
+
+# ----------------------------
+# Endpoint /working-set/stats
+# ----------------------------
+@app.get("/working-set/stats")
+def working_set_stats_endpoint():
+    return get_working_set_stats()
+
+# ----------------------------
+# Endpoint /prefetch/stats
+# ----------------------------
+@app.get("/prefetch/stats")
+def prefetch_stats_endpoint():
+    return get_prefetch_stats()
+
+# ----------------------------
+# Endpoint /context/stats
+# ----------------------------
+@app.get("/context/stats")
+def context_stats_endpoint():
+    return get_context_stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("api_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,15 @@
+# gunicorn.conf.py
+# Multi-process deployment that shares the FAISS indexes between workers:
+#   gunicorn -c gunicorn.conf.py api_server:app
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+# The master imports the app (and loads the indexes) once before forking, so
+# workers share those pages copy-on-write instead of each loading a copy.
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+if preload_app:
+    os.environ.setdefault("PRELOAD_INDEXES", "1")
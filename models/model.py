@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Date, Float, Boolean, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -11,6 +11,66 @@ Base = declarative_base()
 # SQLAlchemy Models
 # -----------------------------
 
+class PRODUCTS(Base):
+    """All catalog products; `category` is a key of services.category_registry.CATEGORIES."""
+    __tablename__ = 'products'
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, unique=True, index=True)
+    category = Column(String, nullable=False)
+    title_fa = Column(String)
+    relative_url = Column(Text)
+    selling_price = Column(Integer)
+    specifications = Column(Text)
+    reviews_text = Column(Text)
+
+    colors = relationship("PRODUCT_COLORS", back_populates="product", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        Index("ix_products_category_price", "category", "selling_price"),
+    )
+
+
+class PRODUCT_COLORS(Base):
+    __tablename__ = 'product_colors'
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.product_id"), index=True)
+    title = Column(Text)
+
+    product = relationship("PRODUCTS", back_populates="colors")
+
+    __table_args__ = (
+        UniqueConstraint("product_id", "title", name="uq_product_colors_product_title"),
+    )
+
+
+class PRICE_HISTORY(Base):
+    """Append-only price observations; a row is written only when the price changes."""
+    __tablename__ = 'price_history'
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, nullable=False)
+    price = Column(Integer)
+    recorded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # serves both "latest price per product" and "price at time T"
+        Index("ix_price_history_product_time", "product_id", "recorded_at"),
+    )
+
+
+class PRICE_DAILY(Base):
+    """Daily min/max/last rollup of price_history, one row per product and day with a change."""
+    __tablename__ = 'price_daily'
+    product_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    min_price = Column(Integer)
+    max_price = Column(Integer)
+    last_price = Column(Integer)
+
+
+# -----------------------------
+# Legacy per-category tables (read only by scripts/migrate_catalog.py)
+# -----------------------------
+
 class IPHONE_PRODUCTS(Base):
     __tablename__ = 'iphones'
     id = Column(Integer, primary_key=True, index=True)
@@ -55,6 +115,70 @@ class WATCH_COLORS(Base):
     watch = relationship("WATCH_PRODUCTS", back_populates="colors")
 
 
+class SPEC_ATTRIBUTES(Base):
+    """One row per (product, specification attribute), filled at ingest from the
+    Digikala `specifications` JSON so attribute predicates can be answered with SQL."""
+    __tablename__ = 'spec_attributes'
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, nullable=False)
+    category = Column(String, index=True)
+    group_title = Column(String)
+    attribute = Column(String, nullable=False)   # canonical key, e.g. 'storage'
+    title = Column(String)                       # original Persian attribute title
+    value = Column(Text)                         # raw value as shown on Digikala
+    value_text = Column(String)                  # normalized text (latin digits, lowercase)
+    value_num = Column(Float)                    # normalized number in `unit`, if any
+    unit = Column(String)
+
+    __table_args__ = (
+        Index("ix_spec_attributes_product_attribute", "product_id", "attribute"),
+        Index("ix_spec_attributes_attribute_num", "attribute", "value_num"),
+        Index("ix_spec_attributes_attribute_text", "attribute", "value_text"),
+    )
+
+
+class PRODUCT_REVIEWS(Base):
+    """One row per Digikala comment; `comment_id` deduplicates re-crawls."""
+    __tablename__ = 'reviews'
+    id = Column(Integer, primary_key=True, index=True)
+    comment_id = Column(Integer, unique=True, nullable=False)
+    product_id = Column(Integer, nullable=False)
+    category = Column(String)
+    rate = Column(Integer)
+    is_buyer = Column(Boolean, default=False)
+    title = Column(String)
+    body = Column(Text)
+    likes = Column(Integer, default=0)
+    created_at = Column(String)                  # as returned by Digikala (Jalali date text)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_reviews_product_rank", "product_id", "is_buyer", "likes"),
+    )
+
+
+class CRAWL_JOBS(Base):
+    """Checkpoint of the detail/review crawl: one row per (product, endpoint) with its
+    state, attempt count and retry time, claimed by one collector process at a time."""
+    __tablename__ = 'crawl_jobs'
+    id = Column(Integer, primary_key=True, index=True)
+    category = Column(String, nullable=False)
+    product_id = Column(Integer, nullable=False)
+    endpoint = Column(String, nullable=False)    # 'details' | 'reviews'
+    status = Column(String, nullable=False, default="pending")  # pending | running | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime)           # earliest retry of a failed job
+    claimed_by = Column(String)                  # host:pid of the collector working on it
+    claimed_at = Column(DateTime)
+    last_error = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("product_id", "endpoint", name="uq_crawl_jobs_product_endpoint"),
+        Index("ix_crawl_jobs_category_status", "category", "status", "next_attempt_at"),
+    )
+
+
 # class Session(Base):
 #     __tablename__ = 'sessions'
 #     id = Column(Integer, primary_key=True)
@@ -97,6 +221,10 @@ class Session(Base):
 
     session_id = Column(String, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    last_active_at = Column(DateTime, default=datetime.utcnow, index=True)  # drives retention
+    message_count = Column(Integer, default=0)   # live rows in `messages`
+    summary = Column(Text)                       # rolling summary of the messages moved to the archive
+    working_set = Column(Text)                   # JSON: products retrieved in this session (services/working_set.py)
 
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
@@ -110,4 +238,23 @@ class Message(Base):
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-    session = relationship("Session", back_populates="messages")
\ No newline at end of file
+    session = relationship("Session", back_populates="messages")
+
+    __table_args__ = (
+        # per-turn history: the last N messages of one session
+        Index("ix_messages_session_time", "session_id", "timestamp", "id"),
+    )
+
+
+class MESSAGE_ARCHIVE(Base):
+    """Compacted history of a session: its messages as one compressed JSON blob,
+    moved out of `messages` when the session went idle or grew past the live window."""
+    __tablename__ = "messages_archive"
+
+    session_id = Column(String, primary_key=True)
+    message_count = Column(Integer, default=0)
+    first_at = Column(DateTime)
+    last_at = Column(DateTime, index=True)       # drives archive retention
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    codec = Column(String, default="zlib")
+    payload = Column(LargeBinary)                # [{sender_type, content, timestamp}, ...]
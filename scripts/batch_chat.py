@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# add project directory to sys.path so local modules can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.batch_service import parse_items, run_batch, MODES
+
+
+# ==========================
+# Main
+# ==========================
+def main():
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of questions in-process, the same way POST /chat/batch does."
+    )
+    parser.add_argument("input", help='JSONL file: {"id": ..., "question": ...} per line ("-" for stdin)')
+    parser.add_argument("-o", "--output", help="JSONL results file (default: stdout)")
+    parser.add_argument("--mode", choices=MODES, default="rag", help="rag = retrieve + answer, retrieve = documents only")
+    parser.add_argument("--k", type=int, help="documents per question (BATCH_TOP_K)")
+    parser.add_argument("--concurrency", type=int, help="LLM calls in flight (BATCH_LLM_CONCURRENCY)")
+    parser.add_argument("--chunk-size", type=int, help="questions embedded and searched together (BATCH_CHUNK_SIZE)")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    with source:
+        items = parse_items(source)
+    print(f"📥 {len(items)} questions, mode={args.mode}", file=sys.stderr)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    started = time.perf_counter()
+    done = errors = 0
+    llm_ms = []
+    try:
+        for result in run_batch(items, mode=args.mode, k=args.k, concurrency=args.concurrency,
+                                chunk_size=args.chunk_size):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            errors += "error" in result
+            if "llm_ms" in result:
+                llm_ms.append(result["llm_ms"])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {done} answered ({errors} errors) in {elapsed:.1f}s, {done / elapsed:.1f} questions/s", file=sys.stderr)
+    if llm_ms:
+        llm_ms.sort()
+        print(f"   LLM p50 {llm_ms[len(llm_ms) // 2]:.0f} ms, p95 {llm_ms[int(len(llm_ms) * 0.95)]:.0f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# ==========================
+# Throwaway database
+# ==========================
+# must be set before services.manage_sessions creates its engine
+parser = argparse.ArgumentParser(description="History lookup and archiving cost of the messages table.")
+parser.add_argument("--messages", type=int, default=1_000_000, help="messages in the table")
+parser.add_argument("--sessions", type=int, default=50_000, help="sessions they are spread over")
+parser.add_argument("--lookups", type=int, default=500, help="load_messages calls timed per variant")
+parser.add_argument("--archive", type=int, default=200, help="sessions archived by the archive_session timing")
+parser.add_argument("--db", help="SQLite file to build (default: a temporary file, deleted afterwards)")
+args = parser.parse_args()
+
+db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench-messages-"), "messages.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+# add project directory to sys.path so local modules can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text
+from models.model import Message
+from services.manage_sessions import engine, SessionLocal, init_db, load_messages
+from services.message_archive import archive_session
+
+
+def build(messages: int, sessions: int) -> list:
+    """Fill sessions/messages with `messages` rows over `sessions` sessions, interleaved like live traffic."""
+    init_db()
+    start = datetime(2025, 1, 1)
+    session_ids = [f"bench-{i:07d}" for i in range(sessions)]
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO sessions (session_id, created_at, last_active_at, message_count) "
+                          "VALUES (:sid, :at, :at, :n)"),
+                     [{"sid": sid, "at": start, "n": 0} for sid in session_ids])
+        batch = []
+        for i in range(messages):
+            batch.append({"sid": session_ids[random.randrange(sessions)], "type": "human" if i % 2 == 0 else "ai",
+                          "content": f"پیام شماره {i} درباره آیفون ۱۵ پرو", "at": start + timedelta(seconds=i)})
+            if len(batch) == 50_000:
+                conn.execute(text("INSERT INTO messages (session_id, sender_type, content, timestamp) "
+                                  "VALUES (:sid, :type, :content, :at)"), batch)
+                batch = []
+        if batch:
+            conn.execute(text("INSERT INTO messages (session_id, sender_type, content, timestamp) "
+                              "VALUES (:sid, :type, :content, :at)"), batch)
+        conn.execute(text("UPDATE sessions SET message_count = "
+                          "(SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.session_id)"))
+    return session_ids
+
+
+def time_lookups(session_ids: list, n: int) -> float:
+    """Milliseconds per load_messages call over `n` random sessions."""
+    picks = [random.choice(session_ids) for _ in range(n)]
+    started = time.perf_counter()
+    for sid in picks:
+        load_messages(sid)
+    return (time.perf_counter() - started) * 1000 / n
+
+
+def main():
+    random.seed(0)
+    print(f"📏 Building {args.messages:,} messages over {args.sessions:,} sessions in {db_path} ...")
+    started = time.perf_counter()
+    session_ids = build(args.messages, args.sessions)
+    print(f"  built in {time.perf_counter() - started:.0f}s")
+
+    with_index = time_lookups(session_ids, args.lookups)
+    index = next(i for i in Message.__table__.indexes if i.name == "ix_messages_session_time")
+    index.drop(bind=engine)
+    without_index = time_lookups(session_ids, max(args.lookups // 10, 10))
+    index.create(bind=engine)
+    print(f"  load_messages         {with_index:8.2f} ms per call with ix_messages_session_time")
+    print(f"  load_messages         {without_index:8.2f} ms per call without it")
+
+    db = SessionLocal()
+    try:
+        picks = random.sample(session_ids, min(args.archive, len(session_ids)))
+        started = time.perf_counter()
+        moved = 0
+        for sid in picks:
+            moved += archive_session(db, sid)
+            db.commit()
+        elapsed = (time.perf_counter() - started) * 1000
+    finally:
+        db.close()
+    print(f"  archive_session       {elapsed / len(picks):8.2f} ms per session "
+          f"({moved / len(picks):.0f} messages each, one commit per session)")
+
+    if not args.db:
+        os.remove(db_path)
+        os.rmdir(os.path.dirname(db_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import argparse
+
+# add project directory to sys.path so local modules can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.text_normalizer import normalize_chars, normalize_text, tokenize, canonical_color
+
+# ==========================
+# Inputs
+# ==========================
+QUERIES = [
+    "آيفون ۱۵ پرو‌مکس ۲۵۶ گيگ", "قیمت اپل واچ سری ۹ چنده", "iPhone 15 Pro Max مشکی",
+    "یک گوشی با دوربین خوب زیر ۴۰ میلیون", "رنگ‌های اپل واچ اولترا", "ساعت هوشمند ٤٥ ميلي‌متري",
+    "نظر کاربران درباره باتری آیفون ۱۴", "گوشی موبایل اپل مدل iPhone 13 ظرفیت 128 گیگابایت",
+]
+COLORS = ["مشکی", "Black", "سیاه", "نقره‌ای", "Space Gray", "طلايي", "آبی", "ارغوانی"]
+
+
+def bench(fn, inputs, n: int) -> float:
+    """Strings per second of `fn` over `n` calls cycling through `inputs`."""
+    batch = [f"{inputs[i % len(inputs)]} {i % 97}" for i in range(n)] if fn is not canonical_color \
+        else [inputs[i % len(inputs)] for i in range(n)]
+    started = time.perf_counter()
+    for text in batch:
+        fn(text)
+    return n / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the Persian text normalizer.")
+    parser.add_argument("--n", type=int, default=200_000, help="strings per function")
+    args = parser.parse_args()
+
+    print(f"📏 {args.n} strings per function")
+    for fn, inputs in ((normalize_chars, QUERIES), (normalize_text, QUERIES), (tokenize, QUERIES),
+                       (canonical_color, COLORS)):
+        rate = bench(fn, inputs, args.n)
+        print(f"  {fn.__name__:<16} {rate:12,.0f} strings/s  {1_000_000 / rate:6.2f} s per million")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# add project directory to sys.path so local modules can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.retrieval_client import RETRIEVAL_SERVICE_URL, remote_search, remote_stats
+
+# ==========================
+# Queries
+# ==========================
+QUERIES = [
+    "آیفون ۱۵ پرو مکس", "آیفون سفید ارزان", "اپل واچ سری ۹", "اپل واچ اولترا",
+    "گوشی با دوربین خوب", "باتری قوی", "ساعت هوشمند ورزشی", "آیفون ۱۳ ۱۲۸ گیگ",
+    "iphone 15 pro", "apple watch se", "آیفون مشکی", "صفحه نمایش بزرگ",
+]
+
+
+def run(concurrency: int, requests_per_level: int, index: str) -> float:
+    """Queries per second at the given number of concurrent callers."""
+    queries = [f"{QUERIES[i % len(QUERIES)]} {i}" for i in range(requests_per_level)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda q: remote_search(q, k=10, index=index), queries))
+    return requests_per_level / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the retrieval service versus concurrency.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--index", default="product", choices=["product", "review"])
+    args = parser.parse_args()
+
+    if not RETRIEVAL_SERVICE_URL:
+        print("❌ Set RETRIEVAL_SERVICE_URL to the running retrieval service.")
+        return
+
+    print(f"📏 {RETRIEVAL_SERVICE_URL} ({args.index} index, {args.requests} requests per level)")
+    for concurrency in args.concurrency:
+        before = remote_stats().get(args.index, {})
+        qps = run(concurrency, args.requests, args.index)
+        after = remote_stats().get(args.index, {})
+        batches = after.get("batches", 0) - before.get("batches", 0)
+        queries = after.get("queries", 0) - before.get("queries", 0)
+        avg_batch = queries / batches if batches else 0.0
+        print(f"  concurrency={concurrency:>3}  {qps:8.1f} queries/s  avg batch {avg_batch:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
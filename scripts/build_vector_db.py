@@ -1,115 +1,176 @@
 import os
 import sys
+import time
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.schema import Document  # fix import path for Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
 load_dotenv()
 # add project directory to sys.path so local modules can be imported
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from databases.database import SessionLocal
-from models.model import IPHONE_PRODUCTS, WATCH_PRODUCTS
+from sqlalchemy import func
+from databases.database import SessionLocal, engine
+from models.model import PRODUCTS, PRODUCT_COLORS, PRODUCT_REVIEWS
+from services.category_registry import CATEGORIES
+from services.vector_index import build_vector_store, save_vector_store, FAISS_INDEX_TYPE
+from services.spec_service import specs_to_text
+from services.text_normalizer import normalize_chars
+from services.embedding_backends import get_embedding_backend, EMBEDDING_BACKEND
 
 load_dotenv()
 
 # directory where the vector database will be saved
 VECTOR_DIR = os.getenv("VECTOR_DIR", "vectorstore")
 FAISS_INDEX_PATH = os.path.join(VECTOR_DIR, "faiss_index")
-
-
-def build_vector_db():
+FAISS_REVIEW_INDEX_PATH = os.path.join(VECTOR_DIR, "faiss_review_index")
+REVIEW_CHUNK_CHARS = int(os.getenv("REVIEW_CHUNK_CHARS", "500"))
+REVIEW_CHUNK_OVERLAP = int(os.getenv("REVIEW_CHUNK_OVERLAP", "50"))
+# index type for the (much larger) review index; defaults to FAISS_INDEX_TYPE
+FAISS_REVIEW_INDEX_TYPE = os.getenv("FAISS_REVIEW_INDEX_TYPE", FAISS_INDEX_TYPE)
+# rows fetched per round-trip while streaming products/reviews
+READ_BATCH_SIZE = int(os.getenv("READ_BATCH_SIZE", "1000"))
+# print recall/latency of the approximate index against exact search after building
+FAISS_EVALUATE = os.getenv("FAISS_EVALUATE", "0") == "1"
+
+
+def _string_agg(column, separator):
+    """Dialect-portable string aggregate (string_agg on PostgreSQL, group_concat elsewhere)."""
+    if engine.dialect.name == "postgresql":
+        return func.string_agg(column, separator)
+    if engine.dialect.name == "mysql":
+        # MySQL's two-argument GROUP_CONCAT concatenates instead of separating
+        return func.group_concat(column)
+    return func.group_concat(column, separator)
+
+
+def iter_product_rows(db, categories=None):
+    """
+    Stream lightweight product tuples with their colors already aggregated in SQL:
+    one query instead of one lazy `p.colors` load per product, and no ORM
+    instances kept alive while the index is built.
+    """
+    query = db.query(
+        PRODUCTS.id,
+        PRODUCTS.product_id,
+        PRODUCTS.category,
+        PRODUCTS.title_fa,
+        PRODUCTS.relative_url,
+        PRODUCTS.selling_price,
+        PRODUCTS.specifications,
+        _string_agg(PRODUCT_COLORS.title, ", ").label("colors"),
+    ).outerjoin(PRODUCT_COLORS, PRODUCT_COLORS.product_id == PRODUCTS.product_id)\
+     .group_by(PRODUCTS.id)
+    if categories:
+        query = query.filter(PRODUCTS.category.in_(categories))
+    return query.order_by(PRODUCTS.id).yield_per(READ_BATCH_SIZE)
+
+
+def build_vector_db(categories=None):
     db = SessionLocal()
     try:
-        # --- fetch products ---
-        iphones = db.query(IPHONE_PRODUCTS).all()
-        watches = db.query(WATCH_PRODUCTS).all()
-
-        if not iphones and not watches:
-            print("❌ No products in database.")
-            return
-
         documents = []
+        started = time.perf_counter()
 
-        # --- process iPhones ---
-        for p in iphones:
-            colors = [c.title for c in p.colors] if p.colors else []
-            color_text = ", ".join(colors) if colors else "Unknown"
-            specs_text = p.specifications or "Unknown"
-            reviews_text = p.reviews_text or "None"
-            price_text = f"{p.selling_price:,} تومان" if p.selling_price else "Unknown"
+        # --- stream products (all registered categories unless restricted) ---
+        for row in iter_product_rows(db, categories):
+            cfg = CATEGORIES.get(row.category)
+            label = cfg.label if cfg else row.category
+            # rows collected before normalization may still carry Arabic letters / Persian digits
+            color_text = normalize_chars(row.colors) or "Unknown"
+            specs_text = normalize_chars(specs_to_text(row.specifications)) or "Unknown"
+            price_text = f"{row.selling_price:,} تومان" if row.selling_price else "Unknown"
 
             doc = Document(
                 page_content=(
-                    f"Category: iPhone\n"
-                    f"Product name: {p.title_fa}\n"
+                    f"Category: {label}\n"
+                    f"Product name: {normalize_chars(row.title_fa)}\n"
                     f"Price: {price_text}\n"
                     f"Colors: {color_text}\n"
-                    f"Specifications: {specs_text}\n"
-                    f"Reviews: {reviews_text}"
+                    f"Specifications: {specs_text}"
                 ),
                 metadata={
-                    "id": p.id,
+                    "id": row.id,
                     "Price": price_text,
                     "Colors": color_text,
                     "Specifications": specs_text,
-                    "product_id": p.product_id,
-                    "category": "iphone",
-                    "url": p.relative_url,
+                    "product_id": row.product_id,
+                    "category": row.category,
+                    "url": row.relative_url,
                 },
             )
             documents.append(doc)
 
-        # --- process Watches ---
-        for p in watches:
-            colors = [c.title for c in p.colors] if p.colors else []
-            color_text = ", ".join(colors) if colors else "Unknown"
-            specs_text = p.specifications or "Unknown"
-            reviews_text = p.reviews_text or "None"
-            price_text = f"{p.selling_price:,} تومان" if p.selling_price else "Unknown"
-
-            doc = Document(
-                page_content=(
-                    f"Category: Watch\n"
-                    f"Product name: {p.title_fa}\n"
-                    f"Price: {price_text}\n"
-                    f"Colors: {color_text}\n"
-                    f"Specifications: {specs_text}\n"
-                    f"Reviews: {reviews_text}"
-                ),
-                metadata={
-                    "id": p.id,
-                    "Price": price_text,
-                    "Colors": color_text,
-                    "Specifications": specs_text,
-                    "product_id": p.product_id,
-                    "category": "watch",
-                    "url": p.relative_url,
-                },
-            )
-            documents.append(doc)
+        if not documents:
+            print("❌ No products in database.")
+            return
+        print(f"⏱️ Read {len(documents)} products in {time.perf_counter() - started:.2f}s")
 
-        # --- create embeddings ---
-        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+        # --- create embeddings (EMBEDDING_BACKEND: openai or local) ---
+        embeddings = get_embedding_backend()
+        print(f"🧮 Embedding backend: {EMBEDDING_BACKEND}")
 
-        # --- build vector DB with FAISS ---
-        vector_store = FAISS.from_documents(
-            documents=documents,
-            embedding=embeddings,
-        )
+        # --- build vector DB with FAISS (index type from FAISS_INDEX_TYPE) ---
+        vector_store = build_vector_store(documents, embeddings, evaluate=FAISS_EVALUATE)
 
         # save to local path
         os.makedirs(VECTOR_DIR, exist_ok=True)
-        vector_store.save_local(FAISS_INDEX_PATH)
+        save_vector_store(vector_store, FAISS_INDEX_PATH, embeddings)
 
         print(f"✅ Vector DB built successfully and saved to '{FAISS_INDEX_PATH}'")
         print(f"📦 Documents count: {len(documents)}")
 
+        # --- review-level index (one vector per review chunk) ---
+        build_review_vector_db(db, embeddings, categories)
+
     except Exception as e:
         print(f"❌ Error building vector DB: {e}")
     finally:
         db.close()
 
 
+def build_review_vector_db(db, embeddings, categories=None):
+    """
+    Build the second FAISS index from individual reviews, chunked so long
+    comments stay within embedding input limits. Each chunk keeps `product_id`
+    so retrieval can aggregate matches back to products.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=REVIEW_CHUNK_CHARS, chunk_overlap=REVIEW_CHUNK_OVERLAP)
+    rows = db.query(
+        PRODUCT_REVIEWS.comment_id,
+        PRODUCT_REVIEWS.product_id,
+        PRODUCT_REVIEWS.category,
+        PRODUCT_REVIEWS.rate,
+        PRODUCT_REVIEWS.is_buyer,
+        PRODUCT_REVIEWS.body,
+    ).filter(PRODUCT_REVIEWS.body.isnot(None))
+    if categories:
+        rows = rows.filter(PRODUCT_REVIEWS.category.in_(categories))
+    rows = rows.yield_per(READ_BATCH_SIZE)
+
+    documents = []
+    for comment_id, product_id, category, rate, is_buyer, body in rows:
+        for chunk in splitter.split_text(normalize_chars(body)):
+            documents.append(Document(
+                page_content=chunk,
+                metadata={
+                    "comment_id": comment_id,
+                    "product_id": product_id,
+                    "category": category,
+                    "rate": rate,
+                    "is_buyer": bool(is_buyer),
+                },
+            ))
+
+    if not documents:
+        print("ℹ️ No reviews in database, skipping review index.")
+        return
+
+    review_store = build_vector_store(documents, embeddings, index_type=FAISS_REVIEW_INDEX_TYPE, evaluate=FAISS_EVALUATE)
+    save_vector_store(review_store, FAISS_REVIEW_INDEX_PATH, embeddings)
+    print(f"✅ Review vector DB saved to '{FAISS_REVIEW_INDEX_PATH}'")
+    print(f"📦 Review chunks count: {len(documents)}")
+
+
 if __name__ == "__main__":
-    build_vector_db() 
+    # optional category names on the command line, e.g. `python scripts/build_vector_db.py iphone`
+    build_vector_db(sys.argv[1:] or None)
@@ -0,0 +1,32 @@
+import os
+import sys
+import json
+import argparse
+
+# add project directory to sys.path so local modules can be imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import message_archive
+from services.message_archive import compact_messages
+
+
+# ==========================
+# Main
+# ==========================
+def main():
+    parser = argparse.ArgumentParser(description="Archive idle chat sessions and trim long ones (for cron).")
+    parser.add_argument("--retention-days", type=float, help="override MESSAGE_RETENTION_DAYS")
+    parser.add_argument("--live-window", type=int, help="override MESSAGE_LIVE_WINDOW")
+    args = parser.parse_args()
+
+    if args.retention_days is not None:
+        message_archive.MESSAGE_RETENTION_DAYS = args.retention_days
+    if args.live_window is not None:
+        message_archive.MESSAGE_LIVE_WINDOW = args.live_window
+
+    print("🗜️ Compacting chat messages...")
+    stats = compact_messages()
+    print(f"✅ Done: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
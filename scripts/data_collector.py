@@ -2,26 +2,33 @@
 import requests
 import json
 import time
+import argparse
 from sqlalchemy.orm import Session
 from sqlalchemy import inspect
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from databases.database import SessionLocal, engine
-from models.model import Base, IPHONE_PRODUCTS, WATCH_PRODUCTS, IPHONE_COLORS, WATCH_COLORS
+from models.model import Base, PRODUCTS, PRODUCT_COLORS
+from services.spec_service import store_spec_attributes
+from services.review_service import store_reviews
+from services.category_registry import CATEGORIES, get_category
+from services.price_service import record_price_changes
+from services.text_normalizer import normalize_chars
+from services.crawl_archive import CRAWL_ARCHIVE_DIR, NullArchive, open_archive, iter_run, latest_run, list_runs, fetched_at_utc
+from services.crawl_jobs import (
+    worker_id, seed_jobs, release_dead_claims, claim_jobs, complete_job, fail_job, next_retry_in, crawl_progress,
+)
+
+# Seconds a collector waits for failed jobs to become retryable before it exits;
+# later retries are left for the next run
+CRAWL_RETRY_WAIT = float(os.getenv("CRAWL_RETRY_WAIT", "120"))
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
     "Accept": "application/json"
 }
 
-IPHONE_API = "https://api.digikala.com/v1/categories/mobile-phone/brands/apple/search/"
-WATCH_API = "https://api.digikala.com/v1/categories/smart-watch/brands/apple/search/"
-IPHONE_DETAILS_API = "https://api.digikala.com/v2/product/"
-WATCH_DETAILS_API = "https://api.digikala.com/v2/product/"
-IPHONE_REVIEWS_API = "https://api.digikala.com/v1/rate-review/products/"
-WATCH_REVIEWS_API = "https://api.digikala.com/v1/rate-review/products/"
-
 # ==========================
 # Helper: build readable review text
 # ==========================
@@ -45,165 +52,358 @@ def ensure_column(model, column_name):
     else:
         print(f"ℹ️ Column {column_name} exists in table {model.__tablename__}.")
 
+# ==========================
+# Fetch (with snapshot)
+# ==========================
+def fetch_json(archive, endpoint, url, category=None, product_id=None, page=None):
+    """GET a Digikala endpoint and keep the raw response in the crawl snapshot."""
+    r = requests.get(url, headers=HEADERS, timeout=10)
+    r.raise_for_status()
+    archive.record(endpoint, url, r.content, category=category, product_id=product_id, page=page)
+    return r.json()
+
+# ==========================
+# Parse and store (shared by crawl and reparse)
+# ==========================
+def store_listing_page(session, cfg, data, at=None):
+    """Upsert products and colors from one search page. Returns (added, price_changes, products_on_page)."""
+    # Check data structure
+    products_list = []
+    data_content = data.get("data", {})
+    if isinstance(data_content, dict):
+        products_list = data_content.get("products", [])
+    elif isinstance(data_content, list):
+        products_list = data_content
+
+    if not products_list:
+        return 0, 0, 0
+
+    added = 0
+    page_prices = {}
+    for p in products_list:
+        pid = p.get("id")
+        title_fa = normalize_chars(p.get("title_fa"))
+        relative_url = p.get("url", {}).get("uri") if isinstance(p.get("url"), dict) else None
+
+        selling_price = None
+        default_variant = p.get("default_variant")
+        if isinstance(default_variant, dict):
+            selling_price = default_variant.get("price", {}).get("selling_price")
+        elif isinstance(default_variant, list) and len(default_variant) > 0:
+            selling_price = default_variant[0].get("price", {}).get("selling_price")
+
+        if not (pid and title_fa and relative_url and selling_price):
+            continue
+
+        # Create or update product
+        db_product = session.query(PRODUCTS).filter_by(product_id=pid).first()
+        if not db_product:
+            db_product = PRODUCTS(
+                product_id=pid,
+                category=cfg.name,
+                title_fa=title_fa,
+                relative_url=f"https://www.digikala.com{relative_url}",
+                selling_price=selling_price
+            )
+            session.add(db_product)
+            added += 1
+        else:
+            # only touch rows whose listing data actually changed
+            full_url = f"https://www.digikala.com{relative_url}"
+            if (db_product.category, db_product.title_fa, db_product.relative_url, db_product.selling_price) != \
+                    (cfg.name, title_fa, full_url, selling_price):
+                db_product.category = cfg.name
+                db_product.title_fa = title_fa
+                db_product.relative_url = full_url
+                db_product.selling_price = selling_price
+        page_prices[pid] = selling_price
+
+        # Store colors
+        colors = p.get("colors", [])
+        for c in colors:
+            color_title = normalize_chars(c.get("title"))
+            if color_title and not session.query(PRODUCT_COLORS).filter_by(product_id=pid, title=color_title).first():
+                session.add(PRODUCT_COLORS(product_id=pid, title=color_title))
+
+    # Append price history only for prices that changed
+    price_changes = record_price_changes(session, page_prices, at=at)
+    return added, price_changes, len(products_list)
+
+
+def store_product_details(session, cfg, product, data):
+    """Colors, specifications and spec attributes from one details response. Returns the attribute count."""
+    pid = product.product_id
+
+    # Store colors from details
+    colors = data.get("data", {}).get("product", {}).get("colors", [])
+    for c in colors:
+        title = normalize_chars(c.get("title"))
+        if title and not session.query(PRODUCT_COLORS).filter_by(product_id=pid, title=title).first():
+            session.add(PRODUCT_COLORS(product_id=pid, title=title))
+
+    # Store specifications
+    specs = data.get("data", {}).get("product", {}).get("specifications", [])
+    if specs and getattr(product, "specifications", None) in (None, ""):
+        product.specifications = json.dumps(specs, ensure_ascii=False)
+
+    # Store normalized, queryable spec attributes
+    if specs:
+        return store_spec_attributes(session, pid, cfg.name, specs)
+    return 0
+
+
+def store_product_reviews(session, cfg, product, all_comments):
+    """Readable review text plus per-comment rows. Returns (inserted, updated)."""
+    product.reviews_text = build_readable_reviews(all_comments)
+    return store_reviews(session, product.product_id, cfg.name, all_comments)
+
 # ==========================
 # Collect products and colors
 # ==========================
-def fetch_and_store_products(api_url, product_model, color_model, max_pages=2):
+def fetch_and_store_products(category, max_pages=None, archive=None):
+    cfg = get_category(category)
+    max_pages = max_pages or cfg.max_pages
+    archive = archive or NullArchive()
     session: Session = SessionLocal()
     total_added = 0
+    total_price_changes = 0
 
     for page in range(1, max_pages + 1):
-        url = f"{api_url}?page={page}"
+        url = f"{cfg.search_api}?page={page}"
         try:
-            r = requests.get(url, headers=HEADERS, timeout=10)
-            r.raise_for_status()
-            data = r.json()
-            
-            # Check data structure
-            products_list = []
-            data_content = data.get("data", {})
-            if isinstance(data_content, dict):
-                products_list = data_content.get("products", [])
-            elif isinstance(data_content, list):
-                products_list = data_content
-
-            if not products_list:
+            data = fetch_json(archive, "listing", url, category=cfg.name, page=page)
+            added, price_changes, found = store_listing_page(session, cfg, data)
+            if not found:
                 break
+            total_added += added
+            total_price_changes += price_changes
 
-            for p in products_list:
-                pid = p.get("id")
-                title_fa = p.get("title_fa")
-                relative_url = p.get("url", {}).get("uri") if isinstance(p.get("url"), dict) else None
-
-                selling_price = None
-                default_variant = p.get("default_variant")
-                if isinstance(default_variant, dict):
-                    selling_price = default_variant.get("price", {}).get("selling_price")
-                elif isinstance(default_variant, list) and len(default_variant) > 0:
-                    selling_price = default_variant[0].get("price", {}).get("selling_price")
-
-                if not (pid and title_fa and relative_url and selling_price):
-                    continue
-
-                # Create or update product
-                db_product = session.query(product_model).filter_by(product_id=pid).first()
-                if not db_product:
-                    db_product = product_model(
-                        product_id=pid,
-                        title_fa=title_fa,
-                        relative_url=f"https://www.digikala.com{relative_url}",
-                        selling_price=selling_price
-                    )
-                    session.add(db_product)
-                    total_added += 1
-                else:
-                    db_product.title_fa = title_fa
-                    db_product.relative_url = f"https://www.digikala.com{relative_url}"
-                    db_product.selling_price = selling_price
-
-                # Store colors
-                colors = p.get("colors", [])
-                for c in colors:
-                    color_title = c.get("title")
-                    if color_title and not session.query(color_model).filter_by(product_id=pid, title=color_title).first():
-                        session.add(color_model(product_id=pid, title=color_title))
-            
             session.commit()
-            print(f"✅ Page {page} processed. Products added: {total_added}")
+            print(f"✅ Page {page} processed. Products added: {total_added}, price changes: {price_changes}")
             time.sleep(1)
 
         except Exception as e:
             print(f"❌ Error on page {page}: {e}")
             session.rollback()
     session.close()
-    print(f"✨ Finished collecting products and colors. Total new products: {total_added}")
+    print(f"✨ Finished collecting products and colors. Total new products: {total_added}, price changes: {total_price_changes}")
 
 # ==========================
 # Collect specifications and reviews
 # ==========================
-def fetch_full_product_data(product_model, color_model, details_api, reviews_api, delay_specs=1, delay_reviews=1, max_pages=2):
+def fetch_full_product_data(category, delay_specs=1, delay_reviews=1, max_pages=None, archive=None, restart=False):
+    """
+    Fetch details and reviews for every product of the category, driven by the
+    crawl_jobs table: progress is checkpointed per product and endpoint, so a
+    restarted collector resumes where the last one stopped, failed items are
+    retried with backoff, and several collectors can run side by side.
+    """
+    cfg = get_category(category)
+    max_pages = max_pages or cfg.review_pages
+    archive = archive or NullArchive()
     session: Session = SessionLocal()
-    products = session.query(product_model).all()
-    print(f"🔍 Products to process: {len(products)}")
+    worker = worker_id()
 
-    for idx, product in enumerate(products, start=1):
-        pid = product.product_id
-        print(f"\nProcessing product {pid} ({idx}/{len(products)}) ...")
+    product_ids = [pid for (pid,) in session.query(PRODUCTS.product_id).filter(PRODUCTS.category == cfg.name)]
+    seeded = seed_jobs(session, cfg.name, product_ids, restart=restart)
+    released = release_dead_claims(session, cfg.name)
+    if released:
+        print(f"♻️ Resuming {released} jobs left unfinished by a stopped collector.")
+    progress = crawl_progress(session, cfg.name)
+    print(f"🔍 Products: {len(product_ids)}; jobs added: {seeded['added']}, reset: {seeded['reset']}; "
+          f"done: {progress['done']}, pending: {progress['pending']}, failed: {progress['failed']}")
 
-        # Fetch product details
-        try:
-            r = requests.get(f"{details_api}{pid}/", headers=HEADERS, timeout=10)
-            r.raise_for_status()
-            data = r.json()
-
-            # Store colors from details
-            colors = data.get("data", {}).get("product", {}).get("colors", [])
-            for c in colors:
-                title = c.get("title")
-                if title and not session.query(color_model).filter_by(product_id=pid, title=title).first():
-                    session.add(color_model(product_id=pid, title=title))
-            session.commit()
+    while True:
+        jobs = claim_jobs(session, cfg.name, worker)
+        if not jobs:
+            # failed jobs whose backoff ends soon are worth waiting for
+            wait = next_retry_in(session, cfg.name)
+            if wait is not None and wait <= CRAWL_RETRY_WAIT:
+                print(f"⏳ Waiting {wait:.0f}s for failed jobs to become retryable ...")
+                time.sleep(wait + 0.1)
+                continue
+            break
 
-            # Store specifications
-            specs = data.get("data", {}).get("product", {}).get("specifications", [])
-            if specs and getattr(product, "specifications", None) in (None, ""):
-                product.specifications = json.dumps(specs, ensure_ascii=False)
+        for job_id, pid, endpoint in jobs:
+            product = session.query(PRODUCTS).filter_by(product_id=pid).first()
+            if product is None:
+                complete_job(session, job_id, worker)
                 session.commit()
-                print(f"✅ Specifications saved.")
-            time.sleep(delay_specs)
+                continue
+            print(f"\nProcessing {endpoint} of product {pid} ...")
 
-        except Exception as e:
-            print(f"❌ Error fetching details for product {pid}: {e}")
-            session.rollback()
+            # Fetch product details
+            if endpoint == "details":
+                try:
+                    data = fetch_json(archive, "details", f"{cfg.details_api}{pid}/", category=cfg.name, product_id=pid)
+                    count = store_product_details(session, cfg, product, data)
+                    complete_job(session, job_id, worker)
+                    session.commit()
+                    print(f"✅ Details saved ({count} spec attributes).")
+                    time.sleep(delay_specs)
 
-        # Fetch reviews
-        try:
-            all_comments = []
-            for page in range(1, max_pages + 1):
-                url = f"{reviews_api}{pid}/?sort=buyers&page={page}"
-                r = requests.get(url, headers=HEADERS, timeout=10)
-                r.raise_for_status()
-                comments = r.json().get("data", {}).get("comments", [])
-                if not comments:
-                    break
-                all_comments.extend(comments)
-                time.sleep(0.5)
-
-            product.reviews_text = build_readable_reviews(all_comments)
-            session.commit()
-            print(f"💾 Reviews saved ({len(all_comments)} comments).")
-            time.sleep(delay_reviews)
-        except Exception as e:
-            print(f"❌ Error fetching/saving reviews for product {pid}: {e}")
-            session.rollback()
+                except Exception as e:
+                    print(f"❌ Error fetching details for product {pid}: {e}")
+                    session.rollback()
+                    fail_job(session, job_id, worker, str(e))
+
+            # Fetch reviews
+            elif endpoint == "reviews":
+                try:
+                    all_comments = []
+                    for page in range(1, max_pages + 1):
+                        url = f"{cfg.reviews_api}{pid}/?sort=buyers&page={page}"
+                        data = fetch_json(archive, "reviews", url, category=cfg.name, product_id=pid, page=page)
+                        comments = data.get("data", {}).get("comments", [])
+                        if not comments:
+                            break
+                        all_comments.extend(comments)
+                        time.sleep(0.5)
+
+                    inserted, updated = store_product_reviews(session, cfg, product, all_comments)
+                    complete_job(session, job_id, worker)
+                    session.commit()
+                    print(f"💾 Reviews saved ({len(all_comments)} comments, {inserted} new rows, {updated} refreshed).")
+                    time.sleep(delay_reviews)
+                except Exception as e:
+                    print(f"❌ Error fetching/saving reviews for product {pid}: {e}")
+                    session.rollback()
+                    fail_job(session, job_id, worker, str(e))
 
+    progress = crawl_progress(session, cfg.name)
     session.close()
-    print("\n✨ Completed operations for all products.")
+    print(f"\n✨ Completed operations for all products. done: {progress['done']}, "
+          f"waiting for retry: {progress['failed'] - progress['gave_up']}, gave up: {progress['gave_up']}, "
+          f"claimed by other collectors: {progress['running']}")
+
+# ==========================
+# Reparse a snapshot (no HTTP)
+# ==========================
+def reparse_snapshot(run_id=None, categories=None, commit_every=200):
+    """
+    Rebuild products, colors, specs, price history and reviews from a stored crawl
+    run instead of the network. Entries are replayed in fetch order, so listing
+    pages create the products before their details and reviews are applied.
+    Prices are recorded at the time they were fetched (UTC), compared with the
+    price in effect then.
+
+    A run holds only what its own invocation fetched: after a resumed crawl, the
+    details and reviews are spread over several runs. Replay them all, oldest
+    first, with reparse_all_runs().
+    """
+    run_id = run_id or latest_run()
+    if not run_id:
+        print(f"❌ No crawl snapshots in '{CRAWL_ARCHIVE_DIR}'.")
+        return
+    print(f"📼 Reparsing crawl run {run_id}")
+    session: Session = SessionLocal()
+    started = time.perf_counter()
+    counts = {"listing": 0, "details": 0, "reviews": 0}
+    products = {}
+    pending_reviews = {}  # product_id -> comments of its pages replayed so far (one product at a time)
+
+    def product_for(pid):
+        if pid not in products:
+            products[pid] = session.query(PRODUCTS).filter_by(product_id=pid).first()
+        return products[pid]
+
+    def flush_reviews():
+        for pid, comments in pending_reviews.items():
+            product = product_for(pid)
+            if product is not None:
+                store_product_reviews(session, get_category(product.category), product, comments)
+        pending_reviews.clear()
+
+    try:
+        for n, entry in enumerate(iter_run(run_id, categories=categories), start=1):
+            endpoint, body = entry["endpoint"], entry["body"] or {}
+            cfg = get_category(entry["category"])
+            if endpoint == "listing":
+                at = fetched_at_utc(entry["fetched_at"])
+                store_listing_page(session, cfg, body, at=at)
+                session.flush()
+            elif endpoint == "details":
+                product = product_for(entry["product_id"])
+                if product is not None:
+                    store_product_details(session, cfg, product, body)
+            elif endpoint == "reviews":
+                # pages of one product are consecutive; store them together
+                if entry["product_id"] not in pending_reviews:
+                    flush_reviews()
+                pending_reviews.setdefault(entry["product_id"], []).extend(body.get("data", {}).get("comments", []))
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+
+            # pending review pages stay pending: a product's pages may straddle the
+            # boundary, and storing part of them would replace its reviews_text
+            if n % commit_every == 0:
+                session.commit()
+        flush_reviews()
+        session.commit()
+    except Exception as e:
+        print(f"❌ Reparse failed: {e}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"✨ Reparsed {total} responses ({counts['listing']} listing pages, {counts['details']} details, "
+          f"{counts['reviews']} review pages) in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f}/s)")
+
+def reparse_all_runs(categories=None):
+    """Replay every stored run, oldest first, so later fetches win."""
+    runs = list_runs()
+    if not runs:
+        print(f"❌ No crawl snapshots in '{CRAWL_ARCHIVE_DIR}'.")
+        return
+    for run_id in runs:
+        reparse_snapshot(run_id, categories)
 
 # ==========================
 # Direct execution
 # ==========================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect Digikala products, specs and reviews.")
+    parser.add_argument("categories", nargs="*", help="categories to crawl (default: all registered)")
+    parser.add_argument("--reparse", nargs="?", const="latest", metavar="RUN_ID",
+                        help="rebuild the DB from a stored crawl run without HTTP: a run id, 'latest' "
+                             "(default) or 'all' (every run, oldest first; needed after a resumed crawl)")
+    parser.add_argument("--restart", action="store_true",
+                        help="start a fresh details/reviews pass instead of resuming the unfinished one")
+    parser.add_argument("--details-only", action="store_true",
+                        help="skip the listing stage; e.g. extra collectors sharing a running crawl")
+    args = parser.parse_args()
+
     # Create tables if they don't exist
     Base.metadata.create_all(engine)
     print("✅ Tables created (if they did not exist).")
 
     # Check required columns
-    ensure_column(IPHONE_PRODUCTS, "specifications")
-    ensure_column(IPHONE_PRODUCTS, "reviews_text")
-    ensure_column(WATCH_PRODUCTS, "specifications")
-    ensure_column(WATCH_PRODUCTS, "reviews_text")
+    ensure_column(PRODUCTS, "specifications")
+    ensure_column(PRODUCTS, "reviews_text")
+
+    if args.reparse == "all":
+        reparse_all_runs(args.categories or None)
+        sys.exit(0)
+    if args.reparse:
+        reparse_snapshot(None if args.reparse == "latest" else args.reparse, args.categories or None)
+        sys.exit(0)
 
-    # Collect products and colors
-    print("\n=== Collecting iPhone products ===")
-    fetch_and_store_products(IPHONE_API, IPHONE_PRODUCTS, IPHONE_COLORS, max_pages=2)
+    # Categories to crawl: command line arguments, or every registered category
+    categories = args.categories or list(CATEGORIES)
 
-    print("\n=== Collecting Watch products ===")
-    fetch_and_store_products(WATCH_API, WATCH_PRODUCTS, WATCH_COLORS, max_pages=2)
+    # Every response is kept in a compressed snapshot so parsing changes can be replayed offline
+    with open_archive() as archive:
+        if archive.run_id:
+            print(f"📼 Crawl snapshot: {archive.run_id}")
 
-    # Fetch specifications and reviews
-    print("\n=== Processing iPhones ===")
-    fetch_full_product_data(IPHONE_PRODUCTS, IPHONE_COLORS, IPHONE_DETAILS_API, IPHONE_REVIEWS_API)
+        # Collect products and colors
+        if not args.details_only:
+            for category in categories:
+                print(f"\n=== Collecting {get_category(category).label} products ===")
+                fetch_and_store_products(category, archive=archive)
 
-    print("\n=== Processing Watches ===")
-    fetch_full_product_data(WATCH_PRODUCTS, WATCH_COLORS, WATCH_DETAILS_API, WATCH_REVIEWS_API)
+        # Fetch specifications and reviews (resumable, shareable between collectors)
+        for category in categories:
+            print(f"\n=== Processing {get_category(category).label} ===")
+            fetch_full_product_data(category, archive=archive, restart=args.restart)
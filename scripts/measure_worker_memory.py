@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import urllib.request
+
+# add project directory to sys.path so local modules can be imported
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+
+# ==========================
+# Settings
+# ==========================
+APP = os.getenv("MEASURE_APP", "api_server:app")
+PORT = int(os.getenv("MEASURE_PORT", "8765"))
+# seconds to wait for all workers to come up and load their indexes
+STARTUP_TIMEOUT = int(os.getenv("MEASURE_STARTUP_TIMEOUT", "180"))
+SETTLE_SECONDS = int(os.getenv("MEASURE_SETTLE_SECONDS", "5"))
+
+
+# ==========================
+# /proc helpers (Linux)
+# ==========================
+def _children(pid: int):
+    """All descendant pids of `pid`."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the ppid is the 2nd field after the ")" closing the command name
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def memory_kb(pid: int) -> dict:
+    """Rss / Pss / shared / private kB of one process from smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def _wait_ready(proc, timeout: int) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{PORT}/router/stats", timeout=2):
+                return True
+        except Exception:
+            time.sleep(1)
+    return False
+
+
+# ==========================
+# Measurement
+# ==========================
+def measure(workers: int, server: str, mmap: bool) -> dict:
+    env = dict(os.environ, PRELOAD_INDEXES="1", FAISS_MMAP="1" if mmap else "0")
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+               "--workers", str(workers), "--bind", f"127.0.0.1:{PORT}", APP]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", APP, "--host", "127.0.0.1",
+               "--port", str(PORT), "--workers", str(workers)]
+
+    proc = subprocess.Popen(cmd, cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not _wait_ready(proc, STARTUP_TIMEOUT):
+            raise RuntimeError(f"server did not start: {' '.join(cmd)}")
+        time.sleep(SETTLE_SECONDS)
+        pids = [proc.pid] + _children(proc.pid)
+        per_process = {}
+        for pid in pids:
+            try:
+                per_process[pid] = memory_kb(pid)
+            except OSError:
+                continue
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    # a single uvicorn worker serves from the launched process itself
+    worker_rows = [m for pid, m in per_process.items() if pid != proc.pid] or list(per_process.values())
+    return {
+        "workers": workers,
+        "processes": len(per_process),
+        "rss_per_worker_mb": sum(m["rss"] for m in worker_rows) / max(len(worker_rows), 1) / 1024,
+        "pss_per_worker_mb": sum(m["pss"] for m in worker_rows) / max(len(worker_rows), 1) / 1024,
+        "private_per_worker_mb": sum(m["private"] for m in worker_rows) / max(len(worker_rows), 1) / 1024,
+        "total_pss_mb": sum(m["pss"] for m in per_process.values()) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory of the API server versus worker count.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="gunicorn")
+    parser.add_argument("--mmap", action="store_true", help="memory-map the FAISS indexes (FAISS_MMAP=1)")
+    args = parser.parse_args()
+
+    print(f"📏 {args.server} {'mmap' if args.mmap else 'in-memory'} indexes, app {APP}")
+    print(f"{'workers':>8} {'RSS/worker':>12} {'PSS/worker':>12} {'private/worker':>15} {'total PSS':>11}")
+    for n in args.workers:
+        row = measure(n, args.server, args.mmap)
+        print(f"{row['workers']:>8} {row['rss_per_worker_mb']:>10.1f}MB {row['pss_per_worker_mb']:>10.1f}MB "
+              f"{row['private_per_worker_mb']:>13.1f}MB {row['total_pss_mb']:>9.1f}MB")
+    print("✅ PSS splits shared pages between the processes that map them; total PSS is the real footprint.")
+
+
+if __name__ == "__main__":
+    main()
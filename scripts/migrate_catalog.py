@@ -0,0 +1,77 @@
+# scripts/migrate_catalog.py
+import os
+import sys
+from sqlalchemy import inspect
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from databases.database import SessionLocal, engine
+from models.model import (
+    Base, PRODUCTS, PRODUCT_COLORS,
+    IPHONE_PRODUCTS, WATCH_PRODUCTS, IPHONE_COLORS, WATCH_COLORS,
+)
+
+# legacy product table, legacy color table -> category name
+LEGACY_TABLES = [
+    (IPHONE_PRODUCTS, IPHONE_COLORS, "iphone"),
+    (WATCH_PRODUCTS, WATCH_COLORS, "watch"),
+]
+
+
+# ==========================
+# Copy legacy per-category tables into products / product_colors
+# ==========================
+def migrate_catalog(drop_legacy=False):
+    """
+    Idempotent: products already present in `products` (by product_id) are
+    skipped, colors are deduplicated on (product_id, title).
+    """
+    Base.metadata.create_all(engine)
+    existing_tables = set(inspect(engine).get_table_names())
+    session = SessionLocal()
+    try:
+        known_products = {pid for (pid,) in session.query(PRODUCTS.product_id)}
+        known_colors = set(session.query(PRODUCT_COLORS.product_id, PRODUCT_COLORS.title))
+
+        for product_model, color_model, category in LEGACY_TABLES:
+            if product_model.__tablename__ not in existing_tables:
+                continue
+
+            products = [
+                {
+                    "product_id": p.product_id,
+                    "category": category,
+                    "title_fa": p.title_fa,
+                    "relative_url": p.relative_url,
+                    "selling_price": p.selling_price,
+                    "specifications": p.specifications,
+                    "reviews_text": p.reviews_text,
+                }
+                for p in session.query(product_model)
+                if p.product_id not in known_products
+            ]
+            session.bulk_insert_mappings(PRODUCTS, products)
+            known_products.update(p["product_id"] for p in products)
+
+            colors = []
+            for pid, title in session.query(color_model.product_id, color_model.title):
+                if title and (pid, title) not in known_colors:
+                    colors.append({"product_id": pid, "title": title})
+                    known_colors.add((pid, title))
+            session.bulk_insert_mappings(PRODUCT_COLORS, colors)
+
+            session.commit()
+            print(f"✅ {product_model.__tablename__}: {len(products)} products, {len(colors)} colors migrated as '{category}'.")
+
+        if drop_legacy:
+            for product_model, color_model, _ in LEGACY_TABLES:
+                color_model.__table__.drop(engine, checkfirst=True)
+                product_model.__table__.drop(engine, checkfirst=True)
+            print("🗑️ Legacy tables dropped.")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    migrate_catalog(drop_legacy="--drop-legacy" in sys.argv)
@@ -0,0 +1,404 @@
+# services/admission.py
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque, Counter
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Agent runs in flight per worker process. The limit adapts between
+# ADMISSION_MIN_CONCURRENCY and this value: it backs off when the provider
+# rate-limits us and creeps back up while calls succeed.
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8"))
+ADMISSION_MIN_CONCURRENCY = int(os.getenv("ADMISSION_MIN_CONCURRENCY", "1"))
+# Agent runs in flight across all worker processes on this host (0 = no global limit)
+ADMISSION_GLOBAL_CONCURRENCY = int(os.getenv("ADMISSION_GLOBAL_CONCURRENCY", "0"))
+ADMISSION_LOCK_DIR = os.getenv("ADMISSION_LOCK_DIR", "/tmp/dastyar-admission")
+# Requests allowed to wait for a slot, and how long (seconds) before they are shed
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "15"))
+# Running + waiting requests one chat session may hold
+ADMISSION_SESSION_MAX = int(os.getenv("ADMISSION_SESSION_MAX", "2"))
+# Share of the limit that batch LLM calls may hold together, and how long (seconds)
+# one batch call waits for idle capacity before its item fails
+ADMISSION_BATCH_SHARE = float(os.getenv("ADMISSION_BATCH_SHARE", "0.5"))
+ADMISSION_BATCH_TIMEOUT = float(os.getenv("ADMISSION_BATCH_TIMEOUT", "300"))
+
+# waiters re-check capacity this often (seconds): global slots are freed by other processes
+_POLL_INTERVAL = 0.05
+
+
+class Overloaded(Exception):
+    """Request shed by admission control; maps to 503 (or 429 for a busy session) with Retry-After."""
+
+    def __init__(self, reason: str, retry_after: int, status_code: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for provider rate-limit errors (OpenAI RateLimitError / HTTP 429)."""
+    if type(error).__name__ == "RateLimitError":
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+# -------------------------
+# Host-wide slots
+# -------------------------
+class _GlobalSlots:
+    """
+    Host-wide semaphore shared by independently started worker processes: slot i
+    is held by whoever has an exclusive flock on `slot-i`. The kernel drops the
+    lock when a worker dies, so a crashed worker never leaks capacity.
+    """
+
+    def __init__(self, size: int, lock_dir: str):
+        self.size = size
+        self.lock_dir = lock_dir
+        self._fcntl = None
+        if size > 0:
+            try:
+                import fcntl
+                os.makedirs(lock_dir, exist_ok=True)
+                self._fcntl = fcntl
+            except (ImportError, OSError) as e:
+                logger.warning("Global admission limit disabled (%s)", e)
+
+    @property
+    def enabled(self) -> bool:
+        return self._fcntl is not None
+
+    def try_acquire(self) -> Optional[int]:
+        """A held slot's file descriptor, -1 when there is no global limit, None when all are taken."""
+        if not self.enabled:
+            return -1
+        for i in range(self.size):
+            fd = os.open(os.path.join(self.lock_dir, f"slot-{i}"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, fd: int):
+        if fd is not None and fd >= 0:
+            os.close(fd)  # closing the descriptor drops the flock
+
+
+def admission_key(session_id: Optional[str], client_host: Optional[str]) -> str:
+    """
+    Key that per-session fairness counts a request under. Requests without a
+    session id get a fresh session each, so they are grouped by client address
+    instead; behind a proxy that is the proxy's address unless uvicorn runs with
+    --proxy-headers.
+    """
+    return session_id or f"client:{client_host or 'unknown'}"
+
+
+# -------------------------
+# Controller
+# -------------------------
+class _Waiter:
+    __slots__ = ("session_id", "enqueued_at", "deadline", "wake", "slot")
+
+    def __init__(self, session_id: str, wake):
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + ADMISSION_QUEUE_TIMEOUT
+        self.wake = wake
+        self.slot = None
+
+
+class AdmissionController:
+    """
+    Admission control in front of agent runs, shared by sync and async endpoints.
+
+    - At most `limit` runs per worker (AIMD: multiplicative decrease on provider
+      rate limits, additive increase on success) and, optionally, a host-wide cap.
+    - Excess requests wait in a bounded queue served round-robin across
+      sessions, so one user's burst cannot starve the others; a session may
+      hold at most ADMISSION_SESSION_MAX running + waiting requests.
+    - A waiting request is shed once it has waited ADMISSION_QUEUE_TIMEOUT,
+      and one arriving to a full queue is shed at once; both get a Retry-After
+      estimate instead of queueing forever.
+    - Fairness is per admission key: the chat session, or the client address
+      for requests that did not name a session (see `admission_key`).
+    - Batch LLM calls (`batch_slot`) count against the same limit but only use
+      idle capacity: they never take a slot while requests are queued and hold
+      at most ADMISSION_BATCH_SHARE of the limit.
+    """
+
+    def __init__(self, max_concurrency: int = None, min_concurrency: int = None,
+                 max_queue: int = None, session_max: int = None, global_concurrency: int = None,
+                 batch_share: float = None):
+        self.max_limit = max_concurrency or ADMISSION_MAX_CONCURRENCY
+        self.min_limit = max(1, min(min_concurrency or ADMISSION_MIN_CONCURRENCY, self.max_limit))
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.session_max = session_max or ADMISSION_SESSION_MAX
+        self.batch_share = ADMISSION_BATCH_SHARE if batch_share is None else batch_share
+        self.limit = float(self.max_limit)
+        self._global = _GlobalSlots(
+            ADMISSION_GLOBAL_CONCURRENCY if global_concurrency is None else global_concurrency, ADMISSION_LOCK_DIR
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._batch_in_flight = 0
+        self._per_session = Counter()
+        # session_id -> waiters in arrival order; dict order is the round-robin rotation
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._service_ewma = 5.0  # seconds per agent run, seeds the Retry-After estimate
+        self.stats = Counter()
+
+    # ---- admission ----
+    def _admit_locked(self, waiter: Optional[_Waiter] = None) -> Optional[int]:
+        """Take a slot for `waiter` (or a new arrival) if capacity and fairness allow."""
+        if self._in_flight >= int(self.limit):
+            return None
+        if waiter is None and self._queued:
+            return None  # arrivals do not overtake the queue
+        if waiter is not None:
+            head_session = next(iter(self._queues))
+            if head_session != waiter.session_id or self._queues[head_session][0] is not waiter:
+                return None
+        slot = self._global.try_acquire()
+        if slot is None:
+            return None
+        self._in_flight += 1
+        if waiter is not None:
+            queue = self._queues.pop(waiter.session_id)
+            queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues[waiter.session_id] = queue  # back of the rotation
+            self.stats["wait_ms_total"] += int((time.monotonic() - waiter.enqueued_at) * 1000)
+            self.stats["admitted_after_wait"] += 1
+            self._wake_head_locked()  # the next session may fit too
+        self.stats["admitted"] += 1
+        return slot
+
+    def _admit_batch_locked(self) -> Optional[int]:
+        """Take a slot for a batch call if it fits in capacity nobody is waiting for."""
+        if self._queued or self._in_flight >= int(self.limit):
+            return None
+        if self._batch_in_flight >= max(1, int(self.limit * self.batch_share)):
+            return None
+        slot = self._global.try_acquire()
+        if slot is None:
+            return None
+        self._in_flight += 1
+        self._batch_in_flight += 1
+        self.stats["batch_admitted"] += 1
+        return slot
+
+    def _retry_after_locked(self) -> int:
+        rounds = (self._queued + 1) / max(int(self.limit), 1)
+        return max(1, math.ceil(rounds * self._service_ewma))
+
+    def _shed(self, reason: str, status_code: int = 503) -> Overloaded:
+        self.stats[f"shed_{reason}"] += 1
+        return Overloaded(reason, self._retry_after_locked(), status_code)
+
+    def _enter(self, session_id: str, wake) -> tuple:
+        """Admit now (returns (slot, None)) or enqueue (returns (None, waiter)); raises Overloaded."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._per_session[session_id] >= self.session_max:
+                raise self._shed("session", status_code=429)
+            slot = self._admit_locked()
+            if slot is not None:
+                self._per_session[session_id] += 1
+                return slot, None
+            if self._queued >= self.max_queue:
+                raise self._shed("queue_full")
+            waiter = _Waiter(session_id, wake)
+            self._queues.setdefault(session_id, deque()).append(waiter)
+            self._queued += 1
+            self._per_session[session_id] += 1
+            self.stats["queued"] += 1
+            return None, waiter
+
+    def _poll(self, waiter: _Waiter) -> bool:
+        """Waiter woke up: True once admitted; raises Overloaded past its deadline."""
+        with self._lock:
+            if waiter.slot is None:
+                waiter.slot = self._admit_locked(waiter)
+            if waiter.slot is not None:
+                return True
+            if time.monotonic() >= waiter.deadline:
+                self._drop_locked(waiter)
+                raise self._shed("deadline")
+            return False
+
+    def _drop_locked(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.session_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._queues[waiter.session_id]
+        self._per_session[waiter.session_id] -= 1
+        if self._per_session[waiter.session_id] <= 0:
+            del self._per_session[waiter.session_id]
+        self._wake_head_locked()
+
+    def _wake_head_locked(self):
+        if self._queues:
+            self._queues[next(iter(self._queues))][0].wake()
+
+    def _exit(self, session_id: Optional[str], slot: int, started: float, error: BaseException = None):
+        """Release a slot; `session_id` is None for a batch call."""
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._global.release(slot)
+            self._in_flight -= 1
+            if session_id is None:
+                self._batch_in_flight -= 1
+            else:
+                self._per_session[session_id] -= 1
+                if self._per_session[session_id] <= 0:
+                    del self._per_session[session_id]
+                # Retry-After estimates are in agent runs; batch calls are single LLM calls
+                self._service_ewma = 0.8 * self._service_ewma + 0.2 * elapsed
+            if error is not None and is_rate_limit_error(error):
+                self.limit = max(float(self.min_limit), self.limit * 0.7)
+                self.stats["rate_limited"] += 1
+                logger.warning("Provider rate limit; admission limit lowered to %.1f", self.limit)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+                self.stats["failed" if error is not None else "completed"] += 1
+            self._wake_head_locked()
+
+    # ---- public API ----
+    @contextmanager
+    def slot(self, session_id: str):
+        """Hold an agent-run slot for the block (sync endpoints); raises Overloaded."""
+        event = threading.Event()
+        slot, waiter = self._enter(session_id, event.set)
+        if waiter is not None:
+            try:
+                while not self._poll(waiter):
+                    event.wait(_POLL_INTERVAL)
+                    event.clear()
+            except BaseException:
+                with self._lock:
+                    if waiter.slot is None and waiter in self._queues.get(session_id, ()):
+                        self._drop_locked(waiter)
+                raise
+            slot = waiter.slot
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._exit(session_id, slot, started, e)
+            raise
+        self._exit(session_id, slot, started)
+
+    @asynccontextmanager
+    async def aslot(self, session_id: str):
+        """Async variant of `slot`; waiting does not block the event loop."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        slot, waiter = self._enter(session_id, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is not None:
+            try:
+                while not self._poll(waiter):
+                    try:
+                        await asyncio.wait_for(event.wait(), _POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    event.clear()
+            except BaseException:
+                with self._lock:
+                    if waiter.slot is None and waiter in self._queues.get(session_id, ()):
+                        self._drop_locked(waiter)
+                raise
+            slot = waiter.slot
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._exit(session_id, slot, started, e)
+            raise
+        self._exit(session_id, slot, started)
+
+    def admit_batch(self, max_load: float):
+        """Refuse a new batch (raises Overloaded) while the load is above `max_load`."""
+        with self._lock:
+            if (self._in_flight + self._queued) / max(self.limit, 1.0) > max_load:
+                self.stats["batch_rejected"] += 1
+                raise Overloaded("batch", self._retry_after_locked())
+
+    @contextmanager
+    def batch_slot(self, timeout: float = None):
+        """
+        Hold a slot for one batch LLM call (sync, called from worker threads).
+        Waits outside the request queue until idle capacity frees up; raises
+        Overloaded after `timeout` seconds (ADMISSION_BATCH_TIMEOUT).
+        """
+        deadline = time.monotonic() + (ADMISSION_BATCH_TIMEOUT if timeout is None else timeout)
+        while True:
+            with self._lock:
+                slot = self._admit_batch_locked()
+                if slot is None and time.monotonic() >= deadline:
+                    self.stats["batch_timeouts"] += 1
+                    raise Overloaded("batch_timeout", self._retry_after_locked())
+            if slot is not None:
+                break
+            time.sleep(_POLL_INTERVAL)
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._exit(None, slot, started, e)
+            raise
+        self._exit(None, slot, started)
+
+    def load(self) -> float:
+        """Agent runs in flight plus waiting, relative to the current limit (>1 means queueing)."""
+        with self._lock:
+            return (self._in_flight + self._queued) / max(self.limit, 1.0)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            shed = sum(v for k, v in stats.items() if k.startswith("shed_"))
+            requests = stats.get("requests", 0)
+            admitted_after_wait = stats.get("admitted_after_wait", 0)
+            return {
+                "limit": round(self.limit, 2),
+                "max_limit": self.max_limit,
+                "global_limit": self._global.size if self._global.enabled else None,
+                "in_flight": self._in_flight,
+                "batch_in_flight": self._batch_in_flight,
+                "batch_limit": max(1, int(self.limit * self.batch_share)),
+                "batch_admitted": stats.get("batch_admitted", 0),
+                "batch_timeouts": stats.get("batch_timeouts", 0),
+                "batch_rejected": stats.get("batch_rejected", 0),
+                "queue_depth": self._queued,
+                "sessions_waiting": len(self._queues),
+                "requests": requests,
+                "admitted": stats.get("admitted", 0),
+                "shed": shed,
+                "shed_rate": round(shed / requests, 4) if requests else 0.0,
+                "shed_by_reason": {k[len("shed_"):]: v for k, v in stats.items() if k.startswith("shed_")},
+                "rate_limited": stats.get("rate_limited", 0),
+                "avg_wait_ms": round(stats.get("wait_ms_total", 0) / admitted_after_wait, 1) if admitted_after_wait else 0.0,
+                "avg_service_s": round(self._service_ewma, 2),
+            }
+
+
+admission = AdmissionController()
+
+
+def get_admission_stats() -> Dict:
+    return admission.get_stats()
@@ -1,13 +1,23 @@
 # services/creator_tools.py
 import os
 from typing import List, Dict
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains import LLMChain
 from langchain.tools import BaseTool
 from databases.database import SessionLocal
-from models.model import IPHONE_PRODUCTS, WATCH_PRODUCTS
+from models.model import PRODUCTS
 from services.rag_service import get_rag_chain
+from services.spec_service import find_products_by_attribute, relevant_attributes, format_attributes
+from services.context_builder import build_products_context
+from services.review_service import top_reviews, top_reviews_bulk, format_review
+from services.price_service import price_trend
+from services.singleflight import tool_flight, llm_flight, make_key
+from services.llm_clients import get_chat_model, get_chain
+from services.text_normalizer import normalize_chars, normalize_text, color_matches
+from services.working_set import working_set, current_session
+from services.prefetch import prefetcher, prefetch_for_candidates
+from services.prompts import (
+    FILTER_PRODUCT_PROMPT, SUMMARIZE_REVIEWS_PROMPT, COMPARE_PRODUCTS_PROMPT, CATEGORIZE_PRODUCTS_PROMPT,
+)
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,15 +25,23 @@ load_dotenv()
 # -------------------------
 # LLM
 # -------------------------
-LLM_MODEL = os.getenv("MODEL", "gpt-4o-mini")
-llm = ChatOpenAI(model=LLM_MODEL, temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
+# shared client on the process-wide connection pool; tool chains are built once per prompt
+llm = get_chat_model(temperature=0)
+
+
+def run_chain(chain: LLMChain, inputs: Dict) -> str:
+    """Run an LLMChain; identical concurrent prompts share one LLM request."""
+    return llm_flight.do(make_key(repr(chain.prompt), inputs), chain.run, inputs)
 
 # -------------------------
 # 1️⃣ Tool: Filter and extract information from RAG
 # -------------------------
 class FilterProductsTool(BaseTool):
     name: str = "filter_products"
-    description: str = "Apply filters to products retrieved by RAG"
+    description: str = (
+        "Apply filters to products retrieved by RAG. Leave documents empty to filter the "
+        "products already found in this conversation instead of searching again."
+    )
 
     def _run(self, documents: List[Dict] | str | None = None, color: str = None, min_price: int = None, max_price: int = None, user_query: str = None) -> List[Dict]:
         """
@@ -34,9 +52,11 @@ class FilterProductsTool(BaseTool):
         """
         import json
 
-        # If called with no documents, return empty list (nothing to filter)
+        # If called with no documents, filter the products found earlier in this session
         if not documents:
-            return []
+            documents = working_set.products(current_session.get())
+            if not documents:
+                return []
 
         # If documents is a JSON/string, try to parse
         if isinstance(documents, str):
@@ -48,8 +68,10 @@ class FilterProductsTool(BaseTool):
                 else:
                     documents = parsed
             except Exception:
-                # If parsing fails, we can't filter; return empty list
-                return []
+                # Not a product list (e.g. "those"): fall back to the session's products
+                documents = working_set.products(current_session.get())
+                if not documents:
+                    return []
 
         # At this point expect a list of dicts
         results: List[Dict] = []
@@ -61,25 +83,14 @@ class FilterProductsTool(BaseTool):
 
         # Prepare LLM chain once if needed
         if use_llm_filter:
-            llm_prompt = """شما یک استخراج‌گر هستید که بررسی می‌کند آیا یک محصول با توضیحات زیر مطابق درخواست کاربر هست یا نه.
-ورودی‌ها:
-User request: {user_query}
-Product info (JSON or متن ساختاری):
-{product}
-
-خروجی: دقیقا یکی از کلمه‌های TRUE یا FALSE (بدون متن اضافی). اگر محصول با درخواست کاربر مطابقت دارد TRUE و در غیر این صورت FALSE بنویس.
-مثال: TRUE
-"""
-            llm_chain = LLMChain(llm=llm, prompt=ChatPromptTemplate.from_template(llm_prompt))
+            llm_chain = get_chain(FILTER_PRODUCT_PROMPT)
 
         for doc in documents:
             # If color filter provided, do a simple heuristic match first
-            if color:
-                doc_colors = [c.lower() for c in doc.get("colors", []) if isinstance(c, str)]
-                if isinstance(color, str):
-                    if color.lower() not in doc_colors and not any(color.lower() in c for c in doc_colors):
-                        continue
-                # else: leave as-is
+            # ("black", "سیاه" and "مشکی" are the same color)
+            if color and isinstance(color, str):
+                if not color_matches(color, doc.get("colors", [])):
+                    continue
 
             # If user_query is present, use LLM to vet the product
             if use_llm_filter:
@@ -99,7 +110,7 @@ Product info (JSON or متن ساختاری):
                         # include raw metadata if available
                         product_text = str({**product_summary, **(doc.get("source") or doc.get("metadata") or {})})
 
-                    llm_out = llm_chain.run({"user_query": user_query, "product": product_text})
+                    llm_out = run_chain(llm_chain, {"user_query": user_query, "product": product_text})
                     decision = (llm_out or "").strip().upper()
                     if decision and decision.startswith("T"):
                         pass  # keep product
@@ -127,6 +138,8 @@ Product info (JSON or متن ساختاری):
             if max_price and (price_val is None or price_val > max_price):
                 continue
             results.append(doc)
+        # the filtered list is what the user sees next, so positions refer to it
+        working_set.remember(current_session.get(), results)
         return results
 
     async def _arun(self, *args, **kwargs):
@@ -137,13 +150,32 @@ Product info (JSON or متن ساختاری):
 # -------------------------
 class SummarizeReviewsTool(BaseTool):
     name: str = "summarize_reviews"
-    description: str = "Summarize and analyze up to 20 user reviews from RAG results"
+    description: str = (
+        "Summarize and analyze up to 20 user reviews. Pass product_id to summarize the "
+        "top stored reviews of a product, or pass the reviews from RAG results."
+    )
 
-    def _run(self, reviews: list | str, max_reviews: int = 20) -> str:
+    def _run(self, reviews: list | str = None, max_reviews: int = 20, product_id: int = None) -> str:
         """
         Accept either a single large reviews string or a list of review strings.
+        If `product_id` is given, the top `max_reviews` reviews are selected in SQL
+        (buyers and most-liked first) instead.
         Limit to `max_reviews` and produce a short categorized Persian summary.
+        Concurrent identical calls (e.g. a popular product) share one execution.
         """
+        key = make_key(self.name, reviews, max_reviews, product_id)
+        return tool_flight.do(key, self._summarize, reviews, max_reviews, product_id)
+
+    def _summarize(self, reviews: list | str = None, max_reviews: int = 20, product_id: int = None) -> str:
+        if product_id:
+            # warmed in the background after the search that found this product
+            summary = prefetcher.take("review_summary", (int(product_id), max_reviews))
+            if summary is not None:
+                return summary
+            stored = top_reviews(int(product_id), k=max_reviews)
+            if stored:
+                reviews = [format_review(r) for r in stored]
+
         if not reviews:
             return "No reviews found."
 
@@ -152,63 +184,72 @@ class SummarizeReviewsTool(BaseTool):
         else:
             reviews_list = [r for r in reviews if isinstance(r, str) and r.strip()][:max_reviews]
 
-        prompt_template = """شما یک تحلیل‌گر حرفه‌ای هستید.
-با استفاده از نظرات زیر کاربران در مورد یک محصول اپل، یک خلاصه کوتاه و دسته‌بندی‌شده ایجاد کنید
-(مثلاً قیمت، کیفیت، زیبایی) و در قالب پاراگراف به زبان فارسی ارائه دهید.
-
-نظرات کاربران:
-{reviews}
-
-خلاصه:"""
-
-        chain = LLMChain(llm=llm, prompt=ChatPromptTemplate.from_template(prompt_template))
-        return chain.run({"reviews": "\n".join(reviews_list)})
+        chain = get_chain(SUMMARIZE_REVIEWS_PROMPT)
+        return run_chain(chain, {"reviews": "\n".join(reviews_list)})
 
     async def _arun(self, *args, **kwargs):
         raise NotImplementedError("SummarizeReviewsTool does not support async")
 
+def summarize_stored_reviews(product_id: int, max_reviews: int = 20) -> str | None:
+    """Summary of a product's top stored reviews (what summarize_reviews returns for it), or None without reviews."""
+    stored = top_reviews(int(product_id), k=max_reviews)
+    if not stored:
+        return None
+    chain = get_chain(SUMMARIZE_REVIEWS_PROMPT)
+    return run_chain(chain, {"reviews": "\n".join(format_review(r) for r in stored)})
+
 # -------------------------
 # 3️⃣ Tool: Compare two products using RAG
 # -------------------------
+def _resolve_product(ref: Dict | str | int | None) -> Dict | None:
+    """
+    A full product for a compare argument: complete dicts are used as given,
+    references are looked up in the session's working set, and only a title the
+    working set does not know triggers a new search.
+    """
+    if isinstance(ref, dict) and ref.get("title") and "price" in ref:
+        return ref
+    product = working_set.resolve(current_session.get(), ref)
+    if product is not None:
+        return product
+    query = ref.get("title") if isinstance(ref, dict) else ref
+    if isinstance(query, str) and query.strip() and not query.strip().isdigit():
+        results = RAGTool()._run(query)
+        if isinstance(results, list) and results:
+            return results[0]
+    return None
+
 class CompareProductsTool(BaseTool):
     name: str = "compare_products"
-    description: str = "Compare two products by price, color, specs and reviews using an LLM"
-
-    def _run(self, product_a: Dict, product_b: Dict) -> str:
-        prompt_template = """شما یک دستیار مقایسه حرفه‌ای هستید.
-دو محصول با مشخصات زیر داده شده‌اند.
-یک مقایسه دقیق و خوانا بین دو محصول انجام بده و روی قیمت، رنگ، کیفیت و مشخصات تمرکز کن.
-همچنین خلاصه‌ای از نظرات کاربران ارائه کن و نتیجه را به صورت پاراگراف فارسی بنویس.
-
-محصول اول:
-نام: {title_a}
-قیمت: {price_a}
-رنگ‌ها: {colors_a}
-مشخصات: {specs_a}
-نظرات: {reviews_a}
-
-محصول دوم:
-نام: {title_b}
-قیمت: {price_b}
-رنگ‌ها: {colors_b}
-مشخصات: {specs_b}
-نظرات: {reviews_b}
-
-مقایسه:"""
-
-        chain = LLMChain(llm=llm, prompt=ChatPromptTemplate.from_template(prompt_template))
-        return chain.run({
+    description: str = (
+        "Compare two products by price, color, specs and reviews using an LLM. "
+        "product_a and product_b may be product dicts, or references to products already found "
+        "in this conversation: a position in the latest results (1, 2, 'last'), a product_id or a title. "
+        "Pass focus with what the user cares about (e.g. 'battery and camera') so those specs are kept."
+    )
+
+    def _run(self, product_a: Dict | str | int, product_b: Dict | str | int, focus: str = "") -> str:
+        product_a, product_b = _resolve_product(product_a), _resolve_product(product_b)
+        missing = [ref for ref, p in (("product_a", product_a), ("product_b", product_b)) if p is None]
+        if missing:
+            return f"Could not find {' and '.join(missing)}; search with rag_tool first."
+
+        # Keep only the differing/important spec fields (those `focus` mentions first) and a representative review sample
+        ctx_a, ctx_b = build_products_context([product_a, product_b], name="compare_products", query=focus or "")
+
+        chain = get_chain(COMPARE_PRODUCTS_PROMPT)
+        return run_chain(chain, {
             "title_a": product_a["title"],
             "price_a": product_a["price"],
             "colors_a": ", ".join(product_a.get("colors", [])),
-            "specs_a": product_a.get("specs") or "",
-            "reviews_a": product_a.get("reviews") or "",
+            "specs_a": ctx_a["specs"],
+            "reviews_a": "\n".join(ctx_a["reviews"]),
 
             "title_b": product_b["title"],
             "price_b": product_b["price"],
             "colors_b": ", ".join(product_b.get("colors", [])),
-            "specs_b": product_b.get("specs") or "",
-            "reviews_b": product_b.get("reviews") or "",
+            "specs_b": ctx_b["specs"],
+            "reviews_b": "\n".join(ctx_b["reviews"]),
         })
 
     async def _arun(self, *args, **kwargs):
@@ -223,18 +264,35 @@ class RAGTool(BaseTool):
     name: str = "rag_tool"
     description: str = (
         "Search and retrieve relevant product data using the RAG retriever. "
-        "Optionally apply filters such as color and price range before returning results."
+        "Optionally apply filters such as color and price range before returning results. "
+        "Use mode='review' for opinion-style questions (e.g. 'battery drains fast'): it searches "
+        "individual reviews and returns the products they belong to with the matching snippets."
     )
 
-    def _run(self, query: str, color: str = None, min_price: int = None, max_price: int = None) -> list:
+    def _run(self, query: str, color: str = None, min_price: int = None, max_price: int = None, mode: str = "product") -> list:
         """Perform RAG retrieval and apply optional filters before returning results."""
-        from services.rag_service import get_vector_retriever
-        retriever = get_vector_retriever(k=10)
+        query = normalize_chars(query)
+        # identical concurrent searches share one embedding + retrieval; the key uses the
+        # normalized text so "آيفون ۱۵" and "آیفون 15" are the same search
+        key = make_key(self.name, normalize_text(query), normalize_text(color), min_price, max_price, mode)
+        results = tool_flight.do(key, self._search, query, color, min_price, max_price, mode)
+        # keep the structured results so follow-up turns can refer to them without a new search
+        if isinstance(results, list):
+            working_set.remember(current_session.get(), results)
+            # reviews and prices of the top candidates are the likely next questions
+            prefetch_for_candidates(results)
+        return results
+
+    def _search(self, query: str, color: str = None, min_price: int = None, max_price: int = None, mode: str = "product") -> list:
+        if mode == "review":
+            return self._run_review_mode(query, color, min_price, max_price)
 
-        if not retriever:
+        from services.rag_service import retrieve_documents
+        docs = [doc for doc, _ in retrieve_documents(query, k=10)]
+
+        if not docs:
             return "RAG retriever is not available or not initialized."
 
-        docs = retriever.get_relevant_documents(query)
         results = []
 
         for d in docs:
@@ -259,7 +317,7 @@ class RAGTool(BaseTool):
             price_val = int(digits) if digits else None
 
         
-            if color and all(color.lower() not in c for c in colors):
+            if color and not color_matches(color, colors):
                 continue
         
             if min_price and (not price_val or price_val < min_price):
@@ -280,8 +338,74 @@ class RAGTool(BaseTool):
         if not results:
             return f"No products found for query '{query}' with the applied filters."
 
+        # Carry only the spec attributes the query is about instead of the full blob,
+        # and the top stored reviews instead of re-splitting the review text
+        product_ids = [r["source"].get("product_id") for r in results if r["source"].get("product_id")]
+        try:
+            attrs = relevant_attributes(product_ids, query)
+        except Exception:
+            attrs = {}
+        try:
+            reviews = top_reviews_bulk(product_ids, k=20)
+        except Exception:
+            reviews = {}
+        for r in results:
+            pid = r["source"].get("product_id")
+            if attrs.get(pid):
+                r["specs"] = format_attributes(attrs[pid])
+            if reviews.get(pid):
+                r["reviews"] = [format_review(rv) for rv in reviews[pid]]
+
         return results
 
+    def _run_review_mode(self, query: str, color: str = None, min_price: int = None, max_price: int = None) -> list:
+        """Find matching review chunks first, then aggregate them to products."""
+        from services.rag_service import search_products_by_reviews
+        from services.product_service import load_products
+
+        hits = search_products_by_reviews(query, top_products=10)
+        if not hits:
+            return "Review index is not available or no matching reviews were found."
+
+        product_ids = [h["product_id"] for h in hits]
+        products = load_products(product_ids)
+        try:
+            attrs = relevant_attributes(product_ids, query)
+        except Exception:
+            attrs = {}
+
+        results = []
+        for h in hits:
+            p = products.get(h["product_id"])
+            if not p:
+                continue
+            colors = [c.lower() for c in p["colors"]]
+            price_val = p["price_value"]
+            if color and not color_matches(color, colors):
+                continue
+            if min_price and (not price_val or price_val < min_price):
+                continue
+            if max_price and (not price_val or price_val > max_price):
+                continue
+
+            results.append({
+                "title": p["title"],
+                "price": p["price"],
+                "colors": colors,
+                "specs": format_attributes(attrs.get(h["product_id"], [])),
+                "reviews": h["snippets"],
+                "source": {
+                    "product_id": h["product_id"],
+                    "category": p["category"],
+                    "url": p["url"],
+                    "review_score": round(h["score"], 4),
+                    "matching_reviews": h["matches"],
+                },
+            })
+
+        if not results:
+            return f"No products found for query '{query}' with the applied filters."
+        return results
 
     async def _arun(self, *args, **kwargs):
         raise NotImplementedError("RAGTool does not support async")
@@ -308,27 +432,73 @@ class CategorizeProductsTool(BaseTool):
         if not products:
             return {}
 
-        # Build a prompt that provides up to 20 reviews per product and asks the LLM to group products
+        # Build a prompt with a deduplicated, representative review sample per product
+        # (within the shared token budget) and ask the LLM to group products
+        contexts = build_products_context(products, name="categorize_products", include_specs=False)
         items_text = []
-        for p in products:
-            reviews = p.get("reviews") or []
-            reviews_text = "\n".join(reviews[:20])
+        for p, ctx in zip(products, contexts):
+            reviews_text = "\n".join(ctx["reviews"])
             items_text.append(f"Product: {p.get('title')}\nReviews:\n{reviews_text}\n---")
 
-        prompt = """شما یک تحلیل‌گر خرید حرفه‌ای هستید.
-با استفاده از اطلاعات محصولات و بررسی‌های کاربران، محصولات را بر اساس موضوعات مهم (مثلاً: کیفیت ساخت، عمر باتری، ارزش در مقابل قیمت، طراحی) دسته‌بندی کن.
-برای هر دسته، فهرستی از محصولات مرتبط و یک خلاصه کوتاه پاراگرافی به فارسی بنویس.
-
-ورودی:
-{items}
-
-خروجی:""".replace("{items}", "\n\n".join(items_text))
-
-        chain = LLMChain(llm=llm, prompt=ChatPromptTemplate.from_template(prompt))
-        output = chain.run({})
+        chain = get_chain(CATEGORIZE_PRODUCTS_PROMPT)
+        output = run_chain(chain, {"items": "\n\n".join(items_text)})
         # Return raw LLM output (string) which will contain categorized groups
         return {"categories_summary": output}
 
 
 # expose extended tools
 creator_tools.append(CategorizeProductsTool())
+
+
+# -------------------------
+# 6️⃣ Tool: Answer spec attribute predicates with SQL
+# -------------------------
+class SpecFilterTool(BaseTool):
+    name: str = "spec_filter"
+    description: str = (
+        "Find products whose specification attribute matches a predicate, e.g. "
+        "attribute='storage', op='>=', value='256GB' or attribute='case_size', op='=', value='45mm'. "
+        "Known attributes: storage, ram, screen_size, case_size, weight, chip, os, camera, battery, "
+        "body_material, strap_material, water_resistance. op is one of =, >=, <=, >, <, contains. "
+        "category is optional (e.g. 'iphone' or 'watch')."
+    )
+
+    def _run(self, attribute: str, op: str = "=", value: str = "", category: str = None) -> list | str:
+        try:
+            results = find_products_by_attribute(attribute, op, value, category=category)
+        except Exception as e:
+            return f"Spec lookup failed: {e}"
+        if not results:
+            return f"No products found where {attribute} {op} {value}."
+        return results
+
+    async def _arun(self, *args, **kwargs):
+        raise NotImplementedError("SpecFilterTool does not support async")
+
+
+creator_tools.append(SpecFilterTool())
+
+
+# -------------------------
+# 7️⃣ Tool: Price history / trend
+# -------------------------
+class PriceHistoryTool(BaseTool):
+    name: str = "price_history"
+    description: str = (
+        "Answer questions like 'has this gotten cheaper?' from recorded price history. "
+        "Input: product_id (from the 'source' of RAG results) and optional days (default 30). "
+        "Returns start/current/min/max price over the window and whether it got cheaper."
+    )
+
+    def _run(self, product_id: int, days: int = 30) -> dict | str:
+        try:
+            trend = prefetcher.take("price_trend", (int(product_id), int(days)))
+            return trend if trend is not None else price_trend(int(product_id), days=int(days))
+        except Exception as e:
+            return f"Price history lookup failed: {e}"
+
+    async def _arun(self, *args, **kwargs):
+        raise NotImplementedError("PriceHistoryTool does not support async")
+
+
+creator_tools.append(PriceHistoryTool())
@@ -0,0 +1,177 @@
+# services/batch_service.py
+# Stateless bulk question answering for evaluation and merchandising runs.
+# Questions are processed in chunks: each chunk gets one embedding call and one
+# FAISS search over its query matrix (or goes through the retrieval service, which
+# micro-batches them), then the RAG answers are generated with a bounded number
+# of concurrent LLM calls, each holding an admission slot so batches only use the
+# capacity live /chat traffic leaves idle. No session rows, no history, no agent loop.
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List
+from langchain_core.documents import Document
+from services.text_normalizer import normalize_chars
+from services.admission import admission
+
+logger = logging.getLogger(__name__)
+
+# Questions embedded and searched together
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+# LLM calls in flight per batch request
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+# Documents retrieved per question
+BATCH_TOP_K = int(os.getenv("BATCH_TOP_K", "5"))
+# Largest batch accepted in one request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+# New rag batches are refused while the agent admission load is above this (1 = /chat is queueing)
+BATCH_MAX_LOAD = float(os.getenv("BATCH_MAX_LOAD", "1.0"))
+
+# rag: retrieve + answer; retrieve: documents only (retrieval evaluation, no LLM cost)
+MODES = ("rag", "retrieve")
+
+
+class BatchInputError(ValueError):
+    """A batch line that is neither a JSON object with a question nor plain text."""
+
+
+def parse_items(lines: Iterable[str]) -> List[Dict]:
+    """
+    JSONL lines -> [{'id', 'question'}]. A line is {"id": ..., "question": ...}
+    ("query"/"message" also accepted) or a bare JSON string; missing ids are the
+    1-based line number. Blank lines are skipped.
+    """
+    items = []
+    for n, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise BatchInputError(f"line {n}: not valid JSON")
+        if isinstance(data, str):
+            data = {"question": data}
+        if not isinstance(data, dict):
+            raise BatchInputError(f"line {n}: expected an object or a string")
+        question = data.get("question") or data.get("query") or data.get("message")
+        if not isinstance(question, str) or not question.strip():
+            raise BatchInputError(f"line {n}: no question")
+        items.append({"id": data.get("id", n), "question": question})
+        if len(items) > BATCH_MAX_ITEMS:
+            raise BatchInputError(f"more than BATCH_MAX_ITEMS={BATCH_MAX_ITEMS} questions")
+    return items
+
+
+# -------------------------
+# Retrieval
+# -------------------------
+def _search_chunk(queries: List[str], k: int) -> List[List[Document]]:
+    """Documents per query: one embedding call and one FAISS search for the chunk."""
+    from services.retrieval_client import RETRIEVAL_SERVICE_URL
+    if RETRIEVAL_SERVICE_URL:
+        # the service batches concurrent queries itself; send them together
+        from services.rag_service import retrieve_documents
+        with ThreadPoolExecutor(max_workers=min(len(queries), 32)) as pool:
+            results = list(pool.map(lambda q: retrieve_documents(q, k=k), queries))
+        return [[doc for doc, _ in hits] for hits in results]
+
+    from services.rag_service import get_product_vector_store
+    from services.retrieval_service import search_batch
+    vector_store = get_product_vector_store()
+    if vector_store is None:
+        raise RuntimeError("Product vector store is not available")
+    unique = list(dict.fromkeys(queries))
+    by_query = dict(zip(unique, search_batch(vector_store, unique, k)))
+    return [[Document(page_content=h["page_content"], metadata=h["metadata"]) for h in by_query[q]] for q in queries]
+
+
+def _doc_summary(doc: Document) -> Dict:
+    title = next((line[len("Product name:"):].strip() for line in doc.page_content.splitlines()
+                  if line.startswith("Product name:")), None)
+    return {"title": title, "product_id": doc.metadata.get("product_id"), "category": doc.metadata.get("category")}
+
+
+# -------------------------
+# Answering
+# -------------------------
+def admit_batch(mode: str):
+    """Raise admission.Overloaded when the server is too busy to start a rag batch."""
+    if mode == "rag":
+        admission.admit_batch(BATCH_MAX_LOAD)
+
+
+def _answer(question: str, docs: List[Document]) -> str:
+    from services.llm_clients import get_chain
+    from services.prompts import RAG_ANSWER_PROMPT
+    context = "\n\n".join(doc.page_content for doc in docs)
+    # counts against the admission limit; waits while /chat requests need the capacity
+    with admission.batch_slot():
+        return get_chain(RAG_ANSWER_PROMPT).run({"context": context, "input": question})
+
+
+def run_batch(items: List[Dict], mode: str = "rag", k: int = None, concurrency: int = None,
+              chunk_size: int = None) -> Iterator[Dict]:
+    """
+    Answer `items` ([{'id', 'question'}]) and yield one result per item as it
+    finishes (order within a chunk is completion order; `index` is the input
+    position). Each result carries its timings in milliseconds:
+    `retrieval_ms` (its chunk's shared embedding + search), `llm_ms` and `total_ms`
+    (from the start of its chunk; `llm_ms` includes the wait for an admission
+    slot). A failed item yields an `error` instead of stopping the batch.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown batch mode '{mode}'. Known: {', '.join(MODES)}")
+    k = k or BATCH_TOP_K
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    concurrency = concurrency or BATCH_LLM_CONCURRENCY
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-llm") as pool:
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            chunk_started = time.perf_counter()
+            queries = [normalize_chars(item["question"]) for item in chunk]
+            try:
+                docs_per_query = _search_chunk(queries, k)
+                error = None
+            except Exception as e:
+                logger.exception("Batch retrieval failed: %s", e)
+                docs_per_query, error = [[] for _ in chunk], f"retrieval failed: {e}"
+            retrieval_ms = round((time.perf_counter() - chunk_started) * 1000, 1)
+
+            def base(i: int) -> Dict:
+                return {"index": start + i, "id": chunk[i]["id"], "question": chunk[i]["question"],
+                        "documents": [_doc_summary(d) for d in docs_per_query[i]],
+                        "retrieval_ms": retrieval_ms, "batch_size": len(chunk)}
+
+            if error or mode == "retrieve":
+                for i in range(len(chunk)):
+                    result = base(i)
+                    if error:
+                        result["error"] = error
+                    result["total_ms"] = retrieval_ms
+                    yield result
+                continue
+
+            def answer(i: int) -> Dict:
+                result = base(i)
+                llm_started = time.perf_counter()
+                try:
+                    result["answer"] = _answer(queries[i], docs_per_query[i])
+                except Exception as e:
+                    result["error"] = f"answer failed: {e}"
+                done = time.perf_counter()
+                result["llm_ms"] = round((done - llm_started) * 1000, 1)
+                result["total_ms"] = round((done - chunk_started) * 1000, 1)
+                return result
+
+            futures = [pool.submit(answer, i) for i in range(len(chunk))]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+def run_batch_jsonl(items: List[Dict], **kwargs) -> Iterator[str]:
+    """run_batch() as JSONL lines, for streaming responses and files."""
+    for result in run_batch(items, **kwargs):
+        yield json.dumps(result, ensure_ascii=False) + "\n"
@@ -0,0 +1,64 @@
+# services/category_registry.py
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+DIGIKALA_SEARCH_API = "https://api.digikala.com/v1/categories/{slug}/brands/{brand}/search/"
+DIGIKALA_DETAILS_API = "https://api.digikala.com/v2/product/"
+DIGIKALA_REVIEWS_API = "https://api.digikala.com/v1/rate-review/products/"
+
+
+@dataclass(frozen=True)
+class CategoryConfig:
+    """Everything the crawl/index pipeline needs to know about one catalog category."""
+    name: str                      # key stored in products.category
+    label: str                     # English label used in vector documents
+    label_fa: str                  # Persian label used in replies
+    slug: str                      # Digikala category slug
+    brand: str = "apple"
+    max_pages: int = 2             # listing pages to crawl
+    review_pages: int = 2          # review pages per product
+    keywords: Tuple[str, ...] = () # words users use for this category (normalized, lowercase)
+
+    @property
+    def search_api(self) -> str:
+        return DIGIKALA_SEARCH_API.format(slug=self.slug, brand=self.brand)
+
+    @property
+    def details_api(self) -> str:
+        return DIGIKALA_DETAILS_API
+
+    @property
+    def reviews_api(self) -> str:
+        return DIGIKALA_REVIEWS_API
+
+
+# -------------------------
+# Registry
+# -------------------------
+CATEGORIES: Dict[str, CategoryConfig] = {}
+
+
+def register_category(config: CategoryConfig) -> CategoryConfig:
+    CATEGORIES[config.name] = config
+    return config
+
+
+def get_category(name: str) -> CategoryConfig:
+    try:
+        return CATEGORIES[name]
+    except KeyError:
+        raise ValueError(f"Unknown category '{name}'. Known: {', '.join(CATEGORIES)}")
+
+
+def category_names() -> List[str]:
+    return list(CATEGORIES)
+
+
+register_category(CategoryConfig(
+    name="iphone", label="iPhone", label_fa="آیفون", slug="mobile-phone",
+    keywords=("آیفون", "ایفون", "iphone", "گوشی", "موبایل"),
+))
+register_category(CategoryConfig(
+    name="watch", label="Watch", label_fa="اپل واچ", slug="smart-watch",
+    keywords=("واچ", "watch", "ساعت"),
+))
@@ -0,0 +1,276 @@
+# services/context_builder.py
+import os
+import re
+import math
+import json
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Optional, Callable
+from services.spec_service import flatten_specifications, resolve_attribute, DEFAULT_ATTRIBUTES, ATTRIBUTE_KEYWORDS
+from services.text_normalizer import mentions_keyword, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Total prompt budget (tokens) shared by the products of one tool call
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+# Share of each product's budget spent on specs; the rest goes to reviews
+CONTEXT_SPEC_SHARE = float(os.getenv("CONTEXT_SPEC_SHARE", "0.4"))
+# Use the embedding model to cluster reviews (costs one embedding call per tool call)
+CONTEXT_REVIEW_EMBEDDINGS = os.getenv("CONTEXT_REVIEW_EMBEDDINGS", "0") == "1"
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or encoding not downloadable
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # rough fallback: ~4 characters per token
+    return math.ceil(len(text) / 4)
+
+
+# -------------------------
+# Savings stats
+# -------------------------
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+def record_savings(name: str, tokens_before: int, tokens_after: int):
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["tokens_before"] += tokens_before
+        _stats["tokens_after"] += tokens_after
+    logger.info("%s context: %d -> %d tokens (saved %d)", name, tokens_before, tokens_after, tokens_before - tokens_after)
+
+
+def get_context_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    stats["saved_share"] = round(stats["tokens_saved"] / stats["tokens_before"], 3) if stats["tokens_before"] else 0.0
+    return stats
+
+
+# -------------------------
+# Specs
+# -------------------------
+def _spec_fields(specs) -> List[Dict]:
+    """Accept the Digikala JSON (list or text) or the compact 'title: value | ...' text."""
+    rows = flatten_specifications(specs)
+    if rows:
+        return [{"attribute": r["attribute"], "title": r["title"], "value": r["value"]} for r in rows]
+    if isinstance(specs, dict):
+        return [{"attribute": resolve_attribute(k), "title": k, "value": str(v)} for k, v in specs.items()]
+    fields = []
+    for part in re.split(r"\s*\|\s*|\n", str(specs or "")):
+        if ":" in part:
+            title, value = part.split(":", 1)
+            fields.append({"attribute": resolve_attribute(title.strip()), "title": title.strip(), "value": value.strip()})
+    return fields
+
+
+def select_spec_fields(specs_per_product: List, budget_per_product: int, query: str = "") -> List[str]:
+    """
+    Pick the most informative spec fields for each product within a token budget.
+    Priority: attributes the query mentions, attributes whose values differ between
+    the products (what a comparison is about), the category defaults, then the rest.
+    """
+    fields_per_product = [_spec_fields(s) for s in specs_per_product]
+    norm_query = normalize_text(query)
+    mentioned = {
+        key for key, keywords in ATTRIBUTE_KEYWORDS.items()
+        if any(mentions_keyword(norm_query, k) for k in keywords)
+    }
+    defaults = {a for attrs in DEFAULT_ATTRIBUTES.values() for a in attrs}
+
+    values_by_attr: Dict[str, set] = {}
+    for fields in fields_per_product:
+        for f in fields:
+            values_by_attr.setdefault(f["attribute"], set()).add(f["value"])
+    multi = len(fields_per_product) > 1
+
+    def rank(f):
+        differs = multi and len(values_by_attr.get(f["attribute"], ())) > 1
+        return (
+            f["attribute"] not in mentioned,
+            not differs,
+            f["attribute"] not in defaults,
+            len(f["value"]),
+        )
+
+    out = []
+    for fields in fields_per_product:
+        chosen, used = [], 0
+        for f in sorted(fields, key=rank):
+            line = f"{f['title']}: {f['value']}"
+            cost = count_tokens(line) + 1
+            if used + cost > budget_per_product:
+                continue
+            chosen.append(line)
+            used += cost
+        out.append(" | ".join(chosen))
+    return out
+
+
+# -------------------------
+# Reviews
+# -------------------------
+# header lines produced by build_readable_reviews ("3. 🛒 Buyer | Rating: 5")
+_REVIEW_HEADER_RE = re.compile(r"^\s*\d+\.\s*(🛒|👤)")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _review_lines(reviews) -> List[str]:
+    if isinstance(reviews, str):
+        reviews = reviews.split("\n")
+    return [r.strip() for r in reviews or [] if isinstance(r, str) and r.strip() and not _REVIEW_HEADER_RE.match(r)]
+
+
+def dedupe_reviews(reviews) -> List[str]:
+    """Drop empty, header-only and near-identical (same normalized words) reviews."""
+    seen, out = set(), []
+    for r in _review_lines(reviews):
+        key = " ".join(_WORD_RE.findall(normalize_text(r)))
+        if key and key not in seen:
+            seen.add(key)
+            out.append(r)
+    return out
+
+
+def _bow_vectors(texts: List[str]) -> List[Dict[str, float]]:
+    vectors = []
+    for t in texts:
+        counts = Counter(_WORD_RE.findall(normalize_text(t)))
+        norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+        vectors.append({w: v / norm for w, v in counts.items()})
+    return vectors
+
+
+def _cosine_sparse(a: Dict[str, float], b: Dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(w, 0.0) for w, v in a.items())
+
+
+def _cosine_dense(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a)) or 1.0
+    nb = math.sqrt(sum(y * y for y in b)) or 1.0
+    return dot / (na * nb)
+
+
+def representative_reviews(reviews, budget: int, embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None) -> List[str]:
+    """
+    Deduplicate reviews and pick a representative sample that fits `budget` tokens.
+    Reviews are clustered (farthest-point seeding, one assignment pass) over their
+    embeddings if `embed_fn` is given, otherwise over bag-of-words vectors. The
+    medoid of each cluster is taken, largest clusters first, so common opinions
+    are covered before outliers.
+    """
+    items = dedupe_reviews(reviews)
+    if not items:
+        return []
+    total = sum(count_tokens(r) for r in items)
+    if total <= budget:
+        return items
+
+    avg = max(1, total // len(items))
+    k = max(1, min(len(items), budget // avg))
+
+    if embed_fn is not None:
+        try:
+            vectors = embed_fn(items)
+            sim = _cosine_dense
+        except Exception as e:
+            logger.warning("Review embedding failed, falling back to lexical clustering: %s", e)
+            vectors, sim = _bow_vectors(items), _cosine_sparse
+    else:
+        vectors, sim = _bow_vectors(items), _cosine_sparse
+
+    # farthest-point seeding
+    seeds = [max(range(len(items)), key=lambda i: len(items[i]))]
+    closest = [sim(vectors[i], vectors[seeds[0]]) for i in range(len(items))]
+    while len(seeds) < k:
+        nxt = min((i for i in range(len(items)) if i not in seeds), key=lambda i: closest[i], default=None)
+        if nxt is None:
+            break
+        seeds.append(nxt)
+        closest = [max(c, sim(vectors[i], vectors[nxt])) for i, c in enumerate(closest)]
+
+    # assign every review to its nearest seed
+    clusters: Dict[int, List[int]] = {s: [] for s in seeds}
+    for i in range(len(items)):
+        best = max(seeds, key=lambda s: sim(vectors[i], vectors[s]))
+        clusters[best].append(i)
+
+    # medoid per cluster, biggest clusters first
+    picked = []
+    for members in sorted(clusters.values(), key=len, reverse=True):
+        if not members:
+            continue
+        medoid = max(members, key=lambda i: sum(sim(vectors[i], vectors[j]) for j in members))
+        picked.append(medoid)
+
+    out, used = [], 0
+    for i in picked:
+        cost = count_tokens(items[i]) + 1
+        if used + cost > budget:
+            continue
+        out.append(items[i])
+        used += cost
+    return out
+
+
+def _review_embed_fn():
+    if not CONTEXT_REVIEW_EMBEDDINGS:
+        return None
+    from services.embedding_backends import get_embedding_backend
+    return get_embedding_backend().embed_documents
+
+
+# -------------------------
+# Product context
+# -------------------------
+def build_products_context(products: List[Dict], name: str, query: str = "", budget: int = None,
+                           include_specs: bool = True) -> List[Dict]:
+    """
+    Return one compressed context per product ({'specs': str, 'reviews': [str]})
+    within `budget` tokens in total, and record how many tokens were saved.
+    """
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    per_product = max(1, budget // max(1, len(products)))
+    spec_budget = int(per_product * CONTEXT_SPEC_SHARE) if include_specs else 0
+    review_budget = per_product - spec_budget
+    embed_fn = _review_embed_fn()
+
+    def _raw_specs(p):
+        specs = p.get("specs") or ""
+        return specs if isinstance(specs, str) else json.dumps(specs, ensure_ascii=False)
+
+    def _raw_reviews(p):
+        reviews = p.get("reviews") or ""
+        return reviews if isinstance(reviews, str) else "\n".join(r for r in reviews if isinstance(r, str))
+
+    tokens_before = sum(
+        (count_tokens(_raw_specs(p)) if include_specs else 0) + count_tokens(_raw_reviews(p))
+        for p in products
+    )
+
+    specs = select_spec_fields([p.get("specs") for p in products], spec_budget, query) if include_specs else [""] * len(products)
+    contexts = []
+    for p, spec_text in zip(products, specs):
+        contexts.append({
+            "specs": spec_text,
+            "reviews": representative_reviews(p.get("reviews"), review_budget, embed_fn),
+        })
+
+    tokens_after = sum(count_tokens(c["specs"]) + count_tokens("\n".join(c["reviews"])) for c in contexts)
+    record_savings(name, tokens_before, tokens_after)
+    return contexts
@@ -0,0 +1,279 @@
+# services/crawl_archive.py
+# Raw crawl snapshots. Every Digikala response the collector fetches is appended,
+# unparsed, to one compressed JSONL pack per crawl run:
+#
+#   crawl_archive/runs/<run_id>.jsonl.zst   one line per response, in fetch order
+#   crawl_archive/index.db                 SQLite index: run, endpoint, product, page -> sha256
+#
+# Entries are addressed by the SHA-256 of the response bytes; a body repeated within
+# a run (empty review pages, unchanged listing pages) is stored once and later lines
+# refer to it. `scripts/data_collector.py --reparse` replays a pack into the DB.
+import io
+import os
+import json
+import gzip
+import zlib
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+import importlib.util
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CRAWL_ARCHIVE_DIR = os.getenv("CRAWL_ARCHIVE_DIR", "crawl_archive")
+# Set to 0 to crawl without keeping snapshots
+CRAWL_ARCHIVE = os.getenv("CRAWL_ARCHIVE", "1") == "1"
+# zstd compression level (1 fast .. 19 small)
+CRAWL_ARCHIVE_LEVEL = int(os.getenv("CRAWL_ARCHIVE_LEVEL", "10"))
+# zstd needs the `zstandard` package; gzip is used without it
+HAS_ZSTD = importlib.util.find_spec("zstandard") is not None
+
+ENDPOINTS = ("listing", "details", "reviews")
+
+# `fetched_at` is UTC with a trailing Z; packs written before that carry local time
+FETCHED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# errors raised by a corrupt compressed stream
+_READ_ERRORS = (EOFError, OSError, zlib.error)
+if HAS_ZSTD:
+    import zstandard
+    _READ_ERRORS += (zstandard.ZstdError,)
+
+# lines between flushes, so a crashed crawl loses at most this many responses
+_FLUSH_EVERY = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    run_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    endpoint TEXT NOT NULL,
+    category TEXT,
+    product_id INTEGER,
+    page INTEGER,
+    url TEXT,
+    sha256 TEXT NOT NULL,
+    size INTEGER,
+    fetched_at TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS ix_snapshots_product ON snapshots (product_id, endpoint);
+CREATE INDEX IF NOT EXISTS ix_snapshots_sha ON snapshots (run_id, sha256);
+"""
+
+
+def _connect(root: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(root, "index.db"), timeout=30, check_same_thread=False)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _pack_path(root: str, run_id: str) -> Optional[str]:
+    for ext in (".jsonl.zst", ".jsonl.gz"):
+        path = os.path.join(root, "runs", run_id + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# -------------------------
+# Writing
+# -------------------------
+class CrawlArchive:
+    """Append-only snapshot pack for one crawl run. Thread-safe; use as a context manager."""
+
+    def __init__(self, root: str = None, run_id: str = None, level: int = None):
+        self.root = root or CRAWL_ARCHIVE_DIR
+        self.run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        os.makedirs(os.path.join(self.root, "runs"), exist_ok=True)
+        self.path = os.path.join(self.root, "runs", self.run_id + (".jsonl.zst" if HAS_ZSTD else ".jsonl.gz"))
+
+        if HAS_ZSTD:
+            self._raw = open(self.path, "wb")
+            self._compressor = zstandard.ZstdCompressor(level=level or CRAWL_ARCHIVE_LEVEL)
+            self._stream = self._compressor.stream_writer(self._raw)
+            self._file = io.TextIOWrapper(self._stream, encoding="utf-8")
+        else:
+            self._file = gzip.open(self.path, "wt", encoding="utf-8")
+
+        self._lock = threading.Lock()
+        self._index = _connect(self.root)
+        self._seen = set()
+        self.stats = {"responses": 0, "unique": 0, "raw_bytes": 0}
+
+    def record(self, endpoint: str, url: str, payload: bytes, category: str = None,
+               product_id: int = None, page: int = None) -> str:
+        """Append one raw response; returns its sha256."""
+        sha = hashlib.sha256(payload).hexdigest()
+        fetched_at = time.strftime(FETCHED_AT_FORMAT, time.gmtime())  # UTC, like price_history
+        entry = {"endpoint": endpoint, "category": category, "product_id": product_id, "page": page,
+                 "url": url, "fetched_at": fetched_at, "sha256": sha}
+        with self._lock:
+            seq = self.stats["responses"]
+            if sha not in self._seen:
+                self._seen.add(sha)
+                entry["body"] = json.loads(payload)
+                self.stats["unique"] += 1
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._index.execute(
+                "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, seq, endpoint, category, product_id, page, url, sha, len(payload), fetched_at),
+            )
+            self.stats["responses"] += 1
+            self.stats["raw_bytes"] += len(payload)
+            if self.stats["responses"] % _FLUSH_EVERY == 0:
+                self._flush()
+        return sha
+
+    def _flush(self):
+        self._file.flush()
+        if HAS_ZSTD:
+            self._stream.flush(zstandard.FLUSH_BLOCK)
+            self._raw.flush()
+        self._index.commit()
+
+    def close(self):
+        with self._lock:
+            self._file.close()  # ends the zstd frame / gzip member
+            self._index.commit()
+            self._index.close()
+        size = os.path.getsize(self.path)
+        logger.info("Crawl snapshot %s: %d responses (%d unique), %.1f MB raw -> %.1f MB on disk",
+                    self.run_id, self.stats["responses"], self.stats["unique"],
+                    self.stats["raw_bytes"] / 1e6, size / 1e6)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NullArchive:
+    """Stand-in when CRAWL_ARCHIVE=0."""
+
+    run_id = None
+
+    def record(self, *args, **kwargs):
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def open_archive(root: str = None) -> "CrawlArchive | NullArchive":
+    return CrawlArchive(root) if CRAWL_ARCHIVE else NullArchive()
+
+
+# -------------------------
+# Reading
+# -------------------------
+def fetched_at_utc(value: str) -> datetime:
+    """An entry's `fetched_at` as a naive UTC datetime (the convention of price_history)."""
+    if value.endswith("Z"):
+        return datetime.strptime(value, FETCHED_AT_FORMAT)
+    # older packs: local time of the crawling host
+    local = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+    return datetime.fromtimestamp(time.mktime(local.timetuple()), tz=timezone.utc).replace(tzinfo=None)
+
+
+def list_runs(root: str = None) -> List[str]:
+    """Run ids in the archive, oldest first."""
+    runs_dir = os.path.join(root or CRAWL_ARCHIVE_DIR, "runs")
+    if not os.path.isdir(runs_dir):
+        return []
+    names = {f.split(".jsonl")[0] for f in os.listdir(runs_dir) if ".jsonl" in f}
+    return sorted(names)
+
+
+def latest_run(root: str = None) -> Optional[str]:
+    runs = list_runs(root)
+    return runs[-1] if runs else None
+
+
+def lookup(product_id: int, endpoint: str = None, root: str = None) -> List[Dict]:
+    """Index rows for one product (optionally one endpoint), newest run first."""
+    conn = _connect(root or CRAWL_ARCHIVE_DIR)
+    try:
+        sql = "SELECT run_id, seq, endpoint, category, product_id, page, url, sha256, size, fetched_at " \
+              "FROM snapshots WHERE product_id = ?"
+        args = [product_id]
+        if endpoint:
+            sql += " AND endpoint = ?"
+            args.append(endpoint)
+        cols = ["run_id", "seq", "endpoint", "category", "product_id", "page", "url", "sha256", "size", "fetched_at"]
+        return [dict(zip(cols, row)) for row in conn.execute(sql + " ORDER BY run_id DESC, seq", args)]
+    finally:
+        conn.close()
+
+
+def _iter_lines(path: str) -> Iterator[bytes]:
+    """
+    Complete lines of a pack. Decompresses incrementally so a pack whose frame was
+    never closed (crashed crawl) still yields everything flushed before the crash.
+    """
+    if path.endswith(".zst"):
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)  # gzip container
+    pending = b""
+    with open(path, "rb") as f:
+        try:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                pending += decompressor.decompress(chunk)
+                *lines, pending = pending.split(b"\n")
+                yield from lines
+        except _READ_ERRORS as e:
+            logger.warning("Snapshot pack %s is damaged (%s); replaying what was readable", path, e)
+    if pending.strip():
+        logger.warning("Truncated entry at the end of %s; stopping there", path)
+
+
+def iter_run(run_id: str, root: str = None, endpoints: Iterable[str] = None,
+             categories: Iterable[str] = None, product_ids: Iterable[int] = None) -> Iterator[Dict]:
+    """
+    Stream the entries of one run in fetch order, each with its `body` resolved.
+    A pack cut short by a crash yields everything up to the last complete line.
+    """
+    root = root or CRAWL_ARCHIVE_DIR
+    path = _pack_path(root, run_id)
+    if path is None:
+        raise FileNotFoundError(f"No snapshot pack for run '{run_id}' in {root}/runs")
+    endpoints = set(endpoints) if endpoints else None
+    categories = set(categories) if categories else None
+    product_ids = set(product_ids) if product_ids else None
+
+    # only bodies that are referenced again later need to stay in memory
+    conn = _connect(root)
+    try:
+        repeated = {sha for (sha,) in conn.execute(
+            "SELECT sha256 FROM snapshots WHERE run_id = ? GROUP BY sha256 HAVING COUNT(*) > 1", (run_id,))}
+    finally:
+        conn.close()
+    bodies: Dict[str, object] = {}
+
+    for line in _iter_lines(path):
+        entry = json.loads(line)
+        sha = entry["sha256"]
+        if "body" in entry:
+            if sha in repeated:
+                bodies[sha] = entry["body"]
+        else:
+            entry["body"] = bodies.get(sha)
+        if endpoints and entry["endpoint"] not in endpoints:
+            continue
+        if categories and entry["category"] not in categories:
+            continue
+        if product_ids and entry["product_id"] not in product_ids:
+            continue
+        yield entry
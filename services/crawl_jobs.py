@@ -0,0 +1,224 @@
+# services/crawl_jobs.py
+import os
+import socket
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models.model import CRAWL_JOBS
+
+logger = logging.getLogger(__name__)
+
+# A job that failed this many times is left as failed and not retried
+CRAWL_MAX_ATTEMPTS = int(os.getenv("CRAWL_MAX_ATTEMPTS", "5"))
+# Retry delay: CRAWL_BACKOFF_BASE * 2**(attempt-1) seconds with jitter, capped at CRAWL_BACKOFF_MAX
+CRAWL_BACKOFF_BASE = float(os.getenv("CRAWL_BACKOFF_BASE", "30"))
+CRAWL_BACKOFF_MAX = float(os.getenv("CRAWL_BACKOFF_MAX", "3600"))
+# A running job whose collector has not finished it within this many seconds is
+# assumed dead (crash, container restart) and can be claimed again
+CRAWL_JOB_LEASE = int(os.getenv("CRAWL_JOB_LEASE", "900"))
+# Jobs claimed per round-trip
+CRAWL_CLAIM_BATCH = int(os.getenv("CRAWL_CLAIM_BATCH", "10"))
+
+ENDPOINTS = ("details", "reviews")
+STATUSES = ("pending", "running", "done", "failed")
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with +-20% jitter so failed jobs of many workers do not retry in lockstep."""
+    delay = min(CRAWL_BACKOFF_MAX, CRAWL_BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# -------------------------
+# Seeding
+# -------------------------
+def seed_jobs(session: Session, category: str, product_ids: Iterable[int],
+              endpoints: Iterable[str] = ENDPOINTS, restart: bool = False) -> Dict[str, int]:
+    """
+    Make sure every (product, endpoint) of the category has a job. Existing jobs
+    keep their state, so an interrupted crawl resumes where it stopped. When the
+    previous pass finished (nothing pending, running or waiting for a retry) or
+    `restart` is set, all jobs of the category are reset for a fresh pass.
+    Commits. Returns {'added': n, 'reset': n}.
+    """
+    endpoints = list(endpoints)
+    existing = set(
+        session.query(CRAWL_JOBS.product_id, CRAWL_JOBS.endpoint)
+               .filter(CRAWL_JOBS.category == category).all()
+    )
+    if not restart and existing and not _has_open_work(session, category):
+        logger.info("Previous %s crawl pass is complete; starting a new one", category)
+        restart = True
+
+    reset = 0
+    if restart and existing:
+        reset = session.query(CRAWL_JOBS).filter(CRAWL_JOBS.category == category).update({
+            "status": "pending", "attempts": 0, "next_attempt_at": None,
+            "claimed_by": None, "claimed_at": None, "last_error": None,
+        }, synchronize_session=False)
+
+    new_rows = [
+        {"category": category, "product_id": pid, "endpoint": endpoint, "status": "pending", "attempts": 0}
+        for pid in product_ids for endpoint in endpoints
+        if (pid, endpoint) not in existing
+    ]
+    try:
+        if new_rows:
+            session.bulk_insert_mappings(CRAWL_JOBS, new_rows)
+        session.commit()
+    except IntegrityError:
+        # another collector seeded the same jobs first; theirs are as good as ours
+        session.rollback()
+        return seed_jobs(session, category, product_ids, endpoints)
+    return {"added": len(new_rows), "reset": reset}
+
+
+def _claimable(now: datetime):
+    return or_(
+        CRAWL_JOBS.status == "pending",
+        and_(CRAWL_JOBS.status == "failed", CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS,
+             CRAWL_JOBS.next_attempt_at <= now),
+        # a job that keeps killing its collector stops being reclaimed after CRAWL_MAX_ATTEMPTS
+        and_(CRAWL_JOBS.status == "running", CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS,
+             CRAWL_JOBS.claimed_at < now - timedelta(seconds=CRAWL_JOB_LEASE)),
+    )
+
+
+def _has_open_work(session: Session, category: str) -> bool:
+    """Anything pending, running (and alive or reclaimable) or failed-but-retryable in the category."""
+    lease_start = datetime.utcnow() - timedelta(seconds=CRAWL_JOB_LEASE)
+    return session.query(CRAWL_JOBS.id).filter(
+        CRAWL_JOBS.category == category,
+        or_(
+            CRAWL_JOBS.status == "pending",
+            and_(CRAWL_JOBS.status == "running",
+                 or_(CRAWL_JOBS.claimed_at >= lease_start, CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS)),
+            and_(CRAWL_JOBS.status == "failed", CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS),
+        ),
+    ).first() is not None
+
+
+# -------------------------
+# Claiming
+# -------------------------
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def release_dead_claims(session: Session, category: str) -> int:
+    """
+    Return jobs left running by collectors on this host that no longer exist
+    (or by an earlier life of this very worker id, as after a container restart
+    where the pid is reused) to pending, without waiting for CRAWL_JOB_LEASE.
+    Commits. Returns the number released.
+    """
+    me = worker_id()
+    host = socket.gethostname()
+    dead = []
+    for job_id, claimed_by in session.query(CRAWL_JOBS.id, CRAWL_JOBS.claimed_by).filter(
+            CRAWL_JOBS.category == category, CRAWL_JOBS.status == "running",
+            CRAWL_JOBS.claimed_by.like(f"{host}:%")):
+        pid = claimed_by.rsplit(":", 1)[-1]
+        if claimed_by == me or (pid.isdigit() and not _pid_alive(int(pid))):
+            dead.append(job_id)
+    if dead:
+        session.query(CRAWL_JOBS).filter(CRAWL_JOBS.id.in_(dead), CRAWL_JOBS.status == "running").update({
+            "status": "pending", "claimed_by": None, "claimed_at": None,
+        }, synchronize_session=False)
+    session.commit()
+    return len(dead)
+
+
+def claim_jobs(session: Session, category: str, worker: str, limit: int = None) -> List[Tuple[int, int, str]]:
+    """
+    Claim up to `limit` runnable jobs for `worker`: pending ones, failed ones whose
+    backoff has passed, and running ones whose lease expired. Each row is claimed
+    with a conditional UPDATE (compare-and-set on its state), so collectors
+    sharing the table never get the same job. Commits.
+    Returns [(job_id, product_id, endpoint)] ordered by product.
+    """
+    limit = limit or CRAWL_CLAIM_BATCH
+    now = datetime.utcnow()
+    candidates = session.query(CRAWL_JOBS.id, CRAWL_JOBS.product_id, CRAWL_JOBS.endpoint)\
+        .filter(CRAWL_JOBS.category == category, _claimable(now))\
+        .order_by(CRAWL_JOBS.product_id, CRAWL_JOBS.endpoint)\
+        .limit(limit * 2).all()  # extra rows in case other collectors win some of them
+
+    claimed = []
+    for job_id, product_id, endpoint in candidates:
+        won = session.query(CRAWL_JOBS).filter(CRAWL_JOBS.id == job_id, _claimable(now)).update({
+            "status": "running", "claimed_by": worker, "claimed_at": now,
+            "attempts": CRAWL_JOBS.attempts + 1,
+        }, synchronize_session=False)
+        if won:
+            claimed.append((job_id, product_id, endpoint))
+            if len(claimed) >= limit:
+                break
+    session.commit()
+    return claimed
+
+
+def complete_job(session: Session, job_id: int, worker: str):
+    """Mark a claimed job done. Caller commits (together with the data it stored)."""
+    session.query(CRAWL_JOBS).filter(CRAWL_JOBS.id == job_id, CRAWL_JOBS.claimed_by == worker).update({
+        "status": "done", "next_attempt_at": None, "last_error": None,
+    }, synchronize_session=False)
+
+
+def fail_job(session: Session, job_id: int, worker: str, error: str) -> Optional[datetime]:
+    """
+    Record a failed attempt. The job is retried after an exponential backoff until
+    CRAWL_MAX_ATTEMPTS is reached. Commits. Returns the retry time, or None if
+    the job has given up.
+    """
+    attempts = session.query(CRAWL_JOBS.attempts).filter(CRAWL_JOBS.id == job_id).scalar() or 0
+    retry_at = None
+    if attempts < CRAWL_MAX_ATTEMPTS:
+        retry_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(attempts))
+    session.query(CRAWL_JOBS).filter(CRAWL_JOBS.id == job_id, CRAWL_JOBS.claimed_by == worker).update({
+        "status": "failed", "next_attempt_at": retry_at, "last_error": (error or "")[:2000],
+    }, synchronize_session=False)
+    session.commit()
+    return retry_at
+
+
+# -------------------------
+# Progress
+# -------------------------
+def next_retry_in(session: Session, category: str) -> Optional[float]:
+    """Seconds until the earliest failed job of the category may be retried, or None."""
+    at = session.query(func.min(CRAWL_JOBS.next_attempt_at)).filter(
+        CRAWL_JOBS.category == category, CRAWL_JOBS.status == "failed",
+        CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS,
+    ).scalar()
+    if at is None:
+        return None
+    return max(0.0, (at - datetime.utcnow()).total_seconds())
+
+
+def crawl_progress(session: Session, category: str = None) -> Dict[str, int]:
+    """Job counts by status; failed jobs are split into retrying and given up."""
+    query = session.query(CRAWL_JOBS.status, CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS, func.count(CRAWL_JOBS.id))
+    if category:
+        query = query.filter(CRAWL_JOBS.category == category)
+    counts = {status: 0 for status in STATUSES}
+    counts["gave_up"] = 0
+    for status, retryable, n in query.group_by(CRAWL_JOBS.status, CRAWL_JOBS.attempts < CRAWL_MAX_ATTEMPTS):
+        if status == "failed" and not retryable:
+            counts["gave_up"] += n
+        counts[status] = counts.get(status, 0) + n
+    return counts
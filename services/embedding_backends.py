@@ -0,0 +1,115 @@
+# services/embedding_backends.py
+import os
+import zlib
+import logging
+from functools import lru_cache
+from typing import Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from services.text_normalizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+# openai | local
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+# Local backend: output dimension and character n-gram lengths
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "1024"))
+LOCAL_EMBEDDING_MIN_N = int(os.getenv("LOCAL_EMBEDDING_MIN_N", "2"))
+LOCAL_EMBEDDING_MAX_N = int(os.getenv("LOCAL_EMBEDDING_MAX_N", "4"))
+
+BACKENDS = ("openai", "local")
+
+
+# -------------------------
+# Local CPU backend
+# -------------------------
+@lru_cache(maxsize=200_000)
+def _bucket(feature: str, dim: int) -> int:
+    """Column for a hashed feature, encoded as -(column + 1) when the hash says to subtract it."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return -(h % dim) - 1 if h & 0x80000000 else h % dim
+
+
+class HashedNgramEmbeddings(Embeddings):
+    """
+    Feature-hashed bag of word tokens and character n-grams, projected to `dim`
+    columns with signed hashing, sublinear term weights and L2 normalization.
+    Runs on the CPU with no model files and no network, and is deterministic,
+    so an index built on one machine can be queried on another.
+    Tokens go through the shared text normalizer, so "آیفون" and "iphone" land
+    on the same feature.
+    """
+
+    model = "hashed-char-ngram-v1"
+
+    def __init__(self, dim: int = None, min_n: int = None, max_n: int = None):
+        self.dim = dim or LOCAL_EMBEDDING_DIM
+        self.min_n = min_n or LOCAL_EMBEDDING_MIN_N
+        self.max_n = max_n or LOCAL_EMBEDDING_MAX_N
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in tokenize(text):
+            features.append(f"w:{token}")
+            padded = f"<{token}>"
+            for n in range(self.min_n, self.max_n + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 matrix, one L2-normalized row per text."""
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            buckets = [_bucket(f, self.dim) for f in self._features(text or "")]
+            rows.extend([row] * len(buckets))
+            cols.extend(buckets)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        signs = np.where(cols < 0, -1.0, 1.0).astype(np.float32)
+        cols = np.where(cols < 0, -cols - 1, cols)
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (rows, cols), signs)
+        # sublinear tf: repeated n-grams in long reviews should not dominate
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+# -------------------------
+# Backend selection
+# -------------------------
+def get_embedding_backend(name: str = None) -> Embeddings:
+    """Embeddings for the configured backend (EMBEDDING_BACKEND), shared per process."""
+    name = (name or EMBEDDING_BACKEND).lower()
+    if name == "openai":
+        from services.llm_clients import get_embeddings
+        return get_embeddings()
+    if name == "local":
+        return _local_backend()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}'. Known: {', '.join(BACKENDS)}")
+
+
+@lru_cache(maxsize=1)
+def _local_backend() -> HashedNgramEmbeddings:
+    return HashedNgramEmbeddings()
+
+
+def describe_embeddings(embeddings: Embeddings) -> Dict:
+    """
+    What an index built with `embeddings` depends on: backend, model and, for the
+    local backend, its hashing parameters. Recorded in the index manifest.
+    """
+    # unwrap SingleFlightEmbeddings and similar wrappers
+    while hasattr(embeddings, "inner"):
+        embeddings = embeddings.inner
+    if isinstance(embeddings, HashedNgramEmbeddings):
+        return {"backend": "local", "model": embeddings.model, "dim": embeddings.dim,
+                "ngram_range": [embeddings.min_n, embeddings.max_n]}
+    return {"backend": "openai", "model": getattr(embeddings, "model", None)}
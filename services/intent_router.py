@@ -0,0 +1,262 @@
+# services/intent_router.py
+import os
+import math
+import time
+import zlib
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+from services.text_normalizer import normalize_text, tokenize
+from services.category_registry import CATEGORIES
+from services.product_service import catalog_snapshot, load_products, format_price
+
+logger = logging.getLogger(__name__)
+
+# Route greetings and simple price/color lookups without the agent
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# Minimum cosine similarity for the embedding classifier to decide an intent
+ROUTER_CLASSIFIER_MIN_SIM = float(os.getenv("ROUTER_CLASSIFIER_MIN_SIM", "0.45"))
+# Seconds the in-memory catalog index is reused before reloading from the DB
+ROUTER_CATALOG_TTL = int(os.getenv("ROUTER_CATALOG_TTL", "300"))
+# At most this many products are listed in a direct reply
+ROUTER_MAX_MATCHES = int(os.getenv("ROUTER_MAX_MATCHES", "5"))
+
+ROUTES = ("greeting", "thanks", "price_lookup", "color_lookup", "agent")
+
+# -------------------------
+# Vocabulary
+# -------------------------
+GREETING_WORDS = {"سلام", "درود", "hi", "hello", "hey", "خوبی", "خوبین", "وقت", "بخیر", "صبح", "عصر", "روز", "علیکم"}
+THANKS_WORDS = {"ممنون", "مرسی", "متشکرم", "سپاس", "thanks", "thank", "you", "خیلی", "خداحافظ", "bye"}
+PRICE_WORDS = {"قیمت", "چنده", "چند", "چقدر", "چقدره", "price", "cost", "how", "much"}
+COLOR_WORDS = {"رنگ", "رنگی", "رنگهای", "رنگهایی", "رنگای", "رنگها", "color", "colors", "colour"}
+# anything that needs reasoning, filtering or reviews goes to the agent
+COMPLEX_WORDS = {
+    "مقایسه", "نظر", "نظرات", "بهتر", "بهترین", "پیشنهاد", "زیر", "کمتر", "بیشتر", "ارزان", "ارزانترین",
+    "باتری", "دوربین", "کیفیت", "فرق", "تفاوت", "compare", "review", "reviews", "vs", "better", "under",
+}
+# words that carry no model information
+STOP_WORDS = PRICE_WORDS | COLOR_WORDS | {
+    "اپل", "apple", "است", "هست", "چه", "های", "هایی", "موجود", "داره", "دارد", "داره؟", "رو", "را", "برای",
+    "مدل", "of", "the", "is", "what", "which", "in", "اش", "ش", "و", "یه", "یک",
+}
+
+# -------------------------
+# Local embedding classifier
+# -------------------------
+_EMBED_DIM = 512
+
+INTENT_EXAMPLES = {
+    "greeting": ["سلام", "سلام وقت بخیر", "درود", "سلام خوبی", "صبح بخیر", "hi", "hello"],
+    "thanks": ["ممنون", "مرسی", "خیلی ممنون", "متشکرم", "خداحافظ", "thanks", "thank you"],
+    "price_lookup": [
+        "قیمت آیفون ۱۵ چنده", "آیفون ۱۳ چند است", "اپل واچ سری ۹ چقدر است",
+        "قیمت ساعت اپل سری ۸", "price of iphone 15", "iphone 15 pro max price",
+    ],
+    "color_lookup": [
+        "آیفون ۱۵ چه رنگ‌هایی دارد", "رنگ‌های اپل واچ سری ۹", "اپل واچ اولترا چه رنگی داره",
+        "iphone 14 colors", "what colors does iphone 15 come in",
+    ],
+    "agent": [
+        "یک آیفون سفید زیر ۴۰ میلیون می‌خوام", "نظر کاربران درباره باتری آیفون ۱۴ چیه",
+        "آیفون ۱۵ رو با ۱۴ مقایسه کن", "کدوم اپل واچ برای ورزش بهتره",
+        "یک گوشی با دوربین خوب و باتری قوی پیشنهاد بده", "compare iphone 14 and 15",
+    ],
+}
+
+
+def embed_text(text: str) -> List[float]:
+    """Hashed character 3-gram embedding: cheap, local and deterministic."""
+    padded = f" {normalize_text(text)} "
+    vec = [0.0] * _EMBED_DIM
+    for i in range(len(padded) - 2):
+        vec[zlib.crc32(padded[i:i + 3].encode("utf-8")) % _EMBED_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _centroids() -> Dict[str, List[float]]:
+    out = {}
+    for label, examples in INTENT_EXAMPLES.items():
+        vectors = [embed_text(e) for e in examples]
+        mean = [sum(col) / len(vectors) for col in zip(*vectors)]
+        norm = math.sqrt(sum(v * v for v in mean)) or 1.0
+        out[label] = [v / norm for v in mean]
+    return out
+
+
+_CENTROIDS = _centroids()
+
+
+def classify(text: str) -> Tuple[str, float]:
+    """Nearest-centroid intent over the local query embedding."""
+    vec = embed_text(text)
+    scores = {label: sum(a * b for a, b in zip(vec, c)) for label, c in _CENTROIDS.items()}
+    label = max(scores, key=scores.get)
+    return label, scores[label]
+
+
+# -------------------------
+# Catalog index
+# -------------------------
+class _CatalogIndex:
+    """In-memory token index over product titles, refreshed every ROUTER_CATALOG_TTL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._products: List[Dict] = []
+        self._postings: Dict[str, set] = {}
+
+    def _refresh(self):
+        products = catalog_snapshot()
+        postings: Dict[str, set] = {}
+        for i, p in enumerate(products):
+            p["tokens"] = set(tokenize(p["title"]))
+            for t in p["tokens"]:
+                postings.setdefault(t, set()).add(i)
+        self._products, self._postings = products, postings
+        self._loaded_at = time.monotonic()
+
+    def match(self, tokens: List[str], category: Optional[str]) -> List[Dict]:
+        """Products whose title contains every model token of the query."""
+        with self._lock:
+            if time.monotonic() - self._loaded_at > ROUTER_CATALOG_TTL:
+                self._refresh()
+            products, postings = self._products, self._postings
+        if not tokens:
+            return []
+        candidates = None
+        for t in tokens:
+            ids = postings.get(t, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        return [products[i] for i in candidates if not category or products[i]["category"] == category]
+
+
+_catalog = _CatalogIndex()
+
+
+# -------------------------
+# Stats
+# -------------------------
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def _record(route: str):
+    with _stats_lock:
+        _stats[route] += 1
+
+
+def get_router_stats() -> Dict:
+    with _stats_lock:
+        counts = {r: _stats.get(r, 0) for r in ROUTES}
+    total = sum(counts.values())
+    direct = total - counts["agent"]
+    return {
+        "total": total,
+        "counts": counts,
+        "direct_share": round(direct / total, 4) if total else 0.0,
+        "agent_share": round(counts["agent"] / total, 4) if total else 0.0,
+    }
+
+
+# -------------------------
+# Templates
+# -------------------------
+def _greeting_reply() -> str:
+    labels = " یا ".join(cfg.label_fa for cfg in CATEGORIES.values())
+    return f"سلام! 👋 من دستیار خرید شما در دیجی‌کالا هستم. دنبال چه محصولی هستید؟ ({labels})"
+
+
+def _thanks_reply() -> str:
+    return "خواهش می‌کنم! 🙏 اگر سوال دیگری درباره محصولات دارید، بپرسید."
+
+
+def _price_reply(products: List[Dict]) -> str:
+    products = sorted(products, key=lambda p: p["price_value"] or 0)
+    lines = [f"• {p['title']}: {format_price(p['price_value'])}" for p in products[:ROUTER_MAX_MATCHES]]
+    if len(products) > ROUTER_MAX_MATCHES:
+        lines.append(f"و {len(products) - ROUTER_MAX_MATCHES} مدل دیگر.")
+    return "قیمت‌های فعلی در دیجی‌کالا:\n" + "\n".join(lines) + "\n\nمی‌خواهید نظرات کاربران یا مقایسه مدل‌ها را هم ببینید؟"
+
+
+def _color_reply(products: List[Dict]) -> str:
+    records = load_products([p["product_id"] for p in products[:ROUTER_MAX_MATCHES]])
+    lines = []
+    for p in products[:ROUTER_MAX_MATCHES]:
+        colors = records.get(p["product_id"], {}).get("colors") or []
+        lines.append(f"• {p['title']}: {', '.join(colors) if colors else 'نامشخص'}")
+    return "رنگ‌های موجود:\n" + "\n".join(lines) + "\n\nرنگ مورد نظرتان کدام است؟"
+
+
+# -------------------------
+# Router
+# -------------------------
+def _detect_category(tokens: List[str]) -> Optional[str]:
+    for name, cfg in CATEGORIES.items():
+        if any(t in cfg.keywords for t in tokens):
+            return name
+    return None
+
+
+def route_message(message: str) -> Tuple[str, Optional[str]]:
+    """
+    Decide how to answer a user message. Returns (route, reply); reply is None when
+    the message must go to the agent. Rules run first, the local embedding
+    classifier breaks ties, and lookups are answered only on an unambiguous
+    catalog match so anything uncertain still reaches the agent.
+    """
+    route, reply = "agent", None
+    try:
+        if ROUTER_ENABLED and message and message.strip():
+            route, reply = _route(message)
+    except Exception as e:
+        logger.warning("Intent router failed, falling back to agent: %s", e)
+        route, reply = "agent", None
+    _record(route)
+    return route, reply
+
+
+def _route(message: str) -> Tuple[str, Optional[str]]:
+    tokens = tokenize(message)
+    words = set(tokens)
+    if not words or words & COMPLEX_WORDS:
+        return "agent", None
+
+    if words <= GREETING_WORDS:
+        return "greeting", _greeting_reply()
+    if words <= THANKS_WORDS:
+        return "thanks", _thanks_reply()
+
+    if words & COLOR_WORDS:
+        intent = "color_lookup"
+    elif words & PRICE_WORDS:
+        intent = "price_lookup"
+    else:
+        intent, similarity = classify(message)
+        if similarity < ROUTER_CLASSIFIER_MIN_SIM:
+            return "agent", None
+        if intent == "greeting" and len(tokens) <= 3:
+            return "greeting", _greeting_reply()
+        if intent == "thanks" and len(tokens) <= 3:
+            return "thanks", _thanks_reply()
+    if intent not in ("price_lookup", "color_lookup"):
+        return "agent", None
+
+    category = _detect_category(tokens)
+    keywords = {k for cfg in CATEGORIES.values() for k in cfg.keywords}
+    model_tokens = [t for t in tokens if t not in STOP_WORDS and t not in keywords]
+    # "price of an iPhone" without a model is a conversation, not a lookup
+    if not model_tokens:
+        return "agent", None
+
+    products = _catalog.match(model_tokens, category)
+    if not products:
+        return "agent", None
+    if intent == "price_lookup":
+        return "price_lookup", _price_reply(products)
+    return "color_lookup", _color_reply(products)
@@ -0,0 +1,164 @@
+# services/llm_clients.py
+import os
+import time
+import logging
+import threading
+import importlib.util
+from collections import deque
+from functools import lru_cache
+from typing import Dict
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain.chains import LLMChain
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv("MODEL", "gpt-4o-mini")
+# Per-request timeout (seconds) and retries for LLM and embedding calls
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Shared connection pool: total connections and idle keep-alive connections per process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "100"))
+LLM_POOL_KEEPALIVE = int(os.getenv("LLM_POOL_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 multiplexes requests over one TLS connection; needs the `h2` package
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+# Sent as OpenAI's prompt_cache_key so calls sharing our static prompt prefix are routed
+# to the same cache; empty disables it
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "dastyar-agent")
+
+
+# -------------------------
+# HTTP clients
+# -------------------------
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_POOL_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """One keep-alive pool per process, so TLS handshakes happen once per connection, not per call."""
+    logger.info("OpenAI HTTP pool: %d connections, http2=%s", LLM_POOL_SIZE, LLM_HTTP2)
+    return httpx.Client(limits=_limits(), http2=LLM_HTTP2, timeout=LLM_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def get_async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=_limits(), http2=LLM_HTTP2, timeout=LLM_TIMEOUT)
+
+
+# -------------------------
+# Prompt-cache accounting
+# -------------------------
+class PromptCacheStats(BaseCallbackHandler):
+    """Records input, cached and output tokens plus latency of every chat-model call."""
+
+    def __init__(self, recent: int = 50):
+        self._lock = threading.Lock()
+        self._started: Dict = {}
+        self.recent = deque(maxlen=recent)
+        self.totals = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+                       "latency_ms": 0.0, "cached_calls": 0, "cached_latency_ms": 0.0}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        latency_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        input_tokens = cached = output_tokens = 0
+        for generations in response.generations:
+            for gen in generations:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                cached += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        if not input_tokens:
+            # older integrations only report usage in llm_output
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+        with self._lock:
+            t = self.totals
+            t["calls"] += 1
+            t["input_tokens"] += input_tokens
+            t["cached_tokens"] += cached
+            t["output_tokens"] += output_tokens
+            t["latency_ms"] += latency_ms
+            if cached:
+                t["cached_calls"] += 1
+                t["cached_latency_ms"] += latency_ms
+            self.recent.append({"input_tokens": input_tokens, "cached_tokens": cached,
+                                "output_tokens": output_tokens, "latency_ms": round(latency_ms, 1)})
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            t = dict(self.totals)
+            recent = list(self.recent)
+        uncached_calls = t["calls"] - t["cached_calls"]
+        return {
+            "calls": t["calls"],
+            "input_tokens": t["input_tokens"],
+            "cached_tokens": t["cached_tokens"],
+            "output_tokens": t["output_tokens"],
+            "cached_share": round(t["cached_tokens"] / t["input_tokens"], 4) if t["input_tokens"] else 0.0,
+            "avg_latency_ms": round(t["latency_ms"] / t["calls"], 1) if t["calls"] else 0.0,
+            "avg_latency_ms_cached": round(t["cached_latency_ms"] / t["cached_calls"], 1) if t["cached_calls"] else 0.0,
+            "avg_latency_ms_uncached": round((t["latency_ms"] - t["cached_latency_ms"]) / uncached_calls, 1) if uncached_calls else 0.0,
+            "recent": recent,
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> Dict:
+    return prompt_cache_stats.get_stats()
+
+
+# -------------------------
+# Models
+# -------------------------
+@lru_cache(maxsize=None)
+def get_chat_model(temperature: float = 0.0, model: str = None) -> ChatOpenAI:
+    """Shared ChatOpenAI per (model, temperature), all on the process-wide connection pool."""
+    return ChatOpenAI(
+        model=model or LLM_MODEL,
+        temperature=temperature,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY} if PROMPT_CACHE_KEY else None,
+        callbacks=[prompt_cache_stats],
+    )
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_chain(template: str, temperature: float = 0.0) -> LLMChain:
+    """Prompt and LLMChain for a template, built once and reused by every call."""
+    return LLMChain(llm=get_chat_model(temperature), prompt=ChatPromptTemplate.from_template(template))
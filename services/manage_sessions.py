@@ -4,21 +4,43 @@ import os
 import json
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
-from langchain_core.messages import HumanMessage, AIMessage
-from models.model import Session , Message
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from models.model import Session , Message, MESSAGE_ARCHIVE
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-Base = declarative_base()
 engine = create_engine(DATABASE_URL, echo=False, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
 def init_db():
     """Create database tables (if they do not exist)."""
-    Base.metadata.create_all(bind=engine)
+    tables = [Session.__table__, Message.__table__, MESSAGE_ARCHIVE.__table__]
+    Session.metadata.create_all(bind=engine, tables=tables)
+    _ensure_schema()
+
+
+def _ensure_schema():
+    """Bring a sessions/messages schema created before retention up to date."""
+    # message index first: the backfill below looks up messages by session
+    for index in Message.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    columns = {c["name"] for c in inspect(engine).get_columns("sessions")}
+    with engine.begin() as conn:
+        for name, ddl in (("last_active_at", "TIMESTAMP"), ("message_count", "INTEGER DEFAULT 0"),
+                          ("summary", "TEXT"), ("working_set", "TEXT")):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE sessions ADD COLUMN {name} {ddl}"))
+        if "last_active_at" not in columns:
+            conn.execute(text("UPDATE sessions SET last_active_at = COALESCE("
+                              "(SELECT MAX(timestamp) FROM messages WHERE messages.session_id = sessions.session_id), "
+                              "created_at)"))
+            conn.execute(text("UPDATE sessions SET message_count = "
+                              "(SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.session_id)"))
+    for index in Session.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 
 def get_or_create_session(user_context='creator') -> str:
@@ -33,12 +55,25 @@ def get_or_create_session(user_context='creator') -> str:
     return session_id
 
 
+def session_exists(session_id: str) -> bool:
+    """Whether a session with this id was created."""
+    db = SessionLocal()
+    try:
+        return db.query(Session.session_id).filter(Session.session_id == session_id).first() is not None
+    finally:
+        db.close()
+
+
 def save_message(session_id: str, sender_type: str, content: str):
     """Save a new message to the database."""
     db = SessionLocal()
     try:
-        message = Message(session_id=session_id, sender_type=sender_type, content=content)
+        now = datetime.utcnow()
+        message = Message(session_id=session_id, sender_type=sender_type, content=content, timestamp=now)
         db.add(message)
+        db.query(Session).filter(Session.session_id == session_id).update({
+            "last_active_at": now, "message_count": Session.message_count + 1,
+        }, synchronize_session=False)
         db.commit()
     except Exception as e:
         print(f"❌ Failed to save message: {e}")
@@ -48,14 +83,21 @@ def save_message(session_id: str, sender_type: str, content: str):
 
 
 def load_messages(session_id: str, limit: int = 10):
-    """Load messages to reconstruct chat history (last n messages)."""
+    """
+    Load messages to reconstruct chat history (last n messages, oldest first).
+    If older messages were archived, their rolling summary comes first.
+    """
     db = SessionLocal()
     messages = []
     try:
+        summary = db.query(Session.summary).filter(Session.session_id == session_id).scalar()
+        if summary:
+            messages.append(SystemMessage(content=f"خلاصه گفتگوی قبلی:\n{summary}"))
+        # newest first on the (session_id, timestamp, id) index, then back to chronological order
         query = db.query(Message).filter(Message.session_id == session_id)\
-                                 .order_by(Message.timestamp.asc())\
+                                 .order_by(Message.timestamp.desc(), Message.id.desc())\
                                  .limit(limit)
-        for msg in query.all():
+        for msg in reversed(query.all()):
             if msg.sender_type == 'human':
                 messages.append(HumanMessage(content=msg.content))
             elif msg.sender_type == 'ai':
@@ -65,6 +107,16 @@ def load_messages(session_id: str, limit: int = 10):
     return messages
 
 
+def load_archived_messages(session_id: str):
+    """Archived (compacted) history of a session: [{sender_type, content, timestamp}], oldest first."""
+    from services.message_archive import load_archived_messages as _load
+    db = SessionLocal()
+    try:
+        return _load(db, session_id)
+    finally:
+        db.close()
+
+
 # -------------------------
 # Initial run
 # -------------------------
@@ -0,0 +1,222 @@
+# services/message_archive.py
+# Retention for the `messages` table. A background job (or scripts/compact_messages.py
+# from cron) moves the messages of idle sessions, and the oldest messages of very long
+# ones, into one compressed row per session in `messages_archive`, and folds them
+# into the session's rolling summary. `messages` then only holds the live window of
+# recent sessions, so per-turn history lookups stay flat as total volume grows.
+import os
+import json
+import time
+import zlib
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import exists
+from models.model import Session, Message, MESSAGE_ARCHIVE
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for this many days are moved to the archive
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "30"))
+# Live messages kept per active session; older ones are archived (0 = no limit)
+MESSAGE_LIVE_WINDOW = int(os.getenv("MESSAGE_LIVE_WINDOW", "200"))
+# Archived sessions whose last message is older than this are deleted (0 = keep forever)
+MESSAGE_ARCHIVE_RETENTION_DAYS = float(os.getenv("MESSAGE_ARCHIVE_RETENTION_DAYS", "365"))
+# Seconds between background compaction runs in each API process (0 = disabled)
+MESSAGE_COMPACTION_INTERVAL = float(os.getenv("MESSAGE_COMPACTION_INTERVAL", "3600"))
+# Sessions compacted per transaction
+MESSAGE_COMPACTION_BATCH = int(os.getenv("MESSAGE_COMPACTION_BATCH", "200"))
+# Only one process per host runs the job; the others skip while this lock is held
+MESSAGE_COMPACTION_LOCK = os.getenv("MESSAGE_COMPACTION_LOCK", "/tmp/dastyar-message-compaction.lock")
+# Summarize archived messages with the LLM instead of the extractive summary
+MESSAGE_SUMMARY_LLM = os.getenv("MESSAGE_SUMMARY_LLM", "0") == "1"
+# Upper bound on the rolling summary kept per session (characters)
+MESSAGE_SUMMARY_CHARS = int(os.getenv("MESSAGE_SUMMARY_CHARS", "1200"))
+
+
+# -------------------------
+# Payload
+# -------------------------
+def _encode(history: List[Dict]) -> bytes:
+    return zlib.compress(json.dumps(history, ensure_ascii=False).encode("utf-8"), 9)
+
+
+def _decode(payload: Optional[bytes]) -> List[Dict]:
+    return json.loads(zlib.decompress(payload).decode("utf-8")) if payload else []
+
+
+def load_archived_messages(db, session_id: str) -> List[Dict]:
+    """Full archived history of a session, oldest first: [{sender_type, content, timestamp}]."""
+    archive = db.get(MESSAGE_ARCHIVE, session_id)
+    return _decode(archive.payload) if archive else []
+
+
+# -------------------------
+# Rolling summary
+# -------------------------
+_LAST_ANSWER = "آخرین پاسخ: "
+
+
+def _extractive_summary(previous: Optional[str], messages: List[Message]) -> str:
+    """The user's requests in order plus the last answer, newest kept when over the limit."""
+    requests = [line for line in (previous or "").splitlines() if line and not line.startswith(_LAST_ANSWER)]
+    requests += ["- " + " ".join(m.content.split())[:200] for m in messages if m.sender_type == "human" and m.content]
+    answers = [m.content for m in messages if m.sender_type == "ai" and m.content]
+    last_answer = [_LAST_ANSWER + " ".join(answers[-1].split())[:300]] if answers else \
+        [line for line in (previous or "").splitlines() if line.startswith(_LAST_ANSWER)]
+    lines = requests + last_answer
+    while len("\n".join(lines)) > MESSAGE_SUMMARY_CHARS and len(lines) > 1:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def rolling_summary(previous: Optional[str], messages: List[Message]) -> str:
+    """Fold `messages` into the session's summary (LLM when MESSAGE_SUMMARY_LLM=1, else extractive)."""
+    if MESSAGE_SUMMARY_LLM:
+        try:
+            from services.llm_clients import get_chain
+            from services.prompts import SESSION_SUMMARY_PROMPT
+            transcript = "\n".join(f"{m.sender_type}: {m.content}" for m in messages)
+            summary = get_chain(SESSION_SUMMARY_PROMPT).run({"previous": previous or "-", "messages": transcript})
+            return summary.strip()[:MESSAGE_SUMMARY_CHARS]
+        except Exception as e:
+            logger.warning("LLM session summary failed, using the extractive one: %s", e)
+    return _extractive_summary(previous, messages)
+
+
+# -------------------------
+# Compaction
+# -------------------------
+def archive_session(db, session_id: str, keep: int = 0) -> int:
+    """
+    Move all but the newest `keep` messages of a session into its archive row and
+    summary. Caller commits. Returns the number of messages moved.
+    """
+    rows = db.query(Message).filter(Message.session_id == session_id)\
+             .order_by(Message.timestamp.asc(), Message.id.asc()).all()
+    move = rows[:len(rows) - keep] if keep else rows
+    if not move:
+        return 0
+
+    archive = db.get(MESSAGE_ARCHIVE, session_id)
+    history = _decode(archive.payload) if archive else []
+    history += [{"sender_type": m.sender_type, "content": m.content,
+                 "timestamp": m.timestamp.isoformat() if m.timestamp else None} for m in move]
+    if archive is None:
+        archive = MESSAGE_ARCHIVE(session_id=session_id, first_at=move[0].timestamp)
+        db.add(archive)
+    archive.payload = _encode(history)
+    archive.message_count = len(history)
+    archive.last_at = move[-1].timestamp
+    archive.archived_at = datetime.utcnow()
+
+    session = db.get(Session, session_id)
+    if session is not None:
+        session.summary = rolling_summary(session.summary, move)
+    db.query(Session).filter(Session.session_id == session_id).update(
+        {"message_count": Session.message_count - len(move)}, synchronize_session=False)
+    db.query(Message).filter(Message.id.in_([m.id for m in move])).delete(synchronize_session=False)
+    return len(move)
+
+
+def compact_messages(now: datetime = None) -> Dict[str, int]:
+    """
+    One retention pass: archive idle sessions, trim sessions over the live window
+    and delete archives past their retention. Safe to re-run; each session is its
+    own transaction.
+    """
+    from services.manage_sessions import SessionLocal
+
+    now = now or datetime.utcnow()
+    stats = {"archived_sessions": 0, "trimmed_sessions": 0, "moved_messages": 0, "purged_sessions": 0}
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        # idle sessions that still have live messages
+        idle_before = now - timedelta(days=MESSAGE_RETENTION_DAYS)
+        while True:
+            batch = [sid for (sid,) in db.query(Session.session_id).filter(
+                Session.last_active_at < idle_before,
+                exists().where(Message.session_id == Session.session_id),
+            ).limit(MESSAGE_COMPACTION_BATCH)]
+            if not batch:
+                break
+            for sid in batch:
+                stats["moved_messages"] += archive_session(db, sid)
+                stats["archived_sessions"] += 1
+            db.commit()
+
+        # active sessions that outgrew the live window
+        if MESSAGE_LIVE_WINDOW:
+            for (sid,) in db.query(Session.session_id).filter(Session.message_count > MESSAGE_LIVE_WINDOW).all():
+                stats["moved_messages"] += archive_session(db, sid, keep=MESSAGE_LIVE_WINDOW)
+                stats["trimmed_sessions"] += 1
+                db.commit()
+
+        # archives past retention go entirely, session row included
+        if MESSAGE_ARCHIVE_RETENTION_DAYS:
+            purge_before = now - timedelta(days=MESSAGE_ARCHIVE_RETENTION_DAYS)
+            expired = [sid for (sid,) in db.query(MESSAGE_ARCHIVE.session_id).join(
+                Session, Session.session_id == MESSAGE_ARCHIVE.session_id, isouter=True,
+            ).filter(MESSAGE_ARCHIVE.last_at < purge_before,
+                     (Session.last_active_at < purge_before) | (Session.session_id.is_(None)))]
+            for i in range(0, len(expired), MESSAGE_COMPACTION_BATCH):
+                chunk = expired[i:i + MESSAGE_COMPACTION_BATCH]
+                db.query(Message).filter(Message.session_id.in_(chunk)).delete(synchronize_session=False)
+                db.query(MESSAGE_ARCHIVE).filter(MESSAGE_ARCHIVE.session_id.in_(chunk)).delete(synchronize_session=False)
+                db.query(Session).filter(Session.session_id.in_(chunk)).delete(synchronize_session=False)
+                db.commit()
+            stats["purged_sessions"] = len(expired)
+    except Exception as e:
+        logger.exception("Message compaction failed: %s", e)
+        db.rollback()
+    finally:
+        db.close()
+    logger.info("Message compaction in %.1fs: %s", time.perf_counter() - started, stats)
+    return stats
+
+
+# -------------------------
+# Background job
+# -------------------------
+def _run_locked() -> Optional[Dict[str, int]]:
+    """Run one pass unless another process on this host is already running one."""
+    try:
+        import fcntl
+    except ImportError:
+        return compact_messages()
+    fd = os.open(MESSAGE_COMPACTION_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    try:
+        return compact_messages()
+    finally:
+        os.close(fd)  # closing the descriptor drops the flock
+
+
+_started = False
+
+
+def start_compaction_thread(interval: float = None):
+    """Start the periodic compaction job in a daemon thread (once per process)."""
+    global _started
+    interval = MESSAGE_COMPACTION_INTERVAL if interval is None else interval
+    if _started or interval <= 0:
+        return
+    _started = True
+
+    def loop():
+        while True:
+            # jitter so the workers of one deployment do not all wake together
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            try:
+                _run_locked()
+            except Exception as e:
+                logger.exception("Message compaction failed: %s", e)
+
+    threading.Thread(target=loop, name="message-compaction", daemon=True).start()
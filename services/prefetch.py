@@ -0,0 +1,229 @@
+# services/prefetch.py
+# Speculative prefetch. The agent's script is predictable: after a search returns
+# candidates the user usually asks for reviews, then prices or a comparison. When
+# rag_tool returns products, the review summaries and price trends of the top
+# candidates are computed in the background, within a token budget, so those
+# follow-up turns are served from a warm cache. Every prefetched entry is
+# accounted as used (a later tool call took it) or wasted (it expired unused).
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from langchain_community.callbacks import get_openai_callback
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to turn speculative prefetch off
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+# Candidates of a result list that are prefetched
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "3"))
+# Seconds a prefetched result stays usable; unused ones then count as wasted
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "900"))
+# LLM tokens prefetch may spend per hour in each process
+PREFETCH_TOKEN_BUDGET = int(os.getenv("PREFETCH_TOKEN_BUDGET", "200000"))
+# Background threads, and tasks allowed to wait for them (extra tasks are dropped)
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "16"))
+# Skip prefetch while the agent admission load (in flight + queued / limit) is above this
+PREFETCH_MAX_LOAD = float(os.getenv("PREFETCH_MAX_LOAD", "0.5"))
+# Entries kept in the warm cache
+PREFETCH_CACHE_SIZE = int(os.getenv("PREFETCH_CACHE_SIZE", "2000"))
+
+
+class _Entry:
+    __slots__ = ("value", "tokens", "cost", "expires_at", "used")
+
+    def __init__(self, value: Any, tokens: int, cost: float, expires_at: float):
+        self.value = value
+        self.tokens = tokens
+        self.cost = cost
+        self.expires_at = expires_at
+        self.used = False
+
+
+class _TokenBudget:
+    """Token bucket refilled at `per_hour` tokens per hour."""
+
+    def __init__(self, per_hour: int):
+        self.capacity = float(per_hour)
+        self.tokens = float(per_hour)
+        self.updated = time.monotonic()
+
+    def available(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 3600)
+        self.updated = now
+        return self.tokens
+
+    def spend(self, tokens: int):
+        self.available()
+        self.tokens -= tokens
+
+
+class Prefetcher:
+    """
+    Warm cache filled by background tasks. `schedule(kind, key, fn)` runs `fn`
+    off the request path unless it is cached, already running, over budget, or
+    the server is busy; `take(kind, key)` hands a fresh result to the tool that
+    needs it.
+    """
+
+    def __init__(self, ttl: float = None, token_budget: int = None, workers: int = None,
+                 max_pending: int = None, cache_size: int = None):
+        self.ttl = PREFETCH_TTL if ttl is None else ttl
+        self.max_pending = max_pending or PREFETCH_MAX_PENDING
+        self.cache_size = cache_size or PREFETCH_CACHE_SIZE
+        self._budget = _TokenBudget(PREFETCH_TOKEN_BUDGET if token_budget is None else token_budget)
+        self._executor = ThreadPoolExecutor(max_workers=workers or PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._running = set()
+        self.stats = {
+            "scheduled": 0, "completed": 0, "failed": 0,
+            "skipped_cached": 0, "skipped_budget": 0, "skipped_busy": 0, "skipped_queue": 0,
+            "hits": 0, "misses": 0, "used": 0, "wasted": 0,
+            "tokens_spent": 0, "tokens_used": 0, "tokens_wasted": 0,
+            "cost_spent": 0.0, "cost_wasted": 0.0,
+        }
+
+    # ---- cache ----
+    def _retire_locked(self, key: tuple, entry: _Entry):
+        """Account an entry leaving the cache."""
+        if not entry.used:
+            self.stats["wasted"] += 1
+            self.stats["tokens_wasted"] += entry.tokens
+            self.stats["cost_wasted"] += entry.cost
+
+    def _evict_locked(self, now: float):
+        for key in [k for k, e in self._cache.items() if e.expires_at <= now]:
+            self._retire_locked(key, self._cache.pop(key))
+        while len(self._cache) > self.cache_size:
+            self._retire_locked(*self._cache.popitem(last=False))
+
+    def take(self, kind: str, key) -> Optional[Any]:
+        """A prefetched result for (kind, key), or None. Results stay cached until they expire."""
+        with self._lock:
+            self._evict_locked(time.monotonic())
+            entry = self._cache.get((kind, key))
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            if not entry.used:
+                entry.used = True
+                self.stats["used"] += 1
+                self.stats["tokens_used"] += entry.tokens
+            return entry.value
+
+    # ---- scheduling ----
+    def _busy(self) -> bool:
+        from services.admission import admission
+        return admission.load() > PREFETCH_MAX_LOAD
+
+    def schedule(self, kind: str, key, fn: Callable[[], Any], est_tokens: int = 0) -> bool:
+        """Run `fn` in the background and cache its result under (kind, key). Returns True if queued."""
+        cache_key = (kind, key)
+        with self._lock:
+            self._evict_locked(time.monotonic())
+            if cache_key in self._cache or cache_key in self._running:
+                self.stats["skipped_cached"] += 1
+                return False
+            if len(self._running) >= self.max_pending:
+                self.stats["skipped_queue"] += 1
+                return False
+            if est_tokens and self._budget.available() < est_tokens:
+                self.stats["skipped_budget"] += 1
+                return False
+            if self._busy():
+                self.stats["skipped_busy"] += 1
+                return False
+            self._running.add(cache_key)
+            self.stats["scheduled"] += 1
+        self._executor.submit(self._run, cache_key, fn)
+        return True
+
+    def _run(self, cache_key: tuple, fn: Callable[[], Any]):
+        try:
+            # counts the LLM tokens this task spends (calls coalesced with a live request spend none)
+            with get_openai_callback() as cb:
+                value = fn()
+            tokens, cost = cb.total_tokens, cb.total_cost
+        except Exception as e:
+            logger.warning("Prefetch %s failed: %s", cache_key, e)
+            with self._lock:
+                self._running.discard(cache_key)
+                self.stats["failed"] += 1
+            return
+        with self._lock:
+            self._running.discard(cache_key)
+            self._budget.spend(tokens)
+            self.stats["completed"] += 1
+            self.stats["tokens_spent"] += tokens
+            self.stats["cost_spent"] += cost
+            if value is None:
+                return
+            self._cache[cache_key] = _Entry(value, tokens, cost, time.monotonic() + self.ttl)
+            self._evict_locked(time.monotonic())
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            self._evict_locked(time.monotonic())
+            s = dict(self.stats)
+            resolved = s["used"] + s["wasted"]
+            lookups = s["hits"] + s["misses"]
+            return {
+                **s,
+                "cost_spent": round(s["cost_spent"], 6),
+                "cost_wasted": round(s["cost_wasted"], 6),
+                "cached": len(self._cache),
+                "running": len(self._running),
+                "budget_left": int(self._budget.available()),
+                # share of lookups served warm, and of finished prefetches that were used
+                "hit_rate": round(s["hits"] / lookups, 3) if lookups else 0.0,
+                "use_rate": round(s["used"] / resolved, 3) if resolved else 0.0,
+                "waste_rate_tokens": round(s["tokens_wasted"] / (s["tokens_used"] + s["tokens_wasted"]), 3)
+                if s["tokens_used"] + s["tokens_wasted"] else 0.0,
+            }
+
+
+prefetcher = Prefetcher()
+
+
+def get_prefetch_stats() -> Dict:
+    return prefetcher.get_stats()
+
+
+# -------------------------
+# Next-step data
+# -------------------------
+# rough tokens of one review summary call (20 reviews in, a paragraph out)
+_SUMMARY_TOKENS = 1500
+
+
+def prefetch_for_candidates(products: List[Dict]):
+    """Warm the review summary and price trend of the top candidates of a result list."""
+    if not PREFETCH_ENABLED or not isinstance(products, list):
+        return
+    product_ids = []
+    for p in products:
+        source = p.get("source") if isinstance(p, dict) else None
+        pid = source.get("product_id") if isinstance(source, dict) else None
+        if pid and pid not in product_ids:
+            product_ids.append(pid)
+    for pid in product_ids[:PREFETCH_TOP_K]:
+        prefetcher.schedule("price_trend", (int(pid), 30), lambda pid=pid: _price_trend(int(pid)))
+        prefetcher.schedule("review_summary", (int(pid), 20), lambda pid=pid: _review_summary(int(pid)),
+                            est_tokens=_SUMMARY_TOKENS)
+
+
+def _price_trend(product_id: int) -> Dict:
+    from services.price_service import price_trend
+    return price_trend(product_id, days=30)
+
+
+def _review_summary(product_id: int) -> Optional[str]:
+    from services.agent_creator import summarize_stored_reviews
+    return summarize_stored_reviews(product_id, max_reviews=20)
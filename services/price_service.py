@@ -0,0 +1,157 @@
+# services/price_service.py
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import func, and_
+from sqlalchemy.orm import Session
+from databases.database import SessionLocal
+from models.model import PRICE_HISTORY, PRICE_DAILY
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------
+# Ingest
+# -------------------------
+def _latest_prices(session: Session, product_ids: List[int], at: datetime = None) -> Dict[int, int]:
+    """
+    Latest recorded price for each product, or the price in effect at `at` (last
+    change at or before it), via the (product_id, recorded_at) index.
+    """
+    if not product_ids:
+        return {}
+    latest = session.query(
+        PRICE_HISTORY.product_id,
+        func.max(PRICE_HISTORY.recorded_at).label("recorded_at"),
+    ).filter(PRICE_HISTORY.product_id.in_(list(product_ids)))
+    if at is not None:
+        latest = latest.filter(PRICE_HISTORY.recorded_at <= at)
+    latest = latest.group_by(PRICE_HISTORY.product_id).subquery()
+    rows = session.query(PRICE_HISTORY.product_id, PRICE_HISTORY.price).join(
+        latest,
+        and_(PRICE_HISTORY.product_id == latest.c.product_id, PRICE_HISTORY.recorded_at == latest.c.recorded_at),
+    )
+    return {pid: price for pid, price in rows}
+
+
+def record_price_changes(session: Session, prices: Dict[int, int], at: datetime = None) -> int:
+    """
+    Append a price_history row for every product whose price differs from its
+    latest recorded one (or that has no history yet), and fold the change into
+    the daily rollup. Unchanged prices write nothing. Caller commits.
+    With `at` (replayed snapshots, UTC) prices are compared with the price in
+    effect at that time, so replaying an older run into a populated history only
+    adds the changes that really happened then.
+    Returns the number of changes written.
+    """
+    # live crawls compare with the newest row; a replay with the row in effect at `at`
+    latest = _latest_prices(session, list(prices), at=at)
+    at = at or datetime.utcnow()
+    changed = {pid: price for pid, price in prices.items() if price is not None and latest.get(pid) != price}
+    if not changed:
+        return 0
+
+    session.bulk_insert_mappings(PRICE_HISTORY, [
+        {"product_id": pid, "price": price, "recorded_at": at} for pid, price in changed.items()
+    ])
+
+    day = at.date()
+    existing = {
+        r.product_id: r for r in session.query(PRICE_DAILY)
+        .filter(PRICE_DAILY.day == day, PRICE_DAILY.product_id.in_(list(changed)))
+    }
+    for pid, price in changed.items():
+        row = existing.get(pid)
+        if row is None:
+            # the day also covers the price carried over from before the change
+            previous = latest.get(pid)
+            low = min(price, previous) if previous is not None else price
+            high = max(price, previous) if previous is not None else price
+            session.add(PRICE_DAILY(product_id=pid, day=day, min_price=low, max_price=high, last_price=price))
+        else:
+            row.min_price = min(row.min_price, price)
+            row.max_price = max(row.max_price, price)
+            row.last_price = price
+    # SessionLocal does not autoflush; make the rollup rows visible to the next call
+    session.flush()
+    return len(changed)
+
+
+# -------------------------
+# Queries
+# -------------------------
+def latest_prices(product_ids: List[int]) -> Dict[int, int]:
+    db = SessionLocal()
+    try:
+        return _latest_prices(db, product_ids)
+    finally:
+        db.close()
+
+
+def price_at(product_id: int, at: datetime) -> Optional[int]:
+    """Price in effect at time `at` (last change at or before it)."""
+    db = SessionLocal()
+    try:
+        row = db.query(PRICE_HISTORY.price)\
+                .filter(PRICE_HISTORY.product_id == product_id, PRICE_HISTORY.recorded_at <= at)\
+                .order_by(PRICE_HISTORY.recorded_at.desc())\
+                .first()
+        return row[0] if row else None
+    finally:
+        db.close()
+
+
+def daily_rollup(product_id: int, days: int = 30) -> List[Dict]:
+    """Daily min/max/last for days on which the price changed."""
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    db = SessionLocal()
+    try:
+        rows = db.query(PRICE_DAILY)\
+                 .filter(PRICE_DAILY.product_id == product_id, PRICE_DAILY.day >= since)\
+                 .order_by(PRICE_DAILY.day.asc())
+        return [
+            {"day": r.day.isoformat(), "min": r.min_price, "max": r.max_price, "last": r.last_price}
+            for r in rows
+        ]
+    finally:
+        db.close()
+
+
+def price_trend(product_id: int, days: int = 30) -> Dict:
+    """
+    Answer "has this gotten cheaper?": compare the current price with the price in
+    effect `days` ago, plus the min/max seen in between. Two index range lookups.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    db = SessionLocal()
+    try:
+        changes = db.query(PRICE_HISTORY.price, PRICE_HISTORY.recorded_at)\
+                    .filter(PRICE_HISTORY.product_id == product_id, PRICE_HISTORY.recorded_at > since)\
+                    .order_by(PRICE_HISTORY.recorded_at.asc())\
+                    .all()
+        before = db.query(PRICE_HISTORY.price)\
+                   .filter(PRICE_HISTORY.product_id == product_id, PRICE_HISTORY.recorded_at <= since)\
+                   .order_by(PRICE_HISTORY.recorded_at.desc())\
+                   .first()
+    finally:
+        db.close()
+
+    start = before[0] if before else (changes[0].price if changes else None)
+    if start is None:
+        return {"product_id": product_id, "days": days, "history": [], "message": "No price history recorded."}
+
+    current = changes[-1].price if changes else start
+    seen = [start] + [c.price for c in changes]
+    change = current - start
+    return {
+        "product_id": product_id,
+        "days": days,
+        "start_price": start,
+        "current_price": current,
+        "min_price": min(seen),
+        "max_price": max(seen),
+        "change": change,
+        "change_pct": round(change * 100.0 / start, 2) if start else None,
+        "cheaper": change < 0,
+        "history": [{"price": c.price, "recorded_at": c.recorded_at.isoformat()} for c in changes],
+    }
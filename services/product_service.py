@@ -0,0 +1,72 @@
+# services/product_service.py
+from typing import List, Dict
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+from databases.database import SessionLocal
+from models.model import PRODUCTS, PRODUCT_COLORS
+from services.text_normalizer import color_names
+
+
+def format_price(selling_price) -> str:
+    return f"{selling_price:,} تومان" if selling_price else "Unknown"
+
+
+def _to_dict(p) -> Dict:
+    return {
+        "product_id": p.product_id,
+        "category": p.category,
+        "title": p.title_fa,
+        "price": format_price(p.selling_price),
+        "price_value": p.selling_price,
+        "colors": [c.title for c in p.colors],
+        "url": p.relative_url,
+    }
+
+
+def load_products(product_ids: List[int]) -> Dict[int, Dict]:
+    """Structured product records (title, price, colors, url, category) keyed by product_id."""
+    if not product_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        query = db.query(PRODUCTS).options(selectinload(PRODUCTS.colors))\
+                  .filter(PRODUCTS.product_id.in_(list(product_ids)))
+        return {p.product_id: _to_dict(p) for p in query}
+    finally:
+        db.close()
+
+
+def find_products(category: str = None, min_price: int = None, max_price: int = None,
+                  color: str = None, limit: int = 20) -> List[Dict]:
+    """
+    Structured catalog filter over any category. Category + price range is served
+    by the (category, selling_price) index; results are cheapest first.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(PRODUCTS).options(selectinload(PRODUCTS.colors))
+        if category:
+            query = query.filter(PRODUCTS.category == category)
+        if min_price:
+            query = query.filter(PRODUCTS.selling_price >= min_price)
+        if max_price:
+            query = query.filter(PRODUCTS.selling_price <= max_price)
+        if color:
+            # any stored spelling of the color: "مشکی", "سیاه", "Black", ...
+            query = query.filter(PRODUCTS.colors.any(or_(*[PRODUCT_COLORS.title.contains(n) for n in color_names(color)])))
+        return [_to_dict(p) for p in query.order_by(PRODUCTS.selling_price.asc()).limit(limit)]
+    finally:
+        db.close()
+
+
+def catalog_snapshot() -> List[Dict]:
+    """Lightweight (product_id, category, title, price) rows for in-memory lookup indexes."""
+    db = SessionLocal()
+    try:
+        rows = db.query(PRODUCTS.product_id, PRODUCTS.category, PRODUCTS.title_fa, PRODUCTS.selling_price)
+        return [
+            {"product_id": pid, "category": category, "title": title or "", "price_value": price}
+            for pid, category, title, price in rows
+        ]
+    finally:
+        db.close()
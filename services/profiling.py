@@ -0,0 +1,432 @@
+# services/profiling.py
+# Opt-in memory and CPU profiling for the API servers (PROFILING_ENABLED=1).
+#
+# - Memory: tracemalloc snapshots on an interval, diffed by allocation site against
+#   the first snapshot (steady growth) and the previous one (recent growth), next to
+#   the process RSS and live counts of the LangChain objects suspected of piling up.
+# - CPU: a share of requests (PROFILING_SAMPLE_RATE, or any request sent with
+#   `X-Profile: 1` by an admin) is sampled with a stack sampler that watches only
+#   the thread running that request's endpoint, and only while the endpoint's own
+#   call is on its stack. Samples are weighted by the CPU time the thread used, so
+#   time blocked on the LLM counts for nothing, and written as folded stacks (`frame;frame;frame <microseconds>`) that
+#   flamegraph.pl, speedscope and inferno read directly.
+#
+# Admin endpoints live under /admin/profiling; see install_profiling().
+import os
+import gc
+import sys
+import time
+import uuid
+import random
+import asyncio
+import logging
+import functools
+import threading
+import tracemalloc
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# tracemalloc makes allocation-heavy code several times slower; set to 0 for CPU sampling only
+PROFILING_TRACEMALLOC = os.getenv("PROFILING_TRACEMALLOC", "1") == "1"
+# Seconds between tracemalloc snapshots
+PROFILING_SNAPSHOT_INTERVAL = float(os.getenv("PROFILING_SNAPSHOT_INTERVAL", "300"))
+# Stack depth tracemalloc records per allocation (more = slower, better attribution)
+PROFILING_TRACE_FRAMES = int(os.getenv("PROFILING_TRACE_FRAMES", "5"))
+# Allocation sites returned by the memory endpoint
+PROFILING_TOP_N = int(os.getenv("PROFILING_TOP_N", "25"))
+# Share of requests CPU-sampled (0..1)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+# Seconds between stack samples of a profiled request
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005"))
+# Where folded-stack profiles are written, and how many are kept
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "200"))
+# Required in the X-Admin-Token header; when unset, admin endpoints answer localhost only
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+
+# live instances counted at every snapshot; a steadily rising count is a leak
+TRACKED_TYPES = (
+    "LLMChain", "ChatPromptTemplate", "ChatOpenAI", "AgentExecutor",
+    "HumanMessage", "AIMessage", "SystemMessage", "Document",
+)
+
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+                  "<unknown>")
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _count_types() -> Dict[str, int]:
+    wanted = set(TRACKED_TYPES)
+    counts = Counter(type(o).__name__ for o in gc.get_objects() if type(o).__name__ in wanted)
+    return {name: counts.get(name, 0) for name in TRACKED_TYPES}
+
+
+# -------------------------
+# Memory
+# -------------------------
+class MemoryProfiler:
+    """Periodic tracemalloc snapshots and their growth by allocation site."""
+
+    def __init__(self, interval: float = None, frames: int = None):
+        self.interval = PROFILING_SNAPSHOT_INTERVAL if interval is None else interval
+        self.frames = frames or PROFILING_TRACE_FRAMES
+        self._lock = threading.Lock()
+        self._baseline = None
+        self._previous = None
+        self._latest = None
+        self.history = deque(maxlen=288)  # one day at the default interval
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.snapshot()
+        threading.Thread(target=self._loop, name="tracemalloc-snapshots", daemon=True).start()
+        logger.info("tracemalloc profiling on: %d frames, snapshot every %.0fs", self.frames, self.interval)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except Exception as e:
+                logger.warning("tracemalloc snapshot failed: %s", e)
+
+    def snapshot(self) -> Dict:
+        """Take a snapshot now; returns its summary row."""
+        snap = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, f) for f in _IGNORED_FILES]
+        )
+        traced, peak = tracemalloc.get_traced_memory()
+        row = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rss_mb": round((_rss_bytes() or 0) / 1e6, 1),
+            "traced_mb": round(traced / 1e6, 1),
+            "traced_peak_mb": round(peak / 1e6, 1),
+            "objects": _count_types(),
+        }
+        with self._lock:
+            if self._baseline is None:
+                self._baseline = snap
+            self._previous, self._latest = self._latest, snap
+            self.history.append(row)
+        return row
+
+    def top_growth(self, top: int = None, group_by: str = "lineno", since: str = "baseline") -> Dict:
+        """
+        Allocation sites that grew the most between the baseline (or previous)
+        snapshot and the latest one. `group_by` is 'lineno', 'filename' or 'traceback'.
+        """
+        top = top or PROFILING_TOP_N
+        with self._lock:
+            old = self._baseline if since == "baseline" else self._previous
+            new = self._latest
+            history = list(self.history)
+        if old is None or new is None:
+            return {"since": since, "sites": [], "history": history,
+                    "note": None if PROFILING_TRACEMALLOC else "PROFILING_TRACEMALLOC=0"}
+
+        stats = new.compare_to(old, group_by)
+        stats.sort(key=lambda s: s.size_diff, reverse=True)
+        sites = []
+        for s in stats[:top]:
+            frames = [f"{f.filename}:{f.lineno}" for f in s.traceback]
+            sites.append({
+                "site": frames[0] if group_by != "traceback" else frames[-1],
+                "traceback": frames if group_by == "traceback" else None,
+                "size_diff_kb": round(s.size_diff / 1024, 1),
+                "size_kb": round(s.size / 1024, 1),
+                "count_diff": s.count_diff,
+                "count": s.count,
+            })
+        return {
+            "since": since,
+            "group_by": group_by,
+            "total_growth_kb": round(sum(s.size_diff for s in stats) / 1024, 1),
+            "sites": sites,
+            "history": history,
+        }
+
+
+# -------------------------
+# CPU sampling
+# -------------------------
+def _thread_cpu(ident: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def _reaches(frame, anchor) -> bool:
+    while frame is not None:
+        if frame is anchor:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of the threads attached to it every `interval`
+    seconds while running. A thread is attached with the frame of the call being
+    profiled, and a sample only counts while that frame is on the thread's stack,
+    so an event loop thread contributes only while the request's own coroutine
+    runs. Each sample is weighted by the CPU microseconds the thread used since
+    the previous sample, or by wall time where per-thread CPU clocks are unavailable.
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or PROFILING_SAMPLE_INTERVAL
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.threads = set()  # idents ever attached
+        self._targets: Dict[int, object] = {}  # ident -> anchor frame
+        self._last_cpu: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, ident: int, anchor):
+        """Sample thread `ident` while `anchor` (a frame) is on its stack."""
+        cpu = _thread_cpu(ident)
+        with self._lock:
+            self._targets[ident] = anchor
+            self.threads.add(ident)
+            if cpu is not None:
+                self._last_cpu[ident] = cpu
+
+    def detach(self, ident: int):
+        with self._lock:
+            self._targets.pop(ident, None)
+            self._last_cpu.pop(ident, None)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last_wall = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            wall_us = (now - last_wall) * 1e6
+            last_wall = now
+            with self._lock:
+                targets = dict(self._targets)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for ident, anchor in targets.items():
+                frame = frames.get(ident)
+                cpu = _thread_cpu(ident)
+                with self._lock:
+                    if ident not in self._targets:
+                        continue  # detached meanwhile
+                    if cpu is None:
+                        weight = wall_us
+                    else:
+                        # the CPU clock advances even when the sample is not counted, so
+                        # time spent on other work is never attributed to this request
+                        weight = (cpu - self._last_cpu[ident]) * 1e6 if ident in self._last_cpu else 0
+                        self._last_cpu[ident] = cpu
+                if frame is not None and weight >= 1 and _reaches(frame, anchor):
+                    self.stacks[_fold(frame)] += int(weight)
+            del frames
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {us}" for stack, us in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """Decides which requests are sampled and keeps their folded profiles on disk."""
+
+    def __init__(self, rate: float = None, directory: str = None, keep: int = None):
+        self.rate = PROFILING_SAMPLE_RATE if rate is None else rate
+        self.directory = directory or PROFILING_DIR
+        self.recent = deque(maxlen=keep or PROFILING_KEEP)
+        self._lock = threading.Lock()
+
+    def should_sample(self, forced: bool = False) -> bool:
+        return forced or (self.rate > 0 and random.random() < self.rate)
+
+    def save(self, sampler: StackSampler, path: str, wall_s: float, cpu_s: float) -> Dict:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{path.strip('/').replace('/', '_') or 'root'}-{uuid.uuid4().hex[:6]}.folded"
+        with open(os.path.join(self.directory, name), "w", encoding="utf-8") as f:
+            f.write(sampler.folded() + "\n")
+        entry = {"name": name, "path": path, "scope": "request", "threads": len(sampler.threads),
+                 "wall_ms": round(wall_s * 1000, 1),
+                 "process_cpu_ms": round(cpu_s * 1000, 1), "samples": sampler.samples,
+                 "sampled_cpu_ms": round(sum(sampler.stacks.values()) / 1000, 1)}
+        with self._lock:
+            if len(self.recent) == self.recent.maxlen:
+                old = self.recent[0]["name"]
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+            self.recent.append(entry)
+        return entry
+
+    def read(self, name: str) -> Optional[str]:
+        with self._lock:
+            known = {e["name"] for e in self.recent}
+        if name not in known:  # never open arbitrary paths
+            return None
+        with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+            return f.read()
+
+
+memory_profiler = MemoryProfiler()
+request_profiler = RequestProfiler()
+
+# sampler of the request being profiled; copied into the endpoint's thread with the context
+_active_sampler: ContextVar[Optional[StackSampler]] = ContextVar("active_sampler", default=None)
+
+
+def _attached(endpoint):
+    """
+    Wrap an endpoint so that, when its request is profiled, the thread running it
+    (the event loop for async endpoints, a threadpool worker for sync ones) is
+    attached to the request's sampler for the duration of the call.
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            sampler = _active_sampler.get()
+            if sampler is None:
+                return await endpoint(*args, **kwargs)
+            ident = threading.get_ident()
+            sampler.attach(ident, sys._getframe())
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                sampler.detach(ident)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            sampler = _active_sampler.get()
+            if sampler is None:
+                return endpoint(*args, **kwargs)
+            ident = threading.get_ident()
+            sampler.attach(ident, sys._getframe())
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                sampler.detach(ident)
+    return wrapper
+
+
+# -------------------------
+# FastAPI wiring
+# -------------------------
+def _is_admin(request) -> bool:
+    if PROFILING_ADMIN_TOKEN:
+        return request.headers.get("x-admin-token") == PROFILING_ADMIN_TOKEN
+    return request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost")
+
+
+def install_profiling(app):
+    """
+    Add the profiling middleware and /admin/profiling endpoints to `app` when
+    PROFILING_ENABLED=1. Call it before declaring routes: only routes declared
+    afterwards are sampled.
+    """
+    if not PROFILING_ENABLED:
+        return
+    from fastapi import HTTPException, Request
+    from fastapi.responses import PlainTextResponse
+    from fastapi.routing import APIRoute
+
+    class ProfiledRoute(APIRoute):
+        def __init__(self, path, endpoint, **kwargs):
+            super().__init__(path, _attached(endpoint), **kwargs)
+
+    # routes declared after this call attach their thread to a profiled request's sampler
+    app.router.route_class = ProfiledRoute
+
+    if PROFILING_TRACEMALLOC:
+        @app.on_event("startup")
+        def start_memory_profiler():
+            memory_profiler.start()
+
+    @app.middleware("http")
+    async def sample_requests(request: Request, call_next):
+        forced = request.headers.get("x-profile") == "1" and _is_admin(request)
+        if request.url.path.startswith("/admin/") or not request_profiler.should_sample(forced):
+            return await call_next(request)
+        wall, cpu = time.perf_counter(), time.process_time()
+        sampler = StackSampler()
+        token = _active_sampler.set(sampler)
+        try:
+            with sampler:
+                response = await call_next(request)
+        finally:
+            _active_sampler.reset(token)
+        entry = request_profiler.save(sampler, request.url.path, time.perf_counter() - wall, time.process_time() - cpu)
+        response.headers["X-Profile-Id"] = entry["name"]
+        return response
+
+    def _check(request: Request):
+        if not _is_admin(request):
+            raise HTTPException(status_code=403, detail="Admin only")
+
+    @app.get("/admin/profiling/memory")
+    def memory_growth(request: Request, top: int = PROFILING_TOP_N, group_by: str = "lineno",
+                      since: str = "baseline"):
+        _check(request)
+        if group_by not in ("lineno", "filename", "traceback") or since not in ("baseline", "previous"):
+            raise HTTPException(status_code=400, detail="group_by: lineno|filename|traceback, since: baseline|previous")
+        return memory_profiler.top_growth(top, group_by, since)
+
+    @app.post("/admin/profiling/memory/snapshot")
+    def memory_snapshot(request: Request):
+        _check(request)
+        if not tracemalloc.is_tracing():
+            raise HTTPException(status_code=409, detail="tracemalloc is off (PROFILING_TRACEMALLOC=0)")
+        return memory_profiler.snapshot()
+
+    @app.get("/admin/profiling/profiles")
+    def list_profiles(request: Request):
+        _check(request)
+        return list(reversed(request_profiler.recent))
+
+    @app.get("/admin/profiling/profiles/{name}", response_class=PlainTextResponse)
+    def get_profile(name: str, request: Request):
+        _check(request)
+        text = request_profiler.read(name)
+        if text is None:
+            raise HTTPException(status_code=404, detail="Unknown profile")
+        return text
+
+    logger.info("Profiling enabled: sampling %.1f%% of requests to %s/", request_profiler.rate * 100,
+                request_profiler.directory)
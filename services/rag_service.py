@@ -1,46 +1,74 @@
 import os
 import logging
 from functools import lru_cache
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from typing import List, Dict, Tuple
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.vectorstores import FAISS  
+from services.vector_index import load_vector_store, set_search_params
+from services.singleflight import SingleFlightEmbeddings
+from services.llm_clients import get_chat_model
+from services.embedding_backends import get_embedding_backend
+from services.prompts import RAG_ANSWER_PROMPT
+from services.retrieval_client import RETRIEVAL_SERVICE_URL, remote_search
 
 # root path
 VECTOR_DIR = "vectorstore"
 FAISS_INDEX_PATH = os.path.join(VECTOR_DIR, "faiss_index")
+FAISS_REVIEW_INDEX_PATH = os.path.join(VECTOR_DIR, "faiss_review_index")
+# Load the indexes when this module is imported instead of on the first request
+PRELOAD_INDEXES = os.getenv("PRELOAD_INDEXES", "0") == "1"
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+def _load_vector_store(path: str, embeddings):
+    """Load a persisted FAISS store (memory-mapped when FAISS_MMAP=1) and apply the query-time nprobe/efSearch settings."""
+    vector_store = load_vector_store(path, embeddings)
+    set_search_params(vector_store.index)
+    return vector_store
+
+
 @lru_cache(maxsize=1)
-def get_rag_chain():
+def get_product_vector_store():
     """
-    Load the RAG chain from the FAISS vector database.
-    Uses the embeddings and persisted vectorstore for retrieval.
-    The result is cached to avoid re-loading on every request.
+    Load the product FAISS index once per process. The RAG chain and the
+    retriever share it instead of each holding their own copy.
     """
-    embeddings = OpenAIEmbeddings()
+    embeddings = SingleFlightEmbeddings(get_embedding_backend())
 
     try:
         if not os.path.exists(FAISS_INDEX_PATH):
             logger.error("Vector database not found at '%s'", FAISS_INDEX_PATH)
             return None
 
-        vector_store = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)# 🔁 لود FAISS
+        vector_store = _load_vector_store(FAISS_INDEX_PATH, embeddings)
+        logger.info("Product FAISS index loaded from %s", FAISS_INDEX_PATH)
+        return vector_store
+
+    except Exception as e:
+        logger.exception("Error loading product FAISS index: %s", e)
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_rag_chain():
+    """
+    Load the RAG chain from the FAISS vector database.
+    Uses the embeddings and persisted vectorstore for retrieval.
+    The result is cached to avoid re-loading on every request.
+    """
+    try:
+        vector_store = get_product_vector_store()# 🔁 لود FAISS
+        if vector_store is None:
+            return None
         retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 5})
 
         
-        rag_prompt = ChatPromptTemplate.from_template(
-            """براساس اطلاعات زیر پاسخ کاربر را بده. پاسخ‌ها دقیق و به فارسی باشند.
-Context: {context}
-Question: {input}
-Answer:"""
-        )
-
-        llm = ChatOpenAI(model=os.getenv("MODEL", "gpt-4o-mini"), temperature=0)
+        rag_prompt = ChatPromptTemplate.from_template(RAG_ANSWER_PROMPT)
+
+        llm = get_chat_model(temperature=0)
         document_chain = create_stuff_documents_chain(llm, rag_prompt)
 
         # 🔗 RAG chain
@@ -59,14 +87,10 @@ def get_vector_retriever(k: int = 5):
     Load and return a FAISS retriever for direct retrieval of Documents.
     Cached so repeated calls are cheap.
     """
-    embeddings = OpenAIEmbeddings()
-
     try:
-        if not os.path.exists(FAISS_INDEX_PATH):
-            logger.error("Vector database not found at '%s'", FAISS_INDEX_PATH)
+        vector_store = get_product_vector_store()
+        if vector_store is None:
             return None
-
-        vector_store = FAISS.load_local(FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
         retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": k})
         logger.info("FAISS retriever created (k=%d) from %s", k, FAISS_INDEX_PATH)
         return retriever
@@ -74,3 +98,82 @@ def get_vector_retriever(k: int = 5):
     except Exception as e:
         logger.exception("Error loading FAISS retriever: %s", e)
         return None
+
+
+@lru_cache(maxsize=1)
+def get_review_vector_store():
+    """
+    Load the review-chunk FAISS index (one vector per review chunk, with
+    `product_id` metadata). Cached so repeated calls are cheap.
+    """
+    embeddings = SingleFlightEmbeddings(get_embedding_backend())
+
+    try:
+        if not os.path.exists(FAISS_REVIEW_INDEX_PATH):
+            logger.error("Review vector database not found at '%s'", FAISS_REVIEW_INDEX_PATH)
+            return None
+
+        vector_store = _load_vector_store(FAISS_REVIEW_INDEX_PATH, embeddings)
+        logger.info("Review FAISS index loaded from %s", FAISS_REVIEW_INDEX_PATH)
+        return vector_store
+
+    except Exception as e:
+        logger.exception("Error loading review FAISS index: %s", e)
+        return None
+
+
+def preload_indexes():
+    """
+    Load every FAISS index now instead of on the first request. Runs at import
+    time when PRELOAD_INDEXES=1, so a preloading master (gunicorn --preload)
+    loads them once and forked workers share the pages copy-on-write.
+    """
+    get_product_vector_store()
+    get_review_vector_store()
+
+
+def retrieve_documents(query: str, k: int = 10, index: str = "product") -> List[Tuple]:
+    """
+    (Document, L2 distance) pairs for a query from the product or review index.
+    With RETRIEVAL_SERVICE_URL set the search runs in the batched retrieval
+    service; if it is unreachable this process searches its own index instead.
+    """
+    if RETRIEVAL_SERVICE_URL:
+        try:
+            return remote_search(query, k=k, index=index)
+        except Exception as e:
+            logger.warning("Retrieval service unavailable, searching locally: %s", e)
+
+    vector_store = get_product_vector_store() if index == "product" else get_review_vector_store()
+    if vector_store is None:
+        return []
+    return vector_store.similarity_search_with_score(query, k=k)
+
+
+def search_products_by_reviews(query: str, k_chunks: int = 40, top_products: int = 5, snippets_per_product: int = 3) -> List[Dict]:
+    """
+    Opinion-style retrieval ("battery drains fast"): find the review chunks closest
+    to the query, then aggregate them per product. A product's score is the sum of
+    its chunk similarities, so several matching reviews outrank one lucky match.
+    Returns [{'product_id', 'score', 'matches', 'snippets'}] best first.
+    """
+    hits = retrieve_documents(query, k=k_chunks, index="review")
+    products: Dict[int, Dict] = {}
+    for doc, distance in hits:
+        pid = doc.metadata.get("product_id")
+        if pid is None:
+            continue
+        # FAISS returns L2 distances; map to a (0, 1] similarity
+        similarity = 1.0 / (1.0 + float(distance))
+        entry = products.setdefault(pid, {"product_id": pid, "score": 0.0, "matches": 0, "snippets": []})
+        entry["score"] += similarity
+        entry["matches"] += 1
+        if len(entry["snippets"]) < snippets_per_product:
+            entry["snippets"].append(doc.page_content)
+
+    ranked = sorted(products.values(), key=lambda e: e["score"], reverse=True)
+    return ranked[:top_products]
+
+
+if PRELOAD_INDEXES:
+    preload_indexes()
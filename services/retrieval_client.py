@@ -0,0 +1,39 @@
+# services/retrieval_client.py
+import os
+import logging
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import httpx
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# http://host:port or unix:///path/to.sock of services/retrieval_service.py; empty = search in-process
+RETRIEVAL_SERVICE_URL = os.getenv("RETRIEVAL_SERVICE_URL", "")
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+
+
+@lru_cache(maxsize=1)
+def _client() -> httpx.Client:
+    """One pooled client per process; unix:// URLs go over the Unix socket."""
+    if RETRIEVAL_SERVICE_URL.startswith("unix://"):
+        transport = httpx.HTTPTransport(uds=RETRIEVAL_SERVICE_URL[len("unix://"):])
+        return httpx.Client(transport=transport, base_url="http://retrieval", timeout=RETRIEVAL_TIMEOUT)
+    return httpx.Client(base_url=RETRIEVAL_SERVICE_URL, timeout=RETRIEVAL_TIMEOUT)
+
+
+def remote_search(query: str, k: int = 10, index: str = "product") -> List[Tuple[Document, float]]:
+    """(Document, L2 distance) pairs from the retrieval service, best first."""
+    response = _client().post("/search", json={"query": query, "k": k, "index": index})
+    response.raise_for_status()
+    return [
+        (Document(page_content=hit["page_content"], metadata=hit["metadata"]), hit["score"])
+        for hit in response.json()["results"]
+    ]
+
+
+def remote_stats() -> Dict:
+    """Per-index batching stats of the retrieval service."""
+    response = _client().get("/stats")
+    response.raise_for_status()
+    return response.json()
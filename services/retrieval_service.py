@@ -0,0 +1,173 @@
+# services/retrieval_service.py
+# Standalone retrieval service. API workers send queries here instead of searching
+# their own FAISS copy; concurrent queries are micro-batched so one embedding call
+# and one FAISS `search` over the query matrix serve the whole batch.
+#
+# Run one process (batching needs all queries in one place):
+#   uvicorn services.retrieval_service:app --uds /tmp/dastyar-retrieval.sock
+#   uvicorn services.retrieval_service:app --port 8100
+# and point the API at it with RETRIEVAL_SERVICE_URL.
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# How long the first query of a batch waits for others to join
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "5"))
+# Upper bound on queries embedded and searched together
+RETRIEVAL_MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "64"))
+
+INDEXES = ("product", "review")
+
+
+# -------------------------
+# Batched search
+# -------------------------
+def search_batch(vector_store, queries: List[str], k: int) -> List[List[Dict]]:
+    """
+    Embed all queries in one call and run one FAISS search over the query matrix.
+    Returns, per query, up to k hits as {'page_content', 'metadata', 'score'}
+    with the same L2 scores as `similarity_search_with_score`.
+    """
+    vectors = np.asarray(vector_store.embedding_function.embed_documents(queries), dtype="float32")
+    distances, ids = vector_store.index.search(vectors, k)
+    results = []
+    for dist_row, id_row in zip(distances, ids):
+        hits = []
+        for distance, i in zip(dist_row, id_row):
+            if i == -1:
+                continue
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[int(i)])
+            hits.append({"page_content": doc.page_content, "metadata": doc.metadata, "score": float(distance)})
+        results.append(hits)
+    return results
+
+
+class MicroBatcher:
+    """
+    Collect queries for up to `window_ms` (or until `max_batch` arrive) and run
+    them through `search_fn(queries, k)` together. Identical queries in a batch
+    are searched once; k is the largest one asked for and each caller gets its own
+    top-k slice.
+    """
+
+    def __init__(self, search_fn: Callable[[List[str], int], List[List[Dict]]],
+                 window_ms: float = None, max_batch: int = None):
+        self.search_fn = search_fn
+        self.window = (RETRIEVAL_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_batch = max_batch or RETRIEVAL_MAX_BATCH
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queries": 0, "batches": 0, "largest_batch": 0, "search_ms": 0.0}
+
+    async def search(self, query: str, k: int) -> List[Dict]:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, k, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, int, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            queries = list(dict.fromkeys(q for q, _, _ in batch))
+            k = max(k for _, k, _ in batch)
+            started = time.perf_counter()
+            try:
+                # embedding + FAISS release the event loop while they run
+                results = await asyncio.to_thread(self.search_fn, queries, k)
+            except Exception as e:
+                logger.exception("Batched retrieval failed: %s", e)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            by_query = dict(zip(queries, results))
+            for query, k_i, future in batch:
+                if not future.done():
+                    future.set_result(by_query[query][:k_i])
+
+            self.stats["queries"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            self.stats["search_ms"] += (time.perf_counter() - started) * 1000
+
+    def get_stats(self) -> Dict:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch": round(self.stats["queries"] / batches, 2) if batches else 0.0,
+            "avg_batch_ms": round(self.stats["search_ms"] / batches, 2) if batches else 0.0,
+        }
+
+
+# -------------------------
+# Service
+# -------------------------
+def _load_store(index: str):
+    from services.rag_service import get_product_vector_store, get_review_vector_store
+    return get_product_vector_store() if index == "product" else get_review_vector_store()
+
+
+_batchers: Dict[str, MicroBatcher] = {}
+
+
+def get_batcher(index: str) -> MicroBatcher:
+    if index not in _batchers:
+        store = _load_store(index)
+        if store is None:
+            raise HTTPException(status_code=503, detail=f"{index} index is not available")
+        _batchers[index] = MicroBatcher(lambda queries, k: search_batch(store, queries, k))
+    return _batchers[index]
+
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = 10
+    index: str = "product"
+
+
+app = FastAPI(title="Dastyar Retrieval Service")
+
+
+@app.on_event("startup")
+def _warm_up():
+    # load the indexes before the first query instead of inside it
+    for index in INDEXES:
+        try:
+            get_batcher(index)
+        except HTTPException as e:
+            logger.warning("Retrieval service: %s", e.detail)
+
+
+@app.post("/search")
+async def search_endpoint(data: SearchRequest):
+    if data.index not in INDEXES:
+        raise HTTPException(status_code=400, detail=f"Unknown index '{data.index}'. Known: {', '.join(INDEXES)}")
+    results = await get_batcher(data.index).search(data.query, max(1, data.k))
+    return {"results": results}
+
+
+@app.get("/stats")
+def stats_endpoint():
+    return {index: b.get_stats() for index, b in _batchers.items()}
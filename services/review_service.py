@@ -0,0 +1,125 @@
+# services/review_service.py
+import logging
+from datetime import datetime
+from typing import List, Dict, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from databases.database import SessionLocal
+from models.model import PRODUCT_REVIEWS
+from services.text_normalizer import normalize_chars
+
+logger = logging.getLogger(__name__)
+
+
+def parse_comment(comment: Dict) -> Dict:
+    """Map one Digikala rate-review comment to a `reviews` row."""
+    reactions = comment.get("reactions") or {}
+    rate = comment.get("rate")
+    try:
+        rate = int(rate) if rate not in (None, "") else None
+    except (TypeError, ValueError):
+        rate = None
+    return {
+        "comment_id": comment.get("id"),
+        "rate": rate,
+        "is_buyer": comment.get("review_user_type") == "buyer" or bool(comment.get("is_buyer")),
+        "title": normalize_chars(comment.get("title")) or None,
+        "body": normalize_chars(comment.get("body")),
+        "likes": reactions.get("likes") or 0,
+        "created_at": comment.get("created_at"),
+    }
+
+
+# -------------------------
+# Ingest
+# -------------------------
+def store_reviews(session: Session, product_id: int, category: str, comments: List[Dict]) -> Tuple[int, int]:
+    """
+    Bulk upsert comments for one product, deduplicated by comment id.
+    New comments are inserted, known ones refreshed (rate/likes/body may change).
+    Returns (inserted, updated). Caller commits.
+    """
+    rows: Dict[int, Dict] = {}
+    for c in comments:
+        row = parse_comment(c)
+        if row["comment_id"] and row["body"]:
+            rows[row["comment_id"]] = {**row, "product_id": product_id, "category": category, "fetched_at": datetime.utcnow()}
+    if not rows:
+        return 0, 0
+
+    existing = dict(
+        session.query(PRODUCT_REVIEWS.comment_id, PRODUCT_REVIEWS.id)
+               .filter(PRODUCT_REVIEWS.comment_id.in_(list(rows)))
+               .all()
+    )
+    inserts = [r for cid, r in rows.items() if cid not in existing]
+    updates = [{**r, "id": existing[cid]} for cid, r in rows.items() if cid in existing]
+    if inserts:
+        session.bulk_insert_mappings(PRODUCT_REVIEWS, inserts)
+    if updates:
+        session.bulk_update_mappings(PRODUCT_REVIEWS, updates)
+    return len(inserts), len(updates)
+
+
+# -------------------------
+# Queries
+# -------------------------
+def _ranking():
+    # buyers first, then most liked, then most recent (Digikala ids grow over time)
+    return (
+        PRODUCT_REVIEWS.is_buyer.desc(),
+        PRODUCT_REVIEWS.likes.desc(),
+        PRODUCT_REVIEWS.comment_id.desc(),
+    )
+
+
+def _to_dict(r) -> Dict:
+    return {
+        "comment_id": r.comment_id,
+        "product_id": r.product_id,
+        "rate": r.rate,
+        "is_buyer": bool(r.is_buyer),
+        "title": r.title,
+        "body": r.body,
+        "likes": r.likes,
+        "created_at": r.created_at,
+    }
+
+
+def top_reviews(product_id: int, k: int = 20, min_rate: int = None, buyers_only: bool = False) -> List[Dict]:
+    """Top-k reviews of one product selected and ranked in SQL."""
+    db = SessionLocal()
+    try:
+        query = db.query(PRODUCT_REVIEWS).filter(PRODUCT_REVIEWS.product_id == product_id)
+        if min_rate is not None:
+            query = query.filter(PRODUCT_REVIEWS.rate >= min_rate)
+        if buyers_only:
+            query = query.filter(PRODUCT_REVIEWS.is_buyer.is_(True))
+        return [_to_dict(r) for r in query.order_by(*_ranking()).limit(k).all()]
+    finally:
+        db.close()
+
+
+def top_reviews_bulk(product_ids: List[int], k: int = 20) -> Dict[int, List[Dict]]:
+    """Top-k reviews for several products in one query (ROW_NUMBER per product)."""
+    if not product_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        ranked = db.query(
+            PRODUCT_REVIEWS,
+            func.row_number().over(partition_by=PRODUCT_REVIEWS.product_id, order_by=_ranking()).label("rn"),
+        ).filter(PRODUCT_REVIEWS.product_id.in_(list(product_ids))).subquery()
+        rows = db.query(ranked).filter(ranked.c.rn <= k).order_by(ranked.c.product_id, ranked.c.rn).all()
+        out: Dict[int, List[Dict]] = {}
+        for r in rows:
+            out.setdefault(r.product_id, []).append(_to_dict(r))
+        return out
+    finally:
+        db.close()
+
+
+def format_review(review: Dict) -> str:
+    """One-line rendering used in prompts."""
+    user_type = "🛒 Buyer" if review.get("is_buyer") else "👤 User"
+    return f"{user_type} | Rating: {review.get('rate', '')} | {review.get('body', '')}"
@@ -0,0 +1,124 @@
+# services/singleflight.py
+import os
+import json
+import time
+import copy
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+from langchain_core.embeddings import Embeddings
+from services.text_normalizer import normalize_chars, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# How long (seconds) a finished call's result is served to identical requests
+SINGLEFLIGHT_TTL = float(os.getenv("SINGLEFLIGHT_TTL", "5"))
+
+
+def make_key(*parts) -> str:
+    """Stable key for a call from its (JSON-able) arguments."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the first caller for a key executes the
+    function, callers arriving while it runs wait for and share its outcome, and
+    a successful result is kept for `ttl` seconds for late arrivals.
+    Errors are shared with the waiters of that flight only, never cached.
+    Results are deep-copied per caller so nobody mutates a shared object.
+    """
+
+    def __init__(self, name: str, ttl: float = None):
+        self.name = name
+        self.ttl = SINGLEFLIGHT_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"calls": 0, "executions": 0, "shared_inflight": 0, "shared_recent": 0}
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            self.stats["calls"] += 1
+            self._evict_expired()
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            elif call.finished_at is None:
+                self.stats["shared_inflight"] += 1
+            else:
+                self.stats["shared_recent"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._calls.pop(key, None)
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.event.set()
+        if self.ttl <= 0:
+            with self._lock:
+                self._calls.pop(key, None)
+        return copy.deepcopy(call.result)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [k for k, c in self._calls.items() if c.finished_at is not None and now - c.finished_at > self.ttl]
+        for k in expired:
+            del self._calls[k]
+
+
+# -------------------------
+# Shared groups
+# -------------------------
+tool_flight = SingleFlight("tools")
+llm_flight = SingleFlight("llm")
+embedding_flight = SingleFlight("embeddings")
+
+
+def get_singleflight_stats() -> Dict[str, Dict]:
+    return {g.name: dict(g.stats) for g in (tool_flight, llm_flight, embedding_flight)}
+
+
+class SingleFlightEmbeddings(Embeddings):
+    """Embeddings wrapper that coalesces identical concurrent embed_query calls."""
+
+    def __init__(self, inner: Embeddings, flight: SingleFlight = None):
+        self.inner = inner
+        self.flight = flight or embedding_flight
+
+    def embed_query(self, text: str) -> List[float]:
+        # spelling variants of one query ("آيفون ۱۵" / "آیفون 15") share one embedding call
+        text = normalize_chars(text)
+        return self.flight.do(make_key("embed_query", normalize_text(text)), self.inner.embed_query, text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.inner.aembed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
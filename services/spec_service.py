@@ -0,0 +1,303 @@
+# services/spec_service.py
+import json
+import re
+import logging
+from typing import List, Dict, Optional, Iterable
+from sqlalchemy.orm import Session
+from databases.database import SessionLocal
+from models.model import SPEC_ATTRIBUTES, PRODUCTS
+from services.product_service import load_products
+from services.text_normalizer import normalize_text, mentions_keyword
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Canonical attribute keys
+# -------------------------
+# Digikala titles vary slightly between categories; map the common ones to a
+# stable key so tools can ask for "storage" instead of the Persian title.
+SPEC_ATTRIBUTE_ALIASES = {
+    "حافظه داخلی": "storage",
+    "ظرفیت حافظه داخلی": "storage",
+    "مقدار RAM": "ram",
+    "حافظه RAM": "ram",
+    "اندازه صفحه نمایش": "screen_size",
+    "اندازه": "screen_size",
+    "اندازه بدنه": "case_size",
+    "سایز بدنه": "case_size",
+    "قطر بدنه": "case_size",
+    "سایز": "case_size",
+    "وزن": "weight",
+    "ابعاد": "dimensions",
+    "تراشه": "chip",
+    "پردازنده": "chip",
+    "سیستم عامل": "os",
+    "نسخه سیستم عامل": "os",
+    "رزولوشن عکس": "camera",
+    "دوربین‌های پشت گوشی": "camera",
+    "ظرفیت باتری": "battery",
+    "مشخصات باتری": "battery",
+    "تعداد سیم کارت": "sim",
+    "شبکه های ارتباطی": "network",
+    "جنس بدنه": "body_material",
+    "جنس بند": "strap_material",
+    "مقاوم در برابر آب": "water_resistance",
+}
+
+# English / colloquial names a user (or the agent) may use for the same keys
+ATTRIBUTE_KEYWORDS = {
+    "storage": ["storage", "حافظه", "گیگ", "گیگابایت", "ترابایت"],
+    "ram": ["ram", "رم"],
+    "screen_size": ["screen", "صفحه", "اینچ"],
+    "case_size": ["case", "size", "سایز", "میلی‌متر", "میلیمتر", "mm"],
+    "weight": ["weight", "وزن"],
+    "dimensions": ["dimension", "ابعاد"],
+    "chip": ["chip", "cpu", "تراشه", "پردازنده"],
+    "os": ["ios", "watchos", "سیستم عامل"],
+    "camera": ["camera", "دوربین", "مگاپیکسل"],
+    "battery": ["battery", "باتری", "شارژ"],
+    "sim": ["sim", "سیم"],
+    "network": ["network", "5g", "4g", "شبکه"],
+    "body_material": ["material", "جنس", "بدنه"],
+    "strap_material": ["strap", "بند"],
+    "water_resistance": ["water", "ضد آب"],
+}
+
+# Attributes shown when a prompt does not mention any specific one
+DEFAULT_ATTRIBUTES = {
+    "iphone": ["storage", "ram", "screen_size", "chip", "camera"],
+    "watch": ["case_size", "chip", "body_material", "water_resistance", "os"],
+}
+
+# unit keyword -> (canonical unit, multiplier)
+# longer keywords first so "کیلوگرم" is not read as "گرم"
+_UNITS = [
+    ("میلی‌آمپر ساعت", "mah", 1.0),
+    ("میلی آمپر ساعت", "mah", 1.0),
+    ("mah", "mah", 1.0),
+    ("ترابایت", "gb", 1024.0),
+    ("گیگابایت", "gb", 1.0),
+    ("مگابایت", "gb", 1 / 1024),
+    ("tb", "gb", 1024.0),
+    ("gb", "gb", 1.0),
+    ("mb", "gb", 1 / 1024),
+    ("مگاپیکسل", "mp", 1.0),
+    ("megapixel", "mp", 1.0),
+    ("میلی‌متر", "mm", 1.0),
+    ("میلیمتر", "mm", 1.0),
+    ("میلی متر", "mm", 1.0),
+    ("سانتی‌متر", "mm", 10.0),
+    ("mm", "mm", 1.0),
+    ("اینچ", "inch", 1.0),
+    ("inch", "inch", 1.0),
+    ("کیلوگرم", "g", 1000.0),
+    ("گرم", "g", 1.0),
+    ("kg", "g", 1000.0),
+    ("g", "g", 1.0),
+]
+
+# keywords are compared against normalized text, so store them in the same form
+ATTRIBUTE_KEYWORDS = {key: list(dict.fromkeys(normalize_text(k) for k in keywords))
+                      for key, keywords in ATTRIBUTE_KEYWORDS.items()}
+_UNITS = [(normalize_text(keyword), canonical, factor) for keyword, canonical, factor in _UNITS]
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def resolve_attribute(name: str) -> str:
+    """Map a Persian title, canonical key or keyword to the canonical attribute key."""
+    if not name:
+        return name
+    if name in SPEC_ATTRIBUTE_ALIASES:
+        return SPEC_ATTRIBUTE_ALIASES[name]
+    norm = normalize_text(name)
+    if norm in ATTRIBUTE_KEYWORDS:
+        return norm
+    for key, keywords in ATTRIBUTE_KEYWORDS.items():
+        if norm in keywords:
+            return key
+    return norm
+
+
+def normalize_spec_value(raw) -> Dict:
+    """
+    Normalize a raw spec value such as '۲۵۶ گیگابایت' or '1 ترابایت'.
+    Returns {'value_text', 'value_num', 'unit'}; value_num is converted to the
+    canonical unit (GB, mm, inch, g, MP, mAh) so range predicates compare correctly.
+    """
+    text = normalize_text(str(raw) if raw is not None else "")
+    match = _NUMBER_RE.search(text)
+    num, unit = None, None
+    if match:
+        num = float(match.group())
+        rest = text[match.end():]
+        for keyword, canonical, factor in _UNITS:
+            if re.match(rf"\s*{re.escape(keyword)}(?![a-z])", rest):
+                unit = canonical
+                num = num * factor
+                break
+    return {"value_text": text, "value_num": num, "unit": unit}
+
+
+def flatten_specifications(specs) -> List[Dict]:
+    """
+    Flatten Digikala's `specifications` structure
+    ([{"title": group, "attributes": [{"title": ..., "values": [...]}]}])
+    into one dict per attribute. Accepts the parsed list or its JSON text.
+    """
+    if not specs:
+        return []
+    if isinstance(specs, str):
+        try:
+            specs = json.loads(specs)
+        except Exception:
+            return []
+
+    rows = []
+    for group in specs if isinstance(specs, list) else []:
+        if not isinstance(group, dict):
+            continue
+        group_title = group.get("title")
+        for attr in group.get("attributes") or []:
+            title = (attr.get("title") or "").strip()
+            values = [str(v).strip() for v in (attr.get("values") or []) if str(v).strip()]
+            if not title or not values:
+                continue
+            value = "، ".join(values)
+            rows.append({
+                "group_title": group_title,
+                "title": title,
+                "attribute": resolve_attribute(title),
+                "value": value,
+                **normalize_spec_value(values[0]),
+            })
+    return rows
+
+
+def specs_to_text(specs, attributes: Optional[Iterable[str]] = None, sep: str = " | ") -> str:
+    """Compact 'title: value' text for embeddings/prompts instead of the raw JSON blob."""
+    rows = flatten_specifications(specs)
+    if attributes is not None:
+        wanted = set(attributes)
+        rows = [r for r in rows if r["attribute"] in wanted]
+    return format_attributes(rows, sep=sep)
+
+
+def format_attributes(rows: List[Dict], sep: str = " | ") -> str:
+    return sep.join(f"{r['title']}: {r['value']}" for r in rows)
+
+
+# -------------------------
+# Ingest
+# -------------------------
+def store_spec_attributes(session: Session, product_id: int, category: str, specs) -> int:
+    """Replace the attribute rows of one product. Caller commits."""
+    rows = flatten_specifications(specs)
+    session.query(SPEC_ATTRIBUTES).filter(SPEC_ATTRIBUTES.product_id == product_id).delete(synchronize_session=False)
+    session.bulk_insert_mappings(SPEC_ATTRIBUTES, [
+        {"product_id": product_id, "category": category, **r} for r in rows
+    ])
+    return len(rows)
+
+
+def backfill_spec_attributes(category: str = None) -> int:
+    """Populate spec_attributes from the JSON blobs already stored in the products table."""
+    db = SessionLocal()
+    total = 0
+    try:
+        query = db.query(PRODUCTS.product_id, PRODUCTS.category, PRODUCTS.specifications)\
+                  .filter(PRODUCTS.specifications.isnot(None))
+        if category:
+            query = query.filter(PRODUCTS.category == category)
+        for product_id, product_category, specs in query.all():
+            total += store_spec_attributes(db, product_id, product_category, specs)
+        db.commit()
+    except Exception as e:
+        logger.exception("Failed to backfill spec attributes: %s", e)
+        db.rollback()
+    finally:
+        db.close()
+    return total
+
+
+# -------------------------
+# Queries
+# -------------------------
+_NUMERIC_OPS = {
+    "=": lambda col, v: col == v,
+    "==": lambda col, v: col == v,
+    ">=": lambda col, v: col >= v,
+    "<=": lambda col, v: col <= v,
+    ">": lambda col, v: col > v,
+    "<": lambda col, v: col < v,
+}
+
+
+def find_products_by_attribute(attribute: str, op: str, value, category: str = None, limit: int = 50) -> List[Dict]:
+    """
+    Answer predicates such as ('storage', '>=', '256GB') or ('case_size', '=', 45)
+    with one indexed query. Numeric values are compared on the normalized number;
+    anything else falls back to a substring match on the normalized text.
+    Returns product dicts with title, price and the matched attribute value.
+    """
+    attribute = resolve_attribute(attribute)
+    target = normalize_spec_value(value)
+    db = SessionLocal()
+    try:
+        query = db.query(SPEC_ATTRIBUTES).filter(SPEC_ATTRIBUTES.attribute == attribute)
+        if category:
+            query = query.filter(SPEC_ATTRIBUTES.category == category)
+
+        if target["value_num"] is not None and op in _NUMERIC_OPS:
+            query = query.filter(_NUMERIC_OPS[op](SPEC_ATTRIBUTES.value_num, target["value_num"]))
+            if target["unit"]:
+                query = query.filter(SPEC_ATTRIBUTES.unit == target["unit"])
+        else:
+            query = query.filter(SPEC_ATTRIBUTES.value_text.contains(target["value_text"]))
+
+        matches = query.order_by(SPEC_ATTRIBUTES.value_num.asc()).limit(limit).all()
+    finally:
+        db.close()
+
+    products = load_products([m.product_id for m in matches])
+    results = []
+    for m in matches:
+        product = products.get(m.product_id)
+        if product:
+            results.append({**product, "attribute": m.title, "value": m.value})
+    return results
+
+
+def relevant_attributes(product_ids: List[int], query: str = "", limit: int = 6) -> Dict[int, List[Dict]]:
+    """
+    For each product return only the attributes the query talks about, falling back
+    to a short per-category default list. Keeps prompts small instead of pasting
+    the whole specification blob.
+    """
+    if not product_ids:
+        return {}
+    norm_query = normalize_text(query)
+    mentioned = {
+        key for key, keywords in ATTRIBUTE_KEYWORDS.items()
+        if any(mentions_keyword(norm_query, k) for k in keywords)
+    }
+
+    db = SessionLocal()
+    try:
+        rows = db.query(SPEC_ATTRIBUTES).filter(SPEC_ATTRIBUTES.product_id.in_(list(product_ids))).all()
+    finally:
+        db.close()
+
+    by_product: Dict[int, List[Dict]] = {}
+    for r in rows:
+        by_product.setdefault(r.product_id, []).append({
+            "attribute": r.attribute, "title": r.title, "value": r.value, "category": r.category,
+        })
+
+    out = {}
+    for pid, attrs in by_product.items():
+        category = attrs[0]["category"]
+        wanted = mentioned or set(DEFAULT_ATTRIBUTES.get(category, []))
+        selected = [a for a in attrs if a["attribute"] in wanted or mentions_keyword(norm_query, normalize_text(a["title"]))]
+        out[pid] = selected[:limit]
+    return out
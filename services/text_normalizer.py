@@ -0,0 +1,156 @@
+# services/text_normalizer.py
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+# -------------------------
+# Character tables
+# -------------------------
+_ZERO_WIDTH = "\u200b\u200d\u200e\u200f\ufeff"
+_DIACRITICS = "".join(chr(c) for c in range(0x064B, 0x0660)) + "\u0670"
+
+# Display-safe canonical forms: Arabic ي/ى/ك -> Persian ی/ک, Persian/Arabic digits
+# -> ASCII, diacritics, tatweel and invisible marks dropped. ZWNJ is kept.
+_CHARS = str.maketrans({
+    **{d: str(i) for i, d in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+    **{d: str(i) for i, d in enumerate("٠١٢٣٤٥٦٧٨٩")},
+    "ي": "ی", "ى": "ی", "ك": "ک",
+    "٫": ".", "٬": "", "ـ": "",
+    "\u00a0": " ",
+    **{c: "" for c in _ZERO_WIDTH + _DIACRITICS},
+})
+# Matching form additionally folds hamza/ta-marbuta variants and joins
+# ZWNJ-separated parts ("رنگ‌های" == "رنگهای")
+_MATCH = str.maketrans({
+    "أ": "ا", "إ": "ا", "ٱ": "ا", "ؤ": "و", "ئ": "ی", "ة": "ه", "ۀ": "ه",
+    "\u200c": "",
+})
+
+_TOKEN_RE = re.compile(r"\d+|[^\W\d_]+")
+# horizontal whitespace only, so line breaks in reviews and specs survive
+_SPACES_RE = re.compile(r"[^\S\n]+")
+
+# -------------------------
+# Synonyms
+# -------------------------
+# colloquial / transliterated model words -> the word used in Digikala titles
+MODEL_SYNONYMS = {
+    "سری": "series", "پرو": "pro", "مکس": "max", "پلاس": "plus", "مینی": "mini",
+    "الترا": "ultra", "اولترا": "ultra", "آلترا": "ultra",
+    "آیفون": "iphone", "ایفون": "iphone", "واچ": "watch", "اپل": "apple",
+    # written as one word, especially once ZWNJ is joined
+    "پرومکس": "pro max", "promax": "pro max",
+}
+
+# canonical Persian color -> other ways users and Digikala write it
+COLOR_SYNONYMS = {
+    "مشکی": ["black", "سیاه", "مشگی", "midnight", "میدنایت", "jet black"],
+    "سفید": ["white", "استارلایت", "starlight"],
+    "طوسی": ["gray", "grey", "خاکستری", "نوک مدادی", "space gray", "graphite", "گرافیت"],
+    "نقره ای": ["silver", "نقره‌ای", "نقرهای"],
+    "طلایی": ["gold", "طلائی"],
+    "آبی": ["blue", "sierra blue", "pacific blue"],
+    "سرمه ای": ["navy", "سرمه‌ای", "سرمهای"],
+    "قرمز": ["red", "product red"],
+    "صورتی": ["pink", "رز", "rose"],
+    "بنفش": ["purple", "deep purple", "یاسی"],
+    "سبز": ["green", "alpine green", "mint"],
+    "زرد": ["yellow"],
+    "نارنجی": ["orange"],
+    "بژ": ["beige", "کرم", "cream"],
+    "تیتانیوم": ["titanium", "natural titanium", "تیتانیوم طبیعی"],
+}
+
+
+# -------------------------
+# Normalization
+# -------------------------
+def normalize_chars(text: str) -> str:
+    """
+    Canonical character forms, safe to store and display: ي/ك -> ی/ک, Persian and
+    Arabic digits -> 0-9, no diacritics or invisible marks, single spaces.
+    Case, ZWNJ and line breaks are preserved. Used at ingest.
+    """
+    if not text:
+        return ""
+    return _SPACES_RE.sub(" ", text.translate(_CHARS)).replace(" \n", "\n").replace("\n ", "\n").strip()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Matching form for queries, keyword indexes and cache keys: normalize_chars
+    plus lowercase and ZWNJ joined, so "آيفون ۱۵" == "آیفون 15" and
+    "رنگ‌های" == "رنگهای".
+    """
+    if not text:
+        return ""
+    return " ".join(text.translate(_CHARS).translate(_MATCH).lower().split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized tokens with model synonyms applied; digits split from letters ('45mm' -> '45', 'mm')."""
+    tokens = []
+    for t in _TOKEN_RE.findall(normalize_text(text)):
+        synonym = MODEL_SYNONYMS.get(t)
+        if synonym is None:
+            tokens.append(t)
+        else:
+            tokens.extend(synonym.split())
+    return tokens
+
+
+def mentions_keyword(text: str, keyword: str) -> bool:
+    """Whole-word match, so 'رم' does not fire inside 'گرم' and 'آب' not inside 'آبی'."""
+    return bool(keyword) and re.search(rf"(?<!\w){re.escape(keyword)}(?!\w)", text) is not None
+
+
+# -------------------------
+# Colors
+# -------------------------
+_COLOR_LOOKUP = {}
+for _canonical, _variants in COLOR_SYNONYMS.items():
+    for _name in [_canonical, *_variants]:
+        _COLOR_LOOKUP[normalize_text(_name)] = normalize_text(_canonical)
+# longest names first so "space gray" wins over "gray"
+_COLOR_NAMES = sorted(_COLOR_LOOKUP, key=len, reverse=True)
+
+
+@lru_cache(maxsize=4096)
+def canonical_color(color: str) -> Optional[str]:
+    """Canonical Persian color for any spelling ('Black', 'سیاه', 'مشگی' -> 'مشکی'), or None."""
+    norm = normalize_text(color)
+    if norm in _COLOR_LOOKUP:
+        return _COLOR_LOOKUP[norm]
+    for name in _COLOR_NAMES:
+        if mentions_keyword(norm, name):
+            return _COLOR_LOOKUP[name]
+    return None
+
+
+def color_names(color: str) -> List[str]:
+    """Stored spellings to look for when filtering by `color` in SQL: the color itself plus its synonyms."""
+    names = [normalize_chars(color)]
+    canonical = canonical_color(color)
+    if canonical:
+        for name, target in _COLOR_LOOKUP.items():
+            if target == canonical:
+                names.append(name)
+        names.extend(n for n in [canonical, *COLOR_SYNONYMS.get(canonical, [])])
+    return list(dict.fromkeys(n for n in names if n))
+
+
+def color_matches(wanted: str, colors: Iterable[str]) -> bool:
+    """True if any of `colors` is the wanted color under normalization and color synonyms."""
+    if not wanted:
+        return True
+    wanted_norm = normalize_text(wanted)
+    wanted_canonical = canonical_color(wanted)
+    for color in colors or []:
+        if not isinstance(color, str):
+            continue
+        norm = normalize_text(color)
+        if wanted_norm and wanted_norm in norm:
+            return True
+        if wanted_canonical and canonical_color(color) == wanted_canonical:
+            return True
+    return False
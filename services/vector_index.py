@@ -0,0 +1,242 @@
+# services/vector_index.py
+import os
+import json
+import time
+import pickle
+import logging
+from typing import List, Dict, Optional
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from services.embedding_backends import describe_embeddings
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Build-time settings
+# -------------------------
+# flat | ivf_flat | ivf_pq | hnsw
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "1024"))              # IVF coarse clusters
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))                  # PQ sub-quantizers (must divide dim)
+FAISS_PQ_BITS = int(os.getenv("FAISS_PQ_BITS", "8"))             # bits per PQ code
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))              # HNSW graph degree
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "200"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))  # vectors used to train IVF/PQ
+
+# -------------------------
+# Query-time settings
+# -------------------------
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# Memory-map persisted indexes read-only: vectors stay in the OS page cache and
+# every worker process maps the same pages instead of holding a private copy
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
+
+# faiss wants ~39 training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+# written next to index.faiss / index.pkl; records which embedding backend built the index
+MANIFEST_FILE = "manifest.json"
+
+
+class IndexMismatchError(RuntimeError):
+    """The persisted index was built with a different embedding backend or model than the one configured."""
+
+
+def create_index(dim: int, n_vectors: int, index_type: str = None) -> faiss.Index:
+    """
+    Create an (untrained) FAISS index of the requested type, scaled down when the
+    catalog is too small to train it; falls back to an exact flat index.
+    """
+    index_type = (index_type or FAISS_INDEX_TYPE).lower()
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M)
+        index.hnsw.efConstruction = FAISS_EF_CONSTRUCTION
+        return index
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = min(FAISS_NLIST, n_vectors // _MIN_POINTS_PER_CENTROID)
+        if nlist < 2:
+            logger.warning("Only %d vectors; too few to train %s, using a flat index", n_vectors, index_type)
+            return faiss.IndexFlatL2(dim)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+
+        if dim % FAISS_PQ_M != 0:
+            raise ValueError(f"FAISS_PQ_M={FAISS_PQ_M} must divide the embedding dimension {dim}")
+        # each PQ codebook has 2**bits centroids that also need training points
+        bits = FAISS_PQ_BITS
+        while bits > 4 and n_vectors < (2 ** bits) * _MIN_POINTS_PER_CENTROID:
+            bits -= 1
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, FAISS_PQ_M, bits)
+
+    return faiss.IndexFlatL2(dim)
+
+
+def train_and_add(index: faiss.Index, vectors: np.ndarray, seed: int = 0) -> faiss.Index:
+    """Train on a random sample (IVF/PQ only), then add all vectors."""
+    if not index.is_trained:
+        n_train = min(len(vectors), FAISS_TRAIN_SAMPLE)
+        sample = vectors[np.random.default_rng(seed).choice(len(vectors), n_train, replace=False)]
+        started = time.perf_counter()
+        index.train(sample)
+        logger.info("Trained %s on %d vectors in %.1fs", type(index).__name__, n_train, time.perf_counter() - started)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index: faiss.Index, nprobe: int = None, ef_search: int = None):
+    """Apply query-time knobs (nprobe for IVF, efSearch for HNSW); no-op for flat indexes."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or FAISS_NPROBE, ivf.nlist)
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search or FAISS_EF_SEARCH
+
+
+def read_index(path: str, mmap: bool = None) -> faiss.Index:
+    """Read a persisted index, memory-mapped read-only when `mmap` (default FAISS_MMAP)."""
+    mmap = FAISS_MMAP if mmap is None else mmap
+    if not mmap:
+        return faiss.read_index(path)
+    # IO_FLAG_MMAP maps IVF inverted lists; IO_FLAG_MMAP_IFC (faiss >= 1.8) maps flat/HNSW vector storage
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    return faiss.read_index(path, flags)
+
+
+# -------------------------
+# Manifest
+# -------------------------
+def save_vector_store(vector_store: FAISS, folder: str, embeddings=None):
+    """`save_local` plus a manifest naming the embedding backend, model and dimension."""
+    vector_store.save_local(folder)
+    manifest = {
+        **describe_embeddings(embeddings or vector_store.embedding_function),
+        "index_type": type(vector_store.index).__name__,
+        "dim": vector_store.index.d,
+        "vectors": vector_store.index.ntotal,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(folder, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def check_manifest(folder: str, embeddings):
+    """
+    Raise IndexMismatchError if the index in `folder` was not built with the same
+    embedding backend and model as `embeddings`; its vectors would be meaningless
+    to queries embedded by another model. Indexes from before manifests existed
+    were built with OpenAI and are accepted only by the OpenAI backend.
+    """
+    expected = describe_embeddings(embeddings)
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        if expected["backend"] != "openai":
+            raise IndexMismatchError(
+                f"{folder} has no {MANIFEST_FILE} (built with OpenAI embeddings) but EMBEDDING_BACKEND="
+                f"{expected['backend']}; rebuild it with scripts/build_vector_db.py")
+        logger.warning("%s has no %s; assuming it was built with OpenAI embeddings", folder, MANIFEST_FILE)
+        return
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    mismatched = {k: (manifest.get(k), v) for k, v in expected.items() if manifest.get(k) != v}
+    if mismatched:
+        details = ", ".join(f"{k}: index={built!r} configured={now!r}" for k, (built, now) in mismatched.items())
+        raise IndexMismatchError(f"{folder} was built with a different embedding setup ({details}); "
+                                 f"rebuild it with scripts/build_vector_db.py")
+
+
+def load_vector_store(folder: str, embeddings, mmap: bool = None, index_name: str = "index") -> FAISS:
+    """
+    Load a store written by `FAISS.save_local`, like `FAISS.load_local` but with
+    an optionally memory-mapped index. A mapped index is read-only; rebuild it
+    with build_vector_db.py instead of adding to it at runtime. Refuses indexes
+    whose manifest names another embedding backend (IndexMismatchError).
+    """
+    check_manifest(folder, embeddings)
+    index = read_index(os.path.join(folder, f"{index_name}.faiss"), mmap)
+    # the pickle is written by our own build script
+    with open(os.path.join(folder, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def build_vector_store(documents, embeddings, index_type: str = None, evaluate: bool = False) -> FAISS:
+    """
+    Drop-in replacement for `FAISS.from_documents` that builds the configured index
+    type. Returns a LangChain FAISS store that saves/loads like the flat one.
+    """
+    texts = [d.page_content for d in documents]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype="float32")
+    index = create_index(vectors.shape[1], len(vectors), index_type)
+    train_and_add(index, vectors)
+    set_search_params(index)
+
+    if evaluate and not isinstance(index, faiss.IndexFlat):
+        for row in evaluate_recall(index, vectors):
+            print("🔎 {setting}: recall@{k}={recall:.3f}  {ann_ms:.3f} ms/query (exact {exact_ms:.3f} ms/query)".format(**row))
+
+    ids = [str(i) for i in range(len(documents))]
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+
+
+def evaluate_recall(index: faiss.Index, vectors: np.ndarray, queries: Optional[np.ndarray] = None,
+                    k: int = 10, n_queries: int = 200, settings: List[int] = None) -> List[Dict]:
+    """
+    Recall@k and latency of an approximate index against exact search over the same
+    vectors, for a sweep of nprobe (IVF) or efSearch (HNSW) values. Queries default to
+    a random sample of the indexed vectors.
+    """
+    if queries is None:
+        sample = np.random.default_rng(1).choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+        queries = vectors[sample]
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    started = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    is_hnsw = getattr(index, "hnsw", None) is not None
+    if settings is None:
+        settings = [1, 4, 8, 16, 32, 64, 128] if ivf is not None else [16, 32, 64, 128, 256]
+
+    rows = []
+    for value in settings:
+        if ivf is not None:
+            if value > ivf.nlist:
+                continue
+            set_search_params(index, nprobe=value)
+            label = f"nprobe={value}"
+        elif is_hnsw:
+            set_search_params(index, ef_search=value)
+            label = f"efSearch={value}"
+        else:
+            label = "flat"
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        ann_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        rows.append({"setting": label, "k": k, "recall": hits / truth.size, "ann_ms": ann_ms, "exact_ms": exact_ms})
+        if label == "flat":
+            break
+
+    set_search_params(index)  # restore configured defaults
+    return rows
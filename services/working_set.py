@@ -0,0 +1,293 @@
+# services/working_set.py
+# Per-session working set of the products the agent has already retrieved.
+# RAGTool records its structured results here; follow-up turns ("the second one",
+# "compare the first two", "the 15 Pro in white") are resolved against them by
+# compare_products / filter_products without another retrieval and embedding call.
+# Each process keeps an LRU of recent sessions; the set is also written to
+# `sessions.working_set` so a turn served by another worker sees the same products.
+import os
+import re
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+from services.text_normalizer import normalize_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Products remembered per session (oldest dropped first)
+WORKING_SET_SIZE = int(os.getenv("WORKING_SET_SIZE", "20"))
+# Sessions kept in each process's memory
+WORKING_SET_SESSIONS = int(os.getenv("WORKING_SET_SESSIONS", "5000"))
+# Reviews kept per remembered product
+WORKING_SET_REVIEWS = int(os.getenv("WORKING_SET_REVIEWS", "10"))
+# Set to 0 to keep the working set in process memory only
+WORKING_SET_PERSIST = os.getenv("WORKING_SET_PERSIST", "1") == "1"
+
+# Session of the agent run in progress, set by the API around the agent call
+current_session: ContextVar[Optional[str]] = ContextVar("current_session", default=None)
+
+
+@contextmanager
+def session_scope(session_id: str):
+    """
+    Make `session_id` the current session for the tools called inside the block.
+    With persistence on, the session's set is re-read once per turn, since the
+    previous turn may have been served by another worker.
+    """
+    if working_set.persist:
+        working_set.drop_cached(session_id)
+    token = current_session.set(session_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+
+# -------------------------
+# References
+# -------------------------
+# positions as users write them: "دومی", "سومین", "second", "2"
+_ORDINALS = {
+    "اول": 1, "اولی": 1, "اولین": 1, "یکمی": 1, "first": 1,
+    "دوم": 2, "دومی": 2, "دومین": 2, "second": 2,
+    "سوم": 3, "سومی": 3, "سومین": 3, "third": 3,
+    "چهارم": 4, "چهارمی": 4, "چهارمین": 4, "fourth": 4,
+    "پنجم": 5, "پنجمی": 5, "پنجمین": 5, "fifth": 5,
+    "آخر": -1, "آخری": -1, "آخرین": -1, "last": -1,
+}
+_NUMBER_RE = re.compile(r"^#?(\d{1,2})$")
+
+
+def _position(ref: str) -> Optional[int]:
+    """1-based position (-1 for the last one) named by a short reference, else None."""
+    tokens = normalize_text(ref).split()
+    if len(tokens) > 3:
+        return None
+    for token in tokens:
+        if token in _ORDINALS:
+            return _ORDINALS[token]
+        m = _NUMBER_RE.match(token)
+        if m and len(tokens) == 1:
+            return int(m.group(1))
+    return None
+
+
+def _product_key(product: Dict) -> str:
+    source = product.get("source") or {}
+    pid = source.get("product_id") if isinstance(source, dict) else None
+    return f"id:{pid}" if pid else f"title:{normalize_text(product.get('title'))}"
+
+
+def _compact(product: Dict) -> Dict:
+    """What a follow-up needs from a product, with the review list capped."""
+    reviews = product.get("reviews") or []
+    if isinstance(reviews, list):
+        reviews = reviews[:WORKING_SET_REVIEWS]
+    return {
+        "title": product.get("title"),
+        "price": product.get("price"),
+        "colors": product.get("colors") or [],
+        "specs": product.get("specs") or "",
+        "reviews": reviews,
+        "source": product.get("source") or {},
+    }
+
+
+# -------------------------
+# Working set
+# -------------------------
+class _Entry:
+    __slots__ = ("products", "last_results")
+
+    def __init__(self, products: "OrderedDict[str, Dict]" = None, last_results: List[str] = None):
+        self.products = products if products is not None else OrderedDict()  # key -> product, oldest first
+        self.last_results = last_results or []                               # keys of the latest result list, in order
+
+    def to_json(self) -> str:
+        return json.dumps({"products": list(self.products.values()), "last_results": self.last_results},
+                          ensure_ascii=False, default=str)
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "_Entry":
+        if not raw:
+            return cls()
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return cls()
+        products = OrderedDict((_product_key(p), p) for p in data.get("products") or [])
+        return cls(products, [k for k in data.get("last_results") or [] if k in products])
+
+
+class WorkingSet:
+    """
+    Bounded per-session product memory: the last WORKING_SET_SIZE distinct
+    products a session's searches returned, and the order of the latest list
+    (what "the second one" refers to). Thread-safe.
+    """
+
+    def __init__(self, size: int = None, max_sessions: int = None, persist: bool = None):
+        self.size = size or WORKING_SET_SIZE
+        self.max_sessions = max_sessions or WORKING_SET_SESSIONS
+        self.persist = WORKING_SET_PERSIST if persist is None else persist
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.stats = {"remembered": 0, "hits": 0, "misses": 0, "loads": 0}
+
+    # ---- storage ----
+    def _entry(self, session_id: str) -> _Entry:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                return entry
+        entry = self._load(session_id)
+        with self._lock:
+            entry = self._sessions.setdefault(session_id, entry)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return entry
+
+    def _load(self, session_id: str) -> _Entry:
+        if not self.persist:
+            return _Entry()
+        try:
+            from services.manage_sessions import SessionLocal
+            from models.model import Session
+            db = SessionLocal()
+            try:
+                raw = db.query(Session.working_set).filter(Session.session_id == session_id).scalar()
+            finally:
+                db.close()
+            self.stats["loads"] += 1
+            return _Entry.from_json(raw)
+        except Exception as e:
+            logger.warning("Could not load the working set of session %s: %s", session_id, e)
+            return _Entry()
+
+    def _save(self, session_id: str, raw: str):
+        if not self.persist:
+            return
+        try:
+            from services.manage_sessions import SessionLocal
+            from models.model import Session
+            db = SessionLocal()
+            try:
+                db.query(Session).filter(Session.session_id == session_id).update(
+                    {"working_set": raw}, synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning("Could not save the working set of session %s: %s", session_id, e)
+
+    # ---- API ----
+    def remember(self, session_id: Optional[str], products: List[Dict]):
+        """Record a result list of the session; it becomes what positions refer to."""
+        products = [p for p in products or [] if isinstance(p, dict) and p.get("title")]
+        if not session_id or not products:
+            return
+        entry = self._entry(session_id)
+        with self._lock:
+            keys = []
+            for p in products:
+                key = _product_key(p)
+                entry.products.pop(key, None)
+                entry.products[key] = _compact(p)
+                if key not in keys:
+                    keys.append(key)
+            while len(entry.products) > self.size:
+                entry.products.popitem(last=False)
+            entry.last_results = [k for k in keys if k in entry.products]
+            self.stats["remembered"] += len(keys)
+            raw = entry.to_json()
+        self._save(session_id, raw)
+
+    def products(self, session_id: Optional[str]) -> List[Dict]:
+        """The latest result list of the session (empty if nothing was retrieved yet)."""
+        if not session_id:
+            return []
+        entry = self._entry(session_id)
+        with self._lock:
+            return [dict(entry.products[k]) for k in entry.last_results]
+
+    def resolve(self, session_id: Optional[str], ref: Union[str, int, Dict, None]) -> Optional[Dict]:
+        """
+        The remembered product `ref` points at: a position in the latest list
+        (2, "دومی", "last"), a product_id, or (part of) a title. None if it is not
+        in the working set, in which case the caller searches.
+        """
+        product = self._resolve(session_id, ref)
+        with self._lock:
+            self.stats["hits" if product else "misses"] += 1
+        return product
+
+    def _resolve(self, session_id: Optional[str], ref) -> Optional[Dict]:
+        if not session_id or ref is None or ref == "":
+            return None
+        entry = self._entry(session_id)
+        with self._lock:
+            latest = [entry.products[k] for k in entry.last_results]
+            everything = list(reversed(entry.products.values()))  # newest first
+
+            if isinstance(ref, dict):
+                key = _product_key(ref)
+                return dict(entry.products[key]) if key in entry.products else None
+
+            if isinstance(ref, int) or str(ref).strip().isdigit():
+                # small numbers are positions, anything else a product_id
+                n = int(ref)
+                if 1 <= n <= len(latest):
+                    return dict(latest[n - 1])
+                key = f"id:{n}"
+                return dict(entry.products[key]) if key in entry.products else None
+
+            pos = _position(str(ref))
+            if pos is not None:
+                if pos == -1 and latest:
+                    return dict(latest[-1])
+                return dict(latest[pos - 1]) if 1 <= pos <= len(latest) else None
+
+            # title match: every token of the reference appears in the title
+            wanted = set(tokenize(str(ref)))
+            if not wanted:
+                return None
+            best, best_extra = None, None
+            for p in everything:
+                have = set(tokenize(p.get("title") or ""))
+                if wanted <= have:
+                    extra = len(have - wanted)  # prefer the most specific match
+                    if best is None or extra < best_extra:
+                        best, best_extra = p, extra
+            return dict(best) if best else None
+
+    def drop_cached(self, session_id: str):
+        """Forget this process's copy; the next access reloads it from the database."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self._save(session_id, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "sessions_cached": len(self._sessions),
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+working_set = WorkingSet()
+
+
+def get_working_set_stats() -> Dict:
+    return working_set.get_stats()